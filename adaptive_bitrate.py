@@ -0,0 +1,283 @@
+"""
+Адаптация битрейта и разрешения для WebRTC зрителей на слабых каналах.
+
+Каждый зритель читает одну ступень лестницы рендиций (общие SharedEncodedTrack
+из реестра источников, одна на ступень для всех зрителей на ней). Контроллер
+пира смотрит на RTCP обратную связь его sender'а - потери из Receiver Report и
+оценку канала из REMB - и переводит зрителя на ступень ниже при перегрузке или
+выше после устойчиво чистого канала. Переключение происходит на ключевом кадре
+новой ступени, до него зритель продолжает получать старую.
+
+aiortc не согласует transport-cc, поэтому обратная связь - RR и REMB.
+"""
+import asyncio
+import logging
+import time
+
+import av # type: ignore
+from aiortc import MediaStreamTrack # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+from aiortc.rtp import RTCP_PSFB_APP, RtcpPsfbPacket, RtcpRrPacket, RtcpSrPacket, unpack_remb_fci # type: ignore
+
+from media_sources import mask_credentials
+from shared_encoder import EncodingParams
+
+logger = logging.getLogger(__name__)
+
+# Ступени от лучшей к худшей: (высота или None - разрешение камеры, битрейт бит/с)
+ADAPTIVE_LADDER = (
+    (None, 2_500_000),
+    (720, 1_500_000),
+    (480, 800_000),
+    (360, 450_000),
+    (240, 200_000),
+)
+ADAPT_INTERVAL = 1.0              # Как часто принимать решение (сек)
+ADAPT_SETTLE = 2.0                # После переключения ждем свежую обратную связь (сек)
+ADAPT_LOSS_DOWN = 0.10            # Потери выше 10% - ступень вниз
+ADAPT_LOSS_UP = 0.02              # Вверх только при потерях не выше 2%
+ADAPT_REMB_DOWN_RATIO = 0.8       # REMB ниже 80% битрейта ступени - ступень вниз
+ADAPT_UP_HOLD = 5.0               # Сколько секунд канал должен быть чистым перед шагом вверх
+ADAPT_UP_HOLD_MAX = 60.0          # Потолок удвоения после неудачных попыток вверх
+ADAPT_FAILED_UP_WINDOW = 10.0     # Перегрузка в течение этого времени после шага вверх - попытка неудачна
+ADAPT_LOSS_EWMA_ALPHA = 0.5
+ADAPT_KEYFRAME_RETRY = 0.5        # Повторить запрос ключевого кадра новой ступени, если его нет (сек)
+
+
+def build_ladder(codec, ladder=ADAPTIVE_LADDER):
+    """Ступени EncodingParams для кодека; ширина берется по пропорциям камеры."""
+    return [EncodingParams(codec, None, height, bitrate) for height, bitrate in ladder]
+
+
+class AdaptiveController:
+    """Решения по ступени для одного пира: 0 - лучшая ступень, last - худшая."""
+
+    def __init__(self, ladder, rung=0):
+        self.ladder = ladder
+        self.rung = rung
+        self.loss = 0.0
+        self.jitter = None
+        self.remb = None
+        self.up_hold = ADAPT_UP_HOLD
+        self._clean_since = None
+        self._last_switch_at = time.monotonic()
+        self._last_up_at = None
+
+    def on_receiver_report(self, fraction_lost, jitter):
+        loss = fraction_lost / 256.0
+        self.loss += ADAPT_LOSS_EWMA_ALPHA * (loss - self.loss)
+        self.jitter = jitter
+
+    def on_remb(self, bitrate):
+        self.remb = bitrate
+
+    def _congested(self, bitrate):
+        return self.loss > ADAPT_LOSS_DOWN or (
+            self.remb is not None and self.remb < bitrate * ADAPT_REMB_DOWN_RATIO)
+
+    def decide(self, now):
+        """Номер новой ступени или None, если остаемся."""
+        if now - self._last_switch_at < ADAPT_SETTLE:
+            return None
+        last = len(self.ladder) - 1
+        if self._congested(self.ladder[self.rung].bitrate):
+            self._clean_since = None
+            if self.rung == last:
+                return None
+            if self._last_up_at is not None and now - self._last_up_at < ADAPT_FAILED_UP_WINDOW:
+                self.up_hold = min(self.up_hold * 2, ADAPT_UP_HOLD_MAX)
+            # По REMB можно сразу спуститься на ступень, которая пролезает в канал
+            target = self.rung + 1
+            while self.remb is not None and target < last and \
+                    self.remb < self.ladder[target].bitrate * ADAPT_REMB_DOWN_RATIO:
+                target += 1
+            return self._switch(target, now)
+        if self.rung == 0 or self.loss > ADAPT_LOSS_UP or (
+                self.remb is not None and self.remb < self.ladder[self.rung].bitrate):
+            self._clean_since = None
+            return None
+        if self._clean_since is None:
+            self._clean_since = now
+        if now - self._clean_since < self.up_hold:
+            return None
+        self._last_up_at = now
+        return self._switch(self.rung - 1, now)
+
+    def _switch(self, rung, now):
+        self.rung = rung
+        self._clean_since = None
+        self._last_switch_at = now
+        return rung
+
+    def cancel_switch(self, rung):
+        """Ступень не открылась: остаемся на rung, следующее решение - через ADAPT_SETTLE."""
+        self.rung = rung
+        self._last_up_at = None
+
+
+def _retimed(packet, pts):
+    """Копия пакета с другим pts: пакет рендиции общий для всех ее зрителей через MediaRelay."""
+    copy = av.Packet(bytes(packet))
+    copy.pts = copy.dts = pts
+    copy.time_base = packet.time_base
+    copy.is_keyframe = packet.is_keyframe
+    return copy
+
+
+class AdaptiveVideoTrack(MediaStreamTrack):
+    """
+    Трек одного пира поверх подписок на рендиции. Владеет подписками: stop()
+    возвращает их в реестр.
+    """
+    kind = "video"
+
+    def __init__(self, registry, subscription, ladder):
+        super().__init__()
+        self._registry = registry
+        self._current = subscription
+        self._next = None
+        self._next_requested_at = None
+        self._current_recv = None
+        self._next_recv = None
+        self.controller = AdaptiveController(ladder, ladder.index(subscription.rendition.params))
+        self._sender = None
+        self._task = asyncio.ensure_future(self._run())
+        self.switches = 0
+        self.frames_sent = 0
+        self._last_pts = None
+
+    @property
+    def url(self):
+        return self._current.url
+
+    def attach_sender(self, sender):
+        """Подключает RTCP обратную связь и PLI sender'а этого пира."""
+        self._sender = sender
+        handle_rtcp_packet = sender._handle_rtcp_packet
+
+        async def on_rtcp_packet(packet):
+            self._on_rtcp_packet(packet)
+            await handle_rtcp_packet(packet)
+
+        sender._handle_rtcp_packet = on_rtcp_packet
+        # aiortc игнорирует PLI для готовых пакетов; передаем запрос рендиции
+        sender._send_keyframe = self.request_keyframe
+
+    def _on_rtcp_packet(self, packet):
+        ssrc = self._sender._ssrc
+        if isinstance(packet, (RtcpRrPacket, RtcpSrPacket)):
+            for report in packet.reports:
+                if report.ssrc == ssrc:
+                    self.controller.on_receiver_report(report.fraction_lost, report.jitter)
+        elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+            try:
+                bitrate, ssrcs = unpack_remb_fci(packet.fci)
+            except ValueError:
+                return
+            if ssrc in ssrcs:
+                self.controller.on_remb(bitrate)
+
+    def relay_tracks(self):
+        """Прокси MediaRelay, которые сейчас держит этот трек (для учета памяти сессии)."""
+        return [s.track for s in (self._current, self._next) if s is not None]
+
+    def request_keyframe(self):
+        self._current.request_keyframe()
+        if self._next is not None:
+            self._next.request_keyframe()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ADAPT_INTERVAL)
+            if self._next is not None:
+                continue
+            rung = self.controller.decide(time.monotonic())
+            if rung is not None:
+                await self._switch(rung)
+
+    async def _switch(self, rung):
+        params = self.controller.ladder[rung]
+        try:
+            subscription = await self._registry.acquire(self.url, encoding=params)
+        except Exception as e:
+            # Камера недоступна или рендиция не запустилась: задача контроллера должна жить дальше
+            self.controller.cancel_switch(self.controller.ladder.index(self._current.rendition.params))
+            logger.warning(f"Адаптация {mask_credentials(self.url)}: ступень {rung} не открылась "
+                           f"({type(e).__name__}: {e}), остаемся на текущей")
+            return
+        if self.readyState != "live":
+            self._registry.release(subscription)
+            return
+        self.switches += 1
+        logger.info(f"Адаптация {mask_credentials(self.url)}: ступень {rung} ({params.height or 'native'}p, {params.bitrate} бит/с), "
+                    f"потери {self.controller.loss:.1%}, REMB {self.controller.remb}")
+        self._next = subscription
+        self._next_requested_at = time.monotonic()
+        subscription.request_keyframe()
+
+    async def recv(self):
+        packet = await self._recv_packet()
+        self.frames_sent += 1
+        self._last_pts = packet.pts
+        return packet
+
+    async def _recv_packet(self):
+        while True:
+            if self.readyState != "live":
+                raise MediaStreamError
+            if self._next is None:
+                return await self._current.track.recv()
+            # Переключение: старая ступень идет до ключевого кадра новой
+            if self._current_recv is None:
+                self._current_recv = asyncio.ensure_future(self._current.track.recv())
+            if self._next_recv is None:
+                self._next_recv = asyncio.ensure_future(self._next.track.recv())
+            await asyncio.wait((self._current_recv, self._next_recv), return_when=asyncio.FIRST_COMPLETED)
+            if self._next_recv.done():
+                packet, self._next_recv = self._next_recv.result(), None
+                if packet.is_keyframe:
+                    previous, self._current, self._next = self._current, self._next, None
+                    if self._current_recv is not None:
+                        self._current_recv.cancel()
+                        self._current_recv = None
+                    self._registry.release(previous)
+                    if packet.pts is not None and self._last_pts is not None and packet.pts <= self._last_pts:
+                        # Этот кадр камеры уже ушел со старой ступени: с той же меткой RTP приемник
+                        # склеил бы два кадра в один и не декодировал бы ничего до следующего ключевого
+                        packet = _retimed(packet, self._last_pts + 1)
+                    return packet
+                if time.monotonic() - self._next_requested_at > ADAPT_KEYFRAME_RETRY:
+                    self._next_requested_at = time.monotonic()
+                    self._next.request_keyframe()
+                continue
+            packet, self._current_recv = self._current_recv.result(), None
+            return packet
+
+    def stop(self):
+        if self.readyState != "live":
+            return
+        super().stop()
+        self._task.cancel()
+        for pending in (self._current_recv, self._next_recv):
+            if pending is not None:
+                pending.cancel()
+        self._current_recv = self._next_recv = None
+        for subscription in (self._current, self._next):
+            if subscription is not None:
+                self._registry.release(subscription)
+        self._next = None
+
+    def as_dict(self):
+        rung = self.controller.ladder[self.controller.rung]
+        return {
+            "url": mask_credentials(self.url),
+            "rung": self.controller.rung,
+            "height": rung.height,
+            "bitrate": rung.bitrate,
+            "switching": self._next is not None,
+            "switches": self.switches,
+            "loss": round(self.controller.loss, 4),
+            "jitter": self.controller.jitter,
+            "remb": self.controller.remb,
+            "up_hold_s": self.controller.up_hold,
+        }
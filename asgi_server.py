@@ -0,0 +1,272 @@
+"""
+Минимальное ASGI приложение для эндпоинтов, которые должны жить в background_loop
+рядом с RTCPeerConnection: сигнализация WebRTC по WebSocket и, в режиме ASGI
+сервера, весь HTTP API со статикой. uvicorn запускается задачей в уже
+работающем loop, отдельный поток или процесс не нужен.
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+from urllib.parse import parse_qs
+
+import uvicorn # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class WebSocketClosed(Exception):
+    """Клиент закрыл WebSocket."""
+
+
+# Как Flask-CORS с настройками по умолчанию: фронтенд может открываться не с этого сервера
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+]
+
+
+class Request:
+    """HTTP запрос: метод, путь, query и тело целиком."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = {key: values[-1] for key, values in
+                      parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.body = body
+
+    @property
+    def client_host(self):
+        client = self.scope.get("client")
+        return client[0] if client else None
+
+    def json(self):
+        """Тело как JSON; ValueError, если это не JSON объект."""
+        data = json.loads(self.body or b"null")
+        if not isinstance(data, dict):
+            raise ValueError("Ожидается JSON объект")
+        return data
+
+
+class Response:
+    def __init__(self, body=b"", status=200, content_type="text/plain; charset=utf-8"):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, ensure_ascii=False), status, "application/json")
+
+
+class WebSocket:
+    """Обертка над ASGI websocket: JSON сообщения поверх receive/send."""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.closed = False
+
+    @property
+    def client(self):
+        client = self.scope.get("client")
+        return f"{client[0]}:{client[1]}" if client else "?"
+
+    @property
+    def client_host(self):
+        client = self.scope.get("client")
+        return client[0] if client else None
+
+    @property
+    def query(self):
+        return {key: values[-1] for key, values in
+                parse_qs(self.scope.get("query_string", b"").decode("latin-1")).items()}
+
+    async def accept(self):
+        message = await self._receive()
+        if message["type"] != "websocket.connect":
+            raise WebSocketClosed
+        await self._send({"type": "websocket.accept"})
+
+    async def receive(self):
+        """Следующее сообщение клиента: str для текстового кадра, bytes для бинарного; WebSocketClosed при закрытии."""
+        while True:
+            message = await self._receive()
+            if message["type"] == "websocket.disconnect":
+                self.closed = True
+                raise WebSocketClosed
+            if message["type"] != "websocket.receive":
+                continue
+            text = message.get("text")
+            return text if text is not None else (message.get("bytes") or b"")
+
+    async def receive_json(self):
+        """Следующее JSON сообщение клиента; WebSocketClosed при закрытии."""
+        data = await self.receive()
+        return json.loads(data if isinstance(data, str) else data.decode("utf-8"))
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, ensure_ascii=False))
+
+    async def send_text(self, text):
+        if self.closed:
+            raise WebSocketClosed
+        await self._send({"type": "websocket.send", "text": text})
+
+    async def send_bytes(self, data):
+        if self.closed:
+            raise WebSocketClosed
+        await self._send({"type": "websocket.send", "bytes": data})
+
+    async def close(self, code=1000):
+        if not self.closed:
+            self.closed = True
+            await self._send({"type": "websocket.close", "code": code})
+
+
+class AsgiApp:
+    """
+    Роутинг по точному пути: WebSocket эндпоинты и HTTP обработчики
+    async handler(request) -> Response, плюс каталоги статики по префиксу.
+    """
+
+    def __init__(self):
+        self._websocket_routes = {}
+        self._http_routes = {}
+        self._static_dirs = {}
+
+    def websocket(self, path):
+        def register(handler):
+            self._websocket_routes[path] = handler
+            return handler
+        return register
+
+    def route(self, path, methods=("GET",)):
+        def register(handler):
+            for method in methods:
+                self._http_routes[(method, path)] = handler
+            return handler
+        return register
+
+    def static(self, prefix, directory):
+        """Файлы directory по URL prefix/<путь>."""
+        self._static_dirs[prefix.rstrip("/") + "/"] = os.path.realpath(directory)
+
+    def _static_file(self, path):
+        for prefix, directory in self._static_dirs.items():
+            if path.startswith(prefix):
+                file_path = os.path.realpath(os.path.join(directory, path[len(prefix):]))
+                # Не выпускаем ../ за пределы каталога
+                if file_path.startswith(directory + os.sep) and os.path.isfile(file_path):
+                    return file_path
+        return None
+
+    async def _handle_http(self, scope, receive):
+        method, path = scope["method"], scope["path"]
+        if method == "OPTIONS":
+            return Response(status=204)
+        handler = self._http_routes.get((method, path))
+        if handler is not None:
+            body = b""
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return None
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            try:
+                return await handler(Request(scope, body))
+            except Exception as e:
+                logger.error(f"Ошибка обработчика {method} {path}: {e}", exc_info=True)
+                return json_response({"error": str(e)}, 500)
+        if method == "GET":
+            file_path = self._static_file(path)
+            if file_path is not None:
+                return await serve_file(file_path)
+        if any(route_path == path for _, route_path in self._http_routes):
+            return Response("Method Not Allowed", 405)
+        return Response("Not Found", 404)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            handler = self._websocket_routes.get(scope["path"])
+            if handler is None:
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            websocket = WebSocket(scope, receive, send)
+            try:
+                await handler(websocket)
+            except WebSocketClosed:
+                pass
+            finally:
+                try:
+                    await websocket.close()
+                except Exception:
+                    pass  # Соединение уже разорвано
+        elif scope["type"] == "http":
+            response = await self._handle_http(scope, receive)
+            if response is None:
+                return  # Клиент ушел, не дождавшись ответа
+            headers = [(b"content-type", response.content_type.encode("latin-1")),
+                       (b"content-length", str(len(response.body)).encode("latin-1"))] + CORS_HEADERS
+            await send({"type": "http.response.start", "status": response.status, "headers": headers})
+            await send({"type": "http.response.body", "body": response.body})
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def serve_file(path):
+    """Ответ с содержимым файла; чтение с диска в пуле потоков, чтобы не блокировать loop."""
+    loop = asyncio.get_running_loop()
+    body = await loop.run_in_executor(None, _read_file, path)
+    content_type, _ = mimetypes.guess_type(path)
+    content_type = content_type or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+        content_type += "; charset=utf-8"
+    return Response(body, 200, content_type)
+
+
+class AsgiServer:
+    """
+    uvicorn поверх текущего asyncio loop: start() и stop() вызываются из него же.
+    uds - путь Unix сокета вместо host:port (воркер супервизора); к такому сокету
+    подключается только фронт, поэтому X-Forwarded-For от него принимается как адрес клиента.
+    """
+
+    def __init__(self, app, host=None, port=None, uds=None):
+        self.host = host
+        self.port = port
+        self.uds = uds
+        options = {"uds": uds, "forwarded_allow_ips": "*"} if uds else {"host": host, "port": port}
+        self._server = uvicorn.Server(uvicorn.Config(app, lifespan="off", log_level="warning", **options))
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()  # Поднимет ошибку запуска (например, занят порт)
+                return
+            await asyncio.sleep(0.05)
+        logger.info(f"ASGI сервер слушает {self.uds or f'{self.host}:{self.port}'}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._server.should_exit = True
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        except Exception as e:
+            logger.error(f"Ошибка ASGI сервера при остановке: {e}")
+        self._task = None
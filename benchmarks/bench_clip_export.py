@@ -0,0 +1,189 @@
+"""
+Влияние выгрузки клипов и снимков (clip_buffer.py) на живую доставку пакетов.
+
+Живой источник отдает заранее закодированные H.264 пакеты в реальном времени
+через MediaRelay двум подписчикам, как в шлюзе: "зрителю", который меряет
+опоздание каждого пакета относительно расписания камеры, и ClipRecorder.
+Сначала замер без выгрузок, затем с N клиентами, которые без пауз запрашивают
+клип максимальной длины и снимок. Если сборка MP4/JPEG мешала бы loop, выросло
+бы опоздание пакетов у зрителя.
+
+Печатаются перцентили опоздания по фазам, задержки и число выгрузок, объем
+буфера относительно лимита. Лимит можно уменьшить (--max-mb), чтобы увидеть,
+что буфер его не превышает.
+
+Запуск: python benchmarks/bench_clip_export.py --resolution 1920x1080 --seconds 10 --exporters 1,4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import av # type: ignore
+import numpy as np # type: ignore
+from aiortc import MediaStreamTrack # type: ignore
+from aiortc.contrib.media import MediaRelay # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from bench_utils import latency_summary
+from clip_buffer import ClipRecorder, ClipUnavailable, ExportBusy
+
+
+def write_camera_video(path, width, height, fps, seconds, bitrate):
+    """H.264 с шумом, чтобы энкодер выдавал заданный битрейт, как реальная камера; GOP 1 с."""
+    rng = np.random.default_rng(0)
+    with av.open(path, "w") as container:
+        stream = container.add_stream("libx264", rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        stream.bit_rate = bitrate
+        stream.options = {"preset": "ultrafast", "tune": "zerolatency", "g": str(fps)}
+        for i in range(fps * seconds):
+            image = rng.integers(0, 256, size=(height * 3 // 2, width), dtype=np.uint8)
+            frame = av.VideoFrame.from_ndarray(image, format="yuv420p")
+            frame.pts = i
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode(None))
+
+
+class LivePacketTrack(MediaStreamTrack):
+    """Пакеты файла по кругу в темпе камеры; pts продолжаются между кругами."""
+    kind = "video"
+
+    def __init__(self, packets, fps):
+        super().__init__()
+        self._packets = packets
+        self._fps = fps
+        self._index = 0
+        self._started = None
+
+    async def recv(self):
+        if self._started is None:
+            self._started = time.perf_counter()
+        due = self._started + self._index / self._fps
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        source = self._packets[self._index % len(self._packets)]
+        packet = av.Packet(bytes(source))
+        packet.pts = packet.dts = self._index
+        packet.time_base = source.time_base
+        packet.is_keyframe = source.is_keyframe
+        self._index += 1
+        return packet, due
+
+
+class PacketsOnly(MediaStreamTrack):
+    """Рекордер получает только пакеты, без времени по расписанию."""
+    kind = "video"
+
+    def __init__(self, track):
+        super().__init__()
+        self._track = track
+
+    async def recv(self):
+        packet, _ = await self._track.recv()
+        return packet
+
+    def stop(self):
+        super().stop()
+        self._track.stop()
+
+
+class FileIngest:
+    """То, что ClipRecorder берет у RtspIngest: поколение и параметры потока."""
+
+    def __init__(self, container):
+        stream = container.streams.video[0]
+        self.url = "bench"
+        self.generation = 1
+        self.stream = stream
+        self.codec_name = stream.codec_context.name
+        self.extradata = stream.codec_context.extradata
+
+
+async def viewer(track, lateness, phase):
+    try:
+        while True:
+            _, due = await track.recv()
+            lateness[phase[0]].append(time.perf_counter() - due)
+    except MediaStreamError:
+        pass
+
+
+async def exporter(recorder, stats, stop):
+    while not stop.is_set():
+        for kind in ("clip", "snapshot"):
+            started = time.perf_counter()
+            try:
+                if kind == "clip":
+                    data = await recorder.export_clip(recorder.buffer.max_seconds)
+                else:
+                    data = await recorder.export_snapshot()
+            except (ClipUnavailable, ExportBusy):
+                await asyncio.sleep(0.1)
+                continue
+            stats[kind].append(time.perf_counter() - started)
+            stats[kind + "_bytes"] = len(data)
+
+
+async def run(args, packets, ingest):
+    relay = MediaRelay()
+    source = LivePacketTrack(packets, args.fps)
+    lateness = {}
+    phase = ["warmup"]
+    lateness["warmup"] = []
+    viewer_task = asyncio.ensure_future(viewer(relay.subscribe(source), lateness, phase))
+    recorder = ClipRecorder(ingest, PacketsOnly(relay.subscribe(source)), args.buffer_seconds, args.max_mb * 1024 * 1024)
+    # Буфер набирается до полной глубины, иначе клипы короче, чем в работе
+    await asyncio.sleep(args.buffer_seconds)
+    results = []
+    for exporters in [0] + args.exporters:
+        name = f"{exporters} exporters"
+        phase[0] = name
+        lateness[name] = []
+        stats = {"clip": [], "snapshot": []}
+        stop = asyncio.Event()
+        tasks = [asyncio.ensure_future(exporter(recorder, stats, stop)) for _ in range(exporters)]
+        await asyncio.sleep(args.seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+        results.append((name, latency_summary(lateness[name]), stats, recorder.as_dict()))
+    recorder.stop()
+    source.stop()
+    viewer_task.cancel()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--bitrate", type=int, default=4_000_000, help="Битрейт камеры, бит/с")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Длительность каждой фазы")
+    parser.add_argument("--buffer-seconds", type=float, default=10.0)
+    parser.add_argument("--max-mb", type=float, default=32.0)
+    parser.add_argument("--exporters", default="1,4")
+    args = parser.parse_args()
+    args.exporters = [int(n) for n in args.exporters.split(",")]
+    width, height = (int(v) for v in args.resolution.split("x"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "camera.mp4")
+        write_camera_video(path, width, height, args.fps, 4, args.bitrate)
+        container = av.open(path)
+        packets = [p for p in container.demux(video=0) if p.size]
+        results = asyncio.run(run(args, packets, FileIngest(container)))
+
+    print(f"{args.resolution}@{args.fps} {args.bitrate / 1e6:.1f} Mbit/s, buffer {args.buffer_seconds} s / {args.max_mb} MB")
+    print(f"{'phase':12} {'late p50':>9} {'late p99':>9} {'late max':>9} {'clips':>6} {'clip p50':>9} "
+          f"{'snaps':>6} {'snap p50':>9} {'clip MB':>8} {'buffer MB':>10}")
+    for name, lateness, stats, recorder in results:
+        clip = latency_summary(stats["clip"]) if stats["clip"] else None
+        snap = latency_summary(stats["snapshot"]) if stats["snapshot"] else None
+        print(f"{name:12} {lateness['p50_ms']:9.2f} {lateness['p99_ms']:9.2f} {lateness['max_ms']:9.2f} "
+              f"{len(stats['clip']):6} {clip['p50_ms'] if clip else float('nan'):9.1f} "
+              f"{len(stats['snapshot']):6} {snap['p50_ms'] if snap else float('nan'):9.1f} "
+              f"{stats.get('clip_bytes', 0) / 1e6:8.2f} {recorder['buffered_bytes'] / 1e6:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
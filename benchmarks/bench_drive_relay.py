@@ -0,0 +1,212 @@
+"""
+Управление платформой: браузеры напрямую к ESP32 или через ретранслятор шлюза
+(drive_relay.py). Контроллер - заглушка stub_esp32.py с однопоточной обработкой
+сообщений.
+
+Режимы:
+  direct - как было: каждая вкладка (водитель и --viewers открытых вкладок без
+           нажатых клавиш) подключена к ESP32 и шлет drive на каждом тике 50 мс;
+  relay  - вкладки подключены к /ws/drive шлюза и шлют drive только при
+           изменении и раз в 200 мс для поддержки (PlatformController.js), шлюз
+           держит одно соединение с ESP32 и говорит с ним бинарным форматом
+           platform_wire.py;
+  relay-json - то же, но шлюз и ESP32 обмениваются JSON (DRIVE_WIRE_FORMAT = "json").
+
+Водитель в случайные моменты "нажимает" новую команду; она уходит на ближайшем
+тике браузера. Печатаются: сообщений/с, байт/с и клиентов у контроллера, задержка от
+нажатия до изменения скоростей моторов (p50/p99), лишние изменения скоростей
+в секунду (нули пустых вкладок поверх команды водителя) и время до остановки,
+когда водитель замолкает, не закрывая сокет (вкладка зависла).
+
+Запуск: python benchmarks/bench_drive_relay.py --modes direct,relay-json,relay --viewers 0,3 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from bench_utils import REPO_ROOT, latency_summary
+from stub_esp32 import start_stub_process
+from stub_onvif import wait_until_listening
+
+TICK = 0.05                 # UPDATE_INTERVAL_MS PlatformController.js
+KEEPALIVE = 0.2             # KEEPALIVE_INTERVAL_MS PlatformController.js
+PRESS_INTERVAL = (0.15, 0.45)
+SILENCE_TIMEOUT = 5.0
+
+
+# --- Шлюз (отдельный процесс) ---
+def serve(port, signaling_port, esp32_url, wire_format):
+    import app
+    app.drive_relay.url = esp32_url
+    app.drive_relay.wire_format = wire_format
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", signaling_port
+    app.run_server("asgi")
+
+
+def start_gateway(args, wire_format):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", wire_format, "--gateway-port", str(args.gateway_port),
+         "--port", str(args.port)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for_relay(base_url, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base_url}/api/drive") as response:
+                    if response.status == 200 and (await response.json())["connected"]:
+                        return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("Ретранслятор не подключился к заглушке ESP32")
+        await asyncio.sleep(0.1)
+
+
+# --- Вкладки браузера ---
+class Tab:
+    """Цикл PlatformController: тик 50 мс, в direct - drive на каждом тике, в relay - при изменении и keepalive."""
+
+    def __init__(self, ws, every_tick):
+        self.ws = ws
+        self.every_tick = every_tick
+        self.command = (0, 0)
+        self.sending = True
+        self.last_sent = None
+        self.last_sent_at = 0.0
+
+    async def drain(self):
+        async for _ in self.ws:
+            pass
+
+    async def run(self):
+        await asyncio.sleep(random.uniform(0, TICK))
+        while not self.ws.closed:
+            now = time.monotonic()
+            if self.sending and (self.every_tick or self.command != self.last_sent
+                                 or now - self.last_sent_at >= KEEPALIVE):
+                left, right = self.command
+                await self.ws.send_json({"command": "drive", "payload": {"left": left, "right": right}})
+                self.last_sent, self.last_sent_at = self.command, now
+            await asyncio.sleep(TICK)
+
+
+async def run_mode(mode, viewers, args):
+    url = f"ws://127.0.0.1:{args.port}/ws" if mode == "direct" else f"ws://127.0.0.1:{args.gateway_port + 1}/ws/drive"
+    stub_url = f"http://127.0.0.1:{args.port}"
+    async with aiohttp.ClientSession() as session:
+        driver = Tab(await session.ws_connect(url), mode == "direct")
+        tabs = [Tab(await session.ws_connect(url), mode == "direct") for _ in range(viewers)]
+        tasks = [asyncio.ensure_future(coro) for tab in [driver] + tabs for coro in (tab.drain(), tab.run())]
+        await asyncio.sleep(0.5)
+        await session.post(f"{stub_url}/reset")
+
+        # Водитель: новая команда в случайный момент, уходит на ближайшем тике
+        presses = []
+        started = time.monotonic()
+        value = 0
+        while time.monotonic() - started < args.duration:
+            value = value % 90 + 10
+            presses.append((time.monotonic(), (value, value)))
+            driver.command = (value, value)
+            await asyncio.sleep(random.uniform(*PRESS_INTERVAL))
+        elapsed = time.monotonic() - started
+        async with session.get(f"{stub_url}/stats") as response:
+            stats = await response.json()
+
+        # Водитель замолкает с ненулевой командой: вкладка зависла, сокет открыт
+        for tab in tabs:
+            await tab.ws.close()
+        driver.command = (50, 50)
+        await asyncio.sleep(0.5)
+        driver.sending = False
+        silent_at = time.monotonic()
+        stop_after = None
+        while stop_after is None and time.monotonic() - silent_at < SILENCE_TIMEOUT:
+            await asyncio.sleep(0.05)
+            async with session.get(f"{stub_url}/stats") as response:
+                stops = [t for t, left, right in (await response.json())["actuations"]
+                         if t > silent_at and (left, right) == (0, 0)]
+            if stops:
+                stop_after = stops[0] - silent_at
+        await driver.ws.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    actuations = stats["actuations"]
+    latencies, foreign = [], 0
+    for i, (pressed_at, command) in enumerate(presses):
+        until = presses[i + 1][0] if i + 1 < len(presses) else float("inf")
+        hits = [t for t, left, right in actuations if pressed_at <= t < until and (left, right) == command]
+        if hits:
+            latencies.append(hits[0] - pressed_at)
+    for t, left, right in actuations:
+        current = [command for pressed_at, command in presses if pressed_at <= t]
+        if current and (left, right) != current[-1]:
+            foreign += 1
+    return {
+        "messages_per_s": stats["messages"] / elapsed,
+        "bytes_per_s": stats["bytes"] / elapsed,
+        "clients": stats["clients"],
+        "latency": latency_summary(latencies),
+        "missed": len(presses) - len(latencies),
+        "foreign_per_s": foreign / elapsed,
+        "stop_after": stop_after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="direct,relay-json,relay")
+    parser.add_argument("--viewers", default="0,3", help="Открытых вкладок без нажатых клавиш, через запятую")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--handle-ms", type=float, default=2.0, help="Время обработки сообщения заглушкой ESP32")
+    parser.add_argument("--port", type=int, default=8800, help="Порт заглушки ESP32")
+    parser.add_argument("--gateway-port", type=int, default=5300)
+    parser.add_argument("--serve", choices=("json", "binary"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.gateway_port, args.gateway_port + 1, f"ws://127.0.0.1:{args.port}/ws", args.serve)
+        return
+
+    stub = start_stub_process(args.port, args.handle_ms)
+    try:
+        asyncio.run(wait_until_listening(args.port))
+        print(f"duration={args.duration}s esp32 handle={args.handle_ms}ms")
+        print(f"{'mode':10} {'tabs':>4} {'mcu msg/s':>9} {'mcu B/s':>7} {'clients':>7} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'missed':>6} {'flaps/s':>7} {'stop s':>6}")
+        for viewers in (int(v) for v in args.viewers.split(",")):
+            for mode in args.modes.split(","):
+                # Шлюз работает только в своем замере: в direct его heartbeat мешал бы вкладкам
+                gateway = None
+                if mode != "direct":
+                    gateway = start_gateway(args, "json" if mode == "relay-json" else "binary")
+                try:
+                    if gateway is not None:
+                        asyncio.run(wait_for_relay(f"http://127.0.0.1:{args.gateway_port}"))
+                    result = asyncio.run(run_mode(mode, viewers, args))
+                finally:
+                    if gateway is not None:
+                        gateway.terminate()
+                        gateway.wait()
+                stop = f"{result['stop_after']:6.2f}" if result["stop_after"] is not None else f"{'never':>6}"
+                print(f"{mode:10} {viewers + 1:4} {result['messages_per_s']:9.1f} {result['bytes_per_s']:7.0f} "
+                      f"{result['clients']:7} "
+                      f"{result['latency']['p50_ms']:8.1f} {result['latency']['p99_ms']:8.1f} "
+                      f"{result['missed']:6} {result['foreign_per_s']:7.1f} {stop}")
+    finally:
+        stub.terminate()
+
+if __name__ == "__main__":
+    main()
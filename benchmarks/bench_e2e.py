@@ -0,0 +1,420 @@
+"""
+Сквозной бенчмарк шлюза без камер и железа: синтетическая RTSP камера
+(stub_rtsp.py), заглушки ONVIF PTZ каждой модели CameraType со своим SOAP
+диалектом (stub_onvif.py --dialect) и зрители - aiortc пиры, которые шлют
+/offer и декодируют видео, как браузер.
+
+Шлюз - отдельный процесс (app.run_server() в режиме --mode), камеры в нем -
+RTSP_CAMERAS cam0..camN, все с одной RTSP заглушки (у каждой свой путь, значит
+свой ingest и свой энкодер). Заглушки PTZ слушают там, куда шлюз пойдет по
+встроенным параметрам модели (CAMERA_DEFAULTS): YCC365 - на --ptz-port,
+YOOSEE и Y05 - на своих портах 5000 и 6688 адресов 127.0.0.2 и 127.0.0.3
+(на Linux весь 127.0.0.0/8 - loopback; на macOS нужны алиасы lo0).
+
+Для каждого числа камер из --streams шлюз запускается заново, к каждой камере
+подключаются --viewers зрителей. Печатаются:
+  offer        - ответ /offer (offer_async_logic: сессия, источник, answer);
+  ttff cold    - от отправки offer до первого декодированного кадра у первого
+                 зрителя камеры (RTSP открывается с нуля);
+  ttff warm    - то же у следующих зрителей уже открытой камеры;
+  g2g          - "от объектива до экрана": время в кадре (метка stub_rtsp в
+                 момент кодирования) против момента декодирования у зрителя;
+  fps          - кадров в секунду на зрителя, среднее и минимум;
+  cpu, rss     - процесса шлюза на поток (CPU 100% - одно ядро; RSS - прирост
+                 к шлюзу без зрителей);
+  ptz          - RTT /api/ptz с "wait": true (send_ptz_request и очередь камеры)
+                 по моделям камер, пока идут потоки; overhead - p50 минус
+                 задержка заглушки --latency-ms.
+Зрители работают в процессе бенчмарка, заглушки - в своих; на машине с одним
+ядром все они делят его со шлюзом.
+
+Результат прогона дописывается строкой JSON в --results (коммит, параметры,
+метрики по уровням) и сравнивается с последним прогоном с теми же параметрами
+(или из --baseline): метрика хуже на --tolerance и больше порога из
+REGRESSION_THRESHOLDS - регрессия, бенчмарк завершается с кодом 1.
+
+Запуск: python benchmarks/bench_e2e.py --streams 1,4 --viewers 2 --duration 10
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np # type: ignore
+from aiortc import RTCPeerConnection, RTCSessionDescription # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from bench_http_modes import wait_until_ready
+from bench_supervisor import process_usage
+from bench_utils import REPO_ROOT, latency_summary
+from onvif_discovery import CAMERA_DEFAULTS
+from stub_onvif import start_stub_process as start_onvif_stub, wait_until_listening
+from stub_rtsp import age_ms, decode_timestamp, start_stub_process as start_rtsp_stub
+
+CLIENT_TIMEOUT = 30.0
+FIRST_FRAME_TIMEOUT = 20.0
+ONVIF_USER, ONVIF_PASSWORD = "admin", "bench-password"
+# Команды оператора по кругу: у каждой свой SOAP шаблон и разбор ответа
+PTZ_COMMANDS = (
+    {"action": "move", "pan": 0.5, "tilt": -0.25},
+    {"action": "stop"},
+    {"action": "relative_move", "pan": 0.1, "zoom": 0.05},
+    {"action": "absolute_move", "pan": 0.0, "tilt": 0.0, "zoom": 0.0},
+    {"action": "status"},
+)
+
+# Метрика -> наименьшая разница, которая считается изменением (в единицах метрики).
+# Положительный порог - рост хуже, отрицательный - хуже падение. PTZ метрики - по модели: ptz_p50_ms[YCC365]
+REGRESSION_THRESHOLDS = {
+    "failed": 0.5,
+    "offer_p50_ms": 5.0,
+    "offer_p99_ms": 20.0,
+    "ttff_cold_p50_ms": 50.0,
+    "ttff_warm_p50_ms": 50.0,
+    "g2g_p50_ms": 5.0,
+    "g2g_p99_ms": 20.0,
+    "fps_min": -2.0,
+    "cpu_per_stream": 1.0,
+    "rss_per_stream_mb": 5.0,
+    "ptz_p50_ms": 2.0,
+    "ptz_p99_ms": 10.0,
+    "ptz_errors": 0.5,
+}
+
+
+def ptz_cameras(ptz_port):
+    """Камера-заглушка на каждую модель: тип, адрес для /api/ptz, где слушает и на каком диалекте."""
+    cameras = []
+    for i, (camera_type, defaults) in enumerate(CAMERA_DEFAULTS.items()):
+        if defaults.service_path.startswith(":"):
+            # Порт зашит в параметрах модели: камере нужен свой адрес
+            host, port = f"127.0.0.{2 + i}", int(defaults.service_path[1:].split("/", 1)[0])
+            camera_ip = host
+        else:
+            host, port = "127.0.0.1", ptz_port + i
+            camera_ip = f"{host}:{port}"
+        cameras.append({"type": camera_type.value, "camera_ip": camera_ip, "host": host, "port": port,
+                        "dialect": defaults.dialect.value, "profile_token": defaults.profile_token})
+    return cameras
+
+
+# --- Шлюз (отдельный процесс) ---
+def serve(mode, port, rtsp_url, cameras):
+    import app
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", port + 1
+    app.RTSP_CAMERAS = {f"cam{i}": f"{rtsp_url}/cam{i}" for i in range(cameras)}
+    app.drive_relay.url = ""
+    app.RECORDING = app.recorder.enabled = False
+    app.onvif_discovery.cache_path = None   # Заглушки не должны попасть в onvif_cache.json
+    app.peer_sessions.max_sessions = app.peer_sessions.max_per_client = 1000  # Все зрители с 127.0.0.1
+    app.run_server(mode)
+
+
+def start_gateway(args, cameras):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", args.mode, "--port", str(args.port),
+         "--rtsp-port", str(args.rtsp_port), "--cameras", str(cameras)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# --- Зрители ---
+class Viewer:
+    """aiortc пир, который смотрит камеру camera_id и читает метку времени из каждого кадра."""
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.pc = None
+        self.offer_seconds = None
+        self.ttff = None
+        self.measuring = False
+        self.frames = 0
+        self.unreadable = 0
+        self.ages = []
+        self._first_frame = asyncio.Event()
+        self._first_frame_at = None
+        self._reader = None
+
+    async def connect(self, session, base_url, passthrough):
+        pc = self.pc = RTCPeerConnection()
+        pc.addTransceiver("video", direction="recvonly")
+
+        @pc.on("track")
+        def on_track(track):
+            self._reader = asyncio.ensure_future(self._read(track))
+
+        await pc.setLocalDescription(await pc.createOffer())
+        started = time.monotonic()
+        async with session.post(f"{base_url}/offer", json={
+                "sdp": pc.localDescription.sdp, "type": pc.localDescription.type,
+                "camera_id": self.camera_id, "passthrough": passthrough}) as response:
+            answer = await response.json()
+            if response.status != 200:
+                raise RuntimeError(f"/offer {response.status}: {answer.get('error')}")
+        self.offer_seconds = time.monotonic() - started
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+        await asyncio.wait_for(self._first_frame.wait(), FIRST_FRAME_TIMEOUT)
+        self.ttff = self._first_frame_at - started
+
+    async def _read(self, track):
+        try:
+            while True:
+                frame = await track.recv()
+                now = time.monotonic()
+                if self._first_frame_at is None:
+                    self._first_frame_at = now
+                    self._first_frame.set()
+                if not self.measuring:
+                    continue
+                self.frames += 1
+                plane = frame.planes[0]
+                luma = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)[:frame.height, :frame.width]
+                stamp = decode_timestamp(luma)
+                if stamp is None:
+                    self.unreadable += 1
+                else:
+                    self.ages.append(age_ms(stamp, int(now * 1000)) / 1000)
+        except MediaStreamError:
+            pass
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.pc is not None:
+            await self.pc.close()
+
+
+async def connect_all(session, base_url, viewers, passthrough):
+    """Подключает зрителей одновременно; возвращает подключившихся."""
+    results = await asyncio.gather(*(viewer.connect(session, base_url, passthrough) for viewer in viewers),
+                                   return_exceptions=True)
+    return [viewer for viewer, result in zip(viewers, results) if result is None]
+
+
+async def drive_ptz(session, base_url, camera, requests, interval):
+    """Команды PTZ_COMMANDS по кругу одной камере, по одной: (RTT в секундах, ошибок)."""
+    rtts, errors = [], 0
+    for i in range(requests):
+        payload = dict(PTZ_COMMANDS[i % len(PTZ_COMMANDS)], camera_ip=camera["camera_ip"], camera_type=camera["type"],
+                       onvif_user=ONVIF_USER, onvif_password=ONVIF_PASSWORD, wait=True)
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{base_url}/api/ptz", json=payload) as response:
+                await response.read()
+                errors += not 200 <= response.status < 300
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors += 1
+        rtts.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return rtts, errors
+
+
+async def run_level(cameras, args, gateway_pid, ptz):
+    base_url = f"http://127.0.0.1:{args.port}"
+    timeout = aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_until_ready(session, base_url)
+        _, idle_rss = process_usage([gateway_pid])
+        first = [Viewer(f"cam{i}") for i in range(cameras)]
+        rest = [Viewer(f"cam{i}") for i in range(cameras) for _ in range(args.viewers - 1)]
+        connected = await connect_all(session, base_url, first, args.passthrough)
+        connected += await connect_all(session, base_url, rest, args.passthrough)
+        viewers = first + rest
+        try:
+            await asyncio.sleep(args.warmup)
+            for viewer in connected:
+                viewer.measuring = True
+            cpu_before, _ = process_usage([gateway_pid])
+            started = time.monotonic()
+            _, *ptz_results = await asyncio.gather(
+                asyncio.sleep(args.duration),
+                *(drive_ptz(session, base_url, camera, args.ptz_requests, args.ptz_interval) for camera in ptz))
+            elapsed = time.monotonic() - started
+            for viewer in connected:
+                viewer.measuring = False
+            cpu_after, rss = process_usage([gateway_pid])
+        finally:
+            await asyncio.gather(*(viewer.close() for viewer in viewers), return_exceptions=True)
+
+    streams = len(viewers)
+    per_stream = max(len(connected), 1)
+    fps = [viewer.frames / elapsed for viewer in connected]
+    offer = latency_summary([viewer.offer_seconds for viewer in viewers if viewer.offer_seconds is not None])
+    g2g = latency_summary([age for viewer in connected for age in viewer.ages])
+    ttff_cold = latency_summary([viewer.ttff for viewer in first if viewer.ttff is not None])
+    ttff_warm = latency_summary([viewer.ttff for viewer in rest if viewer.ttff is not None])
+    level = {
+        "cameras": cameras,
+        "streams": streams,
+        "failed": streams - len(connected),
+        "offer_p50_ms": offer["p50_ms"],
+        "offer_p99_ms": offer["p99_ms"],
+        "ttff_cold_p50_ms": ttff_cold["p50_ms"],
+        "ttff_cold_max_ms": ttff_cold["max_ms"],
+        "ttff_warm_p50_ms": ttff_warm["p50_ms"],
+        "g2g_p50_ms": g2g["p50_ms"],
+        "g2g_p99_ms": g2g["p99_ms"],
+        "unreadable": sum(viewer.unreadable for viewer in connected),
+        "fps_avg": round(sum(fps) / len(fps), 1) if fps else 0.0,
+        "fps_min": round(min(fps), 1) if fps else 0.0,
+        "cpu_per_stream": round((cpu_after - cpu_before) / elapsed * 100 / per_stream, 2),
+        "rss_per_stream_mb": round((rss - idle_rss) / 2**20 / per_stream, 2),
+        "rss_mb": round(rss / 2**20, 1),
+    }
+    for camera, (rtts, errors) in zip(ptz, ptz_results):
+        summary = latency_summary(rtts)
+        level[f"ptz_p50_ms[{camera['type']}]"] = summary["p50_ms"]
+        level[f"ptz_p99_ms[{camera['type']}]"] = summary["p99_ms"]
+        level[f"ptz_max_ms[{camera['type']}]"] = summary["max_ms"]
+        level[f"ptz_errors[{camera['type']}]"] = errors
+    return level
+
+
+# --- Результаты и регрессии ---
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_baseline(path, config):
+    """Последний прогон из path с теми же параметрами; None - такого нет."""
+    baseline = None
+    try:
+        with open(path, encoding="utf-8") as results:
+            for line in results:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("config") == config:
+                    baseline = record
+    except FileNotFoundError:
+        pass
+    return baseline
+
+
+def find_regressions(baseline, levels, tolerance):
+    """[(камер, метрика, было, стало)] метрик, которые стали хуже на tolerance и больше порога."""
+    previous = {level["cameras"]: level for level in baseline["levels"]}
+    regressions = []
+    for level in levels:
+        old_level = previous.get(level["cameras"])
+        if old_level is None:
+            continue
+        for name, new in level.items():
+            threshold = REGRESSION_THRESHOLDS.get(name.split("[", 1)[0])
+            old = old_level.get(name)
+            if threshold is None or old is None or new != new or old != old:   # NaN - метрики не было
+                continue
+            worse = new - old if threshold > 0 else old - new
+            if worse > abs(threshold) and worse > abs(old) * tolerance:
+                regressions.append((level["cameras"], name, old, new))
+    return regressions
+
+
+def print_levels(levels, ptz, latency_ms):
+    print(f"{'cams':>4} {'streams':>7} {'failed':>6} {'offer p50':>9} {'ttff cold':>9} {'ttff warm':>9} "
+          f"{'g2g p50':>7} {'g2g p99':>7} {'fps avg':>7} {'fps min':>7} {'cpu%/str':>8} {'MB/str':>6}")
+    for level in levels:
+        print(f"{level['cameras']:4} {level['streams']:7} {level['failed']:6} {level['offer_p50_ms']:9.1f} "
+              f"{level['ttff_cold_p50_ms']:9.1f} {level['ttff_warm_p50_ms']:9.1f} {level['g2g_p50_ms']:7.1f} "
+              f"{level['g2g_p99_ms']:7.1f} {level['fps_avg']:7.1f} {level['fps_min']:7.1f} "
+              f"{level['cpu_per_stream']:8.1f} {level['rss_per_stream_mb']:6.1f}")
+    print(f"\n{'cams':>4} {'camera':7} {'dialect':7} {'ptz p50':>7} {'ptz p99':>7} {'ptz max':>7} {'overhead':>8} {'errors':>6}")
+    for level in levels:
+        for camera in ptz:
+            name = camera["type"]
+            p50 = level[f"ptz_p50_ms[{name}]"]
+            print(f"{level['cameras']:4} {name:7} {camera['dialect']:7} {p50:7.1f} {level[f'ptz_p99_ms[{name}]']:7.1f} "
+                  f"{level[f'ptz_max_ms[{name}]']:7.1f} {p50 - latency_ms:8.1f} {level[f'ptz_errors[{name}]']:6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("flask", "asgi"), default="asgi")
+    parser.add_argument("--streams", default="1,4", help="Камер (каждая - свой RTSP путь), через запятую")
+    parser.add_argument("--viewers", type=int, default=2, help="Зрителей на камеру")
+    parser.add_argument("--passthrough", action="store_true", help="Зрители просят passthrough вместо перекода")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0, help="Пауза после подключения до замера")
+    parser.add_argument("--size", default="640x360", help="Кадр синтетической камеры")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30, help="Кадров между ключевыми у камеры")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Задержка ответа заглушек ONVIF")
+    parser.add_argument("--ptz-requests", type=int, default=100, help="Команд PTZ на камеру за уровень")
+    parser.add_argument("--ptz-interval", type=float, default=0.02, help="Пауза между командами одной камере (сек)")
+    parser.add_argument("--port", type=int, default=5600)
+    parser.add_argument("--rtsp-port", type=int, default=8554)
+    parser.add_argument("--ptz-port", type=int, default=8930, help="Порт заглушки моделей без своего порта (YCC365)")
+    parser.add_argument("--results", default=os.path.join(REPO_ROOT, "benchmarks", "results", "bench_e2e.jsonl"),
+                        help="Куда дописать результат; пустая строка - не сохранять")
+    parser.add_argument("--baseline", help="Сравнивать с последним прогоном из этого файла, а не из --results")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Доля ухудшения, которая считается регрессией")
+    parser.add_argument("--serve", choices=("flask", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--cameras", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, f"rtsp://127.0.0.1:{args.rtsp_port}", args.cameras)
+        return
+
+    width, height = (int(v) for v in args.size.split("x"))
+    levels_spec = [int(n) for n in args.streams.split(",")]
+    ptz = ptz_cameras(args.ptz_port)
+    stubs = [start_rtsp_stub(args.rtsp_port, width, height, args.fps, args.gop)]
+    for camera in ptz:
+        stubs.append(start_onvif_stub([camera["port"]], args.latency_ms, host=camera["host"], dialect=camera["dialect"],
+                                      password=ONVIF_PASSWORD, profile_token=camera["profile_token"]))
+    config = {"mode": args.mode, "viewers": args.viewers, "passthrough": args.passthrough, "duration": args.duration,
+              "size": args.size, "fps": args.fps, "gop": args.gop, "latency_ms": args.latency_ms,
+              "ptz_requests": args.ptz_requests, "ptz_interval": args.ptz_interval}
+    levels = []
+    try:
+        asyncio.run(wait_until_listening(args.rtsp_port, timeout=10.0))
+        for camera in ptz:
+            asyncio.run(wait_until_listening(camera["port"], camera["host"]))
+        print(f"mode={args.mode} camera={args.size}@{args.fps}fps gop={args.gop} viewers/camera={args.viewers} "
+              f"passthrough={args.passthrough} duration={args.duration}s onvif latency={args.latency_ms}ms")
+        for cameras in levels_spec:
+            gateway = start_gateway(args, cameras)
+            try:
+                levels.append(asyncio.run(run_level(cameras, args, gateway.pid, ptz)))
+            finally:
+                gateway.terminate()
+                gateway.wait()
+    finally:
+        for stub in stubs:
+            stub.terminate()
+    print_levels(levels, ptz, args.latency_ms)
+
+    baseline = find_baseline(args.baseline or args.results, config) if (args.baseline or args.results) else None
+    record = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+              "config": config, "levels": levels}
+    if args.results:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as results:
+            results.write(json.dumps(record) + "\n")
+    if baseline is None:
+        print("\nБазового прогона с такими параметрами нет, сравнивать не с чем")
+        return
+    regressions = find_regressions(baseline, levels, args.tolerance)
+    print(f"\nСравнение с {baseline['time']} ({baseline.get('commit')}), допуск {args.tolerance:.0%}:")
+    for cameras, name, old, new in regressions:
+        print(f"  РЕГРЕССИЯ cams={cameras} {name}: {old} -> {new}")
+    if not regressions:
+        print("  регрессий нет")
+        return
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
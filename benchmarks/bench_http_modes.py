@@ -0,0 +1,179 @@
+"""
+Пропускная способность /offer и /api/ptz при одновременных клиентах: Flask dev
+сервер (потоки + run_coroutine_threadsafe) против ASGI режима (uvicorn в
+background_loop), см. SERVER_MODE в app.py.
+
+Сервер запускается отдельным процессом через app.run_server() в каждом режиме.
+Камера - сгенерированный H.264 файл вместо RTSP, PTZ - заглушка ONVIF
+(stub_onvif.py, своя "камера" на каждого клиента). Клиенты шлют пачки по N
+одновременных запросов: offer с готовым SDP (ICE до конца не доводится, меряется
+сигнализация) и PTZ move с "wait": true. Для каждого N печатаются запросы/с,
+перцентили задержки и ошибки (не 2xx или таймаут клиента).
+
+Запуск: python benchmarks/bench_http_modes.py --concurrency 1,12,50 --rounds 3
+"""
+import argparse
+import asyncio
+import fractions
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import av # type: ignore
+from aiortc import RTCPeerConnection # type: ignore
+
+from bench_utils import REPO_ROOT, latency_summary
+from stub_onvif import start_stub_process, wait_until_listening
+
+CLIENT_TIMEOUT = 30.0
+
+
+def write_test_video(path, width=640, height=360, fps=30, seconds=2):
+    """Короткий H.264 ролик с движущейся полосой; сервер проигрывает его по кругу вместо камеры."""
+    with av.open(path, "w") as container:
+        stream = container.add_stream("libx264", rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        stream.options = {"preset": "veryfast", "tune": "zerolatency"}
+        for i in range(fps * seconds):
+            frame = av.VideoFrame(width, height, "yuv420p")
+            bar = (i * width // (fps * seconds)) & ~1
+            row = bytes(255 if bar <= x < bar + width // 8 else 64 for x in range(width))
+            frame.planes[0].update(row * height)
+            frame.planes[1].update(bytes([128]) * frame.planes[1].buffer_size)
+            frame.planes[2].update(bytes([128]) * frame.planes[2].buffer_size)
+            frame.pts, frame.time_base = i, fractions.Fraction(1, fps)
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode(None))
+
+
+# --- Сервер (отдельный процесс) ---
+def serve(mode, port, signaling_port, video_path):
+    from aiortc.contrib.media import MediaPlayer # type: ignore
+    import app
+
+    async def open_test_video(url, options=None):
+        return MediaPlayer(url, decode=False, loop=True)
+
+    app.open_rtsp_player = open_test_video
+    app.DEFAULT_RTSP_URL = video_path
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", signaling_port
+    app.run_server(mode)
+
+
+def start_server(mode, args, video_path):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(args.port),
+         "--signaling-port", str(args.port + 1), "--video", video_path],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# --- Клиенты ---
+async def make_offer_sdp():
+    pc = RTCPeerConnection()
+    pc.addTransceiver("video", direction="recvonly")
+    await pc.setLocalDescription(await pc.createOffer())
+    sdp = pc.localDescription.sdp
+    await pc.close()
+    return sdp
+
+
+async def wait_until_ready(session, base_url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{base_url}/api/sources") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Сервер {base_url} не поднялся за {timeout} с")
+        await asyncio.sleep(0.2)
+
+
+async def timed_post(session, url, payload):
+    started = time.perf_counter()
+    try:
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            ok = 200 <= response.status < 300
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+async def run_level(session, url, payloads, rounds):
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for elapsed, ok in await asyncio.gather(*(timed_post(session, url, p) for p in payloads)):
+            latencies.append(elapsed)
+            errors += not ok
+    return len(payloads) * rounds / (time.perf_counter() - started), latencies, errors
+
+
+async def run_mode(mode, args, offer_sdp):
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    timeout = aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_until_ready(session, base_url)
+        # Первый offer открывает источник и энкодер - не в счет
+        await timed_post(session, f"{base_url}/offer", {"sdp": offer_sdp, "type": "offer"})
+        for concurrency in args.concurrency:
+            offers = [{"sdp": offer_sdp, "type": "offer"}] * concurrency
+            results.append(("offer", concurrency) + await run_level(session, f"{base_url}/offer", offers, args.rounds))
+            moves = [{"camera_ip": f"127.0.0.1:{args.stub_port + i}", "camera_type": "YCC365",
+                      "onvif_user": "admin", "onvif_password": "admin",
+                      "action": "move", "pan": 0.5, "wait": True} for i in range(concurrency)]
+            results.append(("ptz", concurrency) + await run_level(session, f"{base_url}/api/ptz", moves, args.rounds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="flask,asgi")
+    parser.add_argument("--concurrency", default="1,12,50")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Задержка ответа заглушки камеры")
+    parser.add_argument("--serve", choices=("flask", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--signaling-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--video", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.signaling_port, args.video)
+        return
+
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    stub = start_stub_process(list(range(args.stub_port, args.stub_port + max(args.concurrency))), args.latency_ms)
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, "camera.mp4")
+        write_test_video(video_path)
+        offer_sdp = asyncio.run(make_offer_sdp())
+        asyncio.run(wait_until_listening(args.stub_port))
+        print(f"rounds={args.rounds} camera latency={args.latency_ms}ms")
+        print(f"{'mode':6} {'request':7} {'conc':>4} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>6}")
+        try:
+            for mode in args.modes.split(","):
+                server = start_server(mode, args, video_path)
+                try:
+                    for kind, concurrency, rate, latencies, errors in asyncio.run(run_mode(mode, args, offer_sdp)):
+                        summary = latency_summary(latencies)
+                        print(f"{mode:6} {kind:7} {concurrency:4} {rate:8.1f} {summary['p50_ms']:8.1f} "
+                              f"{summary['p99_ms']:8.1f} {summary['max_ms']:8.1f} {errors:6}")
+                finally:
+                    server.terminate()
+                    server.wait()
+        finally:
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
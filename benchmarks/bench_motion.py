@@ -0,0 +1,73 @@
+"""
+Пропускная способность детектора движения (motion_detection.py) на одном ядре:
+сколько кадров в секунду анализирует один поток пула для разных разрешений
+камеры и ширины уменьшенного кадра. Ширина 0 - анализ без уменьшения, для
+сравнения.
+
+Кадры - заранее сгенерированные av.VideoFrame yuv420p с движущимся прямоугольником
+на шумном фоне, как их отдает декодер источника. Время CPU меряется по потоку
+(time.thread_time), поэтому кадры/с на ядро не зависят от загрузки машины.
+Частота MOTION_SAMPLE_FPS на источник делится на этот результат - получается
+доля ядра на камеру.
+
+Запуск: python benchmarks/bench_motion.py --resolutions 1280x720,1920x1080 --widths 0,80,160,320
+"""
+import argparse
+import time
+
+import av # type: ignore
+import numpy as np # type: ignore
+
+import bench_utils  # noqa: F401 (путь к модулям репозитория)
+from motion_detection import MOTION_SAMPLE_FPS, MotionDetector, analyze_frame
+
+
+def make_frames(width, height, count, seed=0):
+    """Кадры с шумом матрицы и прямоугольником, который проходит кадр слева направо."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        luma = rng.integers(60, 76, size=(height, width), dtype=np.uint8)
+        x = i * (width - width // 8) // max(1, count - 1)
+        luma[height // 3:height // 3 + height // 6, x:x + width // 8] = 220
+        chroma = np.full((height // 2, width // 2), 128, dtype=np.uint8)
+        yuv = np.concatenate([luma.reshape(-1), chroma.reshape(-1), chroma.reshape(-1)])
+        frames.append(av.VideoFrame.from_ndarray(yuv.reshape(height * 3 // 2, width), format="yuv420p"))
+    return frames
+
+
+def run(frames, width, min_seconds):
+    detector = MotionDetector()
+    analyzed, detected = 0, 0
+    started = time.thread_time()
+    while True:
+        for frame in frames:
+            area, _ = analyze_frame(detector, frame, width or frame.width)
+            detected += area > 0
+        analyzed += len(frames)
+        elapsed = time.thread_time() - started
+        if elapsed >= min_seconds:
+            return analyzed / elapsed, detected / analyzed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--widths", default="0,80,160,320")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Минимум CPU времени на замер")
+    args = parser.parse_args()
+
+    print(f"sample rate {MOTION_SAMPLE_FPS} fps per camera")
+    print(f"{'camera':>10} {'width':>6} {'frames/s/core':>14} {'ms/frame':>9} {'cameras/core':>13} {'changed':>8}")
+    for resolution in args.resolutions.split(","):
+        cam_width, cam_height = (int(v) for v in resolution.split("x"))
+        frames = make_frames(cam_width, cam_height, args.frames)
+        for width in (int(w) for w in args.widths.split(",")):
+            rate, motion_share = run(frames, width, args.seconds)
+            print(f"{resolution:>10} {width or cam_width:6} {rate:14.1f} {1000 / rate:9.2f} "
+                  f"{rate / MOTION_SAMPLE_FPS:13.1f} {motion_share:8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Микро-бенчмарк сериализации одной PTZ команды: старые f-string билдеры
+(эталонная копия кода из app.py до перехода на шаблоны) против onvif_templates.
+
+Запуск: python benchmarks/bench_onvif_templates.py [--iterations N]
+"""
+import argparse
+import base64
+import hashlib
+import random
+import timeit
+from datetime import datetime, timezone
+
+import bench_utils  # noqa: F401  (добавляет корень репозитория в sys.path)
+from onvif_templates import PtzAction, SoapDialect, get_template_set
+
+
+# --- Эталон: построение payload как в app.py до шаблонов ---
+def legacy_wssecurity_header(user, password):
+    creation_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    nonce_str = ''.join(random.choices("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=24))
+    nonce_base64 = base64.b64encode(nonce_str.encode('utf-8')).decode('ascii')
+    sha1_hash = hashlib.sha1(nonce_str.encode('utf-8') + creation_date.encode('utf-8') + password.encode('utf-8')).digest()
+    password_digest_final = base64.b64encode(sha1_hash).decode('ascii')
+    return f"""
+    <s:Header>
+        <Security s:mustUnderstand="1" xmlns="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
+            <UsernameToken>
+                <Username>{user}</Username>
+                <Password Type="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-username-token-profile-1.0#PasswordDigest">{password_digest_final}</Password>
+                <Nonce EncodingType="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-soap-message-security-1.0#Base64Binary">{nonce_base64}</Nonce>
+                <Created xmlns="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd">{creation_date}</Created>
+            </UsernameToken>
+        </Security>
+    </s:Header>"""
+
+
+def legacy_content(camera_type, action, profile_token, x, y, z):
+    if camera_type.upper() in ["YOOSEE", "Y05"]:
+        if action == "Stop":
+            return f"""<Stop xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+                    <ProfileToken>{profile_token}</ProfileToken>
+                    <PanTilt>true</PanTilt>
+                    <Zoom>true</Zoom>
+                </Stop>"""
+        return f"""<ContinuousMove xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+                    <ProfileToken>{profile_token}</ProfileToken>
+                    <Velocity>
+                        <PanTilt x="{x}" y="{y}" space="http://www.onvif.org/ver10/tptz/PanTiltSpaces/VelocityGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+                        <Zoom x="{z}" space="http://www.onvif.org/ver10/tptz/ZoomSpaces/VelocityGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+                    </Velocity>
+                </ContinuousMove>"""
+    if action == "Stop":
+        return f"""<tptz:Stop>
+                    <tptz:ProfileToken>{profile_token}</tptz:ProfileToken>
+                    <tptz:PanTilt>true</tptz:PanTilt>
+                    <tptz:Zoom>true</tptz:Zoom>
+                </tptz:Stop>"""
+    return f"""<tptz:ContinuousMove>
+                    <tptz:ProfileToken>{profile_token}</tptz:ProfileToken>
+                    <tptz:Velocity>
+                        <tt:PanTilt x="{x}" y="{y}"/>
+                        <tt:Zoom x="{z}"/>
+                    </tptz:Velocity>
+                </tptz:ContinuousMove>"""
+
+
+def legacy_build(camera_type, action, user, password, profile_token, x, y, z):
+    content = legacy_content(camera_type, action, profile_token, x, y, z)
+    if camera_type.upper() in ["YOOSEE", "Y05"]:
+        header_part = legacy_wssecurity_header(user, password)
+        payload = f"""<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+    {header_part}
+    <s:Body>
+    {content}
+    </s:Body>
+</s:Envelope>"""
+        action_url = f"http://www.onvif.org/ver20/ptz/wsdl/{action}"
+        headers = {'Content-Type': f'application/soap+xml;charset=UTF8;action="{action_url}"'}
+    else:
+        payload = f"""<?xml version="1.0" encoding="utf-8"?>
+                        <soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl" xmlns:tt="http://www.onvif.org/ver10/schema">
+                            <soap:Body>
+                            {content}
+                            </soap:Body>
+                        </soap:Envelope>"""
+        headers = {'Content-Type': 'application/soap+xml;charset=UTF8'}
+    return payload.encode('utf-8'), headers
+
+
+CASES = [
+    ("Y05", SoapDialect.WSSE, "PROFILE_000"),
+    ("YCC365", SoapDialect.TPTZ, "Profile_1"),
+]
+ACTIONS = [PtzAction.CONTINUOUS_MOVE, PtzAction.STOP]
+
+
+def bench(fn, iterations):
+    best = min(timeit.repeat(fn, number=iterations, repeat=5))
+    return best / iterations * 1e6  # мкс на команду
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'camera':8} {'action':15} {'legacy us':>10} {'template us':>12} {'speedup':>8} {'bytes old/new':>14}")
+    for camera_type, dialect, profile in CASES:
+        template_set = get_template_set(dialect)
+        for action in ACTIONS:
+            legacy = lambda: legacy_build(camera_type, action.value, "admin", "123456", profile, 0.5, -0.5, 0.0)  # noqa: E731
+            compiled = lambda: template_set.render(action, profile, "admin", "123456", 0.5, -0.5, 0.0)  # noqa: E731
+            legacy_us = bench(legacy, args.iterations)
+            template_us = bench(compiled, args.iterations)
+            old_len = len(legacy()[0])
+            new_len = len(compiled()[0])
+            print(f"{camera_type:8} {action.value:15} {legacy_us:10.2f} {template_us:12.2f} "
+                  f"{legacy_us / template_us:7.1f}x {old_len:6}/{new_len:<6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Нагрузочный тест PTZ клиента против локальной заглушки ONVIF (stub_onvif.py).
+
+Каждая "камера" - отдельный порт заглушки; на каждую камеру работает заданное
+число операторов в замкнутом цикле (ждут подтверждение и шлют следующую команду).
+Сравниваются два режима:
+  * async - AsyncPtzScheduler + AsyncPtzTransport в одном event loop (как в app.py);
+  * sync  - прежняя схема: поток на запрос и голый requests.post.
+
+Запуск: python benchmarks/bench_ptz_async_load.py --cameras 32 --latency-ms 20 --duration 10
+"""
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import latency_summary
+from onvif_templates import PtzAction, SoapDialect, get_template_set
+from ptz_scheduler import AsyncPtzScheduler, PtzCommandDropped
+from ptz_transport_async import AsyncPtzTransport
+from stub_onvif import start_stub_process, wait_until_listening
+
+PROFILE = "Profile_1"
+SERVICE_PATH = "/onvif/PTZ"  # Диалект YCC365: без WS-Security, путь без порта
+ACTIONS = (PtzAction.CONTINUOUS_MOVE, PtzAction.STOP)
+
+
+async def run_async(hosts, operators, duration):
+    transport = AsyncPtzTransport(max_connections=len(hosts) * 4)
+    template_set = get_template_set(SoapDialect.TPTZ)
+
+    async def send(command):
+        payload, headers = template_set.render(command.action, PROFILE, x=0.5, y=0.0, z=0.0)
+        response = await transport.post(command.camera_key, f"http://{command.camera_key}{SERVICE_PATH}", payload, headers)
+        return response.status_code
+
+    scheduler = AsyncPtzScheduler(send, coalesce_actions={PtzAction.CONTINUOUS_MOVE},
+                                  preempt_actions={PtzAction.STOP})
+    latencies, errors, coalesced = [], 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def operator(host, index):
+        nonlocal errors, coalesced
+        i = index
+        while time.perf_counter() < deadline:
+            action = ACTIONS[i % 2]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status = await scheduler.submit(host, action)
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+            except PtzCommandDropped:
+                coalesced += 1
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(operator(h, i) for h in hosts for i in range(operators)))
+    elapsed = time.perf_counter() - started
+    await scheduler.close()
+    await transport.close()
+    return latencies, errors, coalesced, elapsed
+
+
+def run_sync(hosts, operators, duration):
+    import requests
+
+    template_set = get_template_set(SoapDialect.TPTZ)
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def operator(host, index):
+        nonlocal errors
+        i = index
+        while time.perf_counter() < deadline:
+            action = ACTIONS[i % 2]
+            i += 1
+            payload, headers = template_set.render(action, PROFILE, x=0.5, y=0.0, z=0.0)
+            started = time.perf_counter()
+            try:
+                r = requests.post(f"http://{host}{SERVICE_PATH}", data=payload, headers=headers, timeout=3)
+                ok = r.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(hosts) * operators) as pool:
+        for host in hosts:
+            for i in range(operators):
+                pool.submit(operator, host, i)
+    return latencies, errors, 0, time.perf_counter() - started
+
+
+def report(mode, latencies, errors, coalesced, elapsed):
+    summary = latency_summary(latencies)
+    print(f"{mode:6} acked={summary['count']:7} cmd/s={summary['count'] / elapsed:9.1f} "
+          f"p50={summary['p50_ms']:7.2f}ms p99={summary['p99_ms']:7.2f}ms max={summary['max_ms']:7.2f}ms "
+          f"errors={errors} coalesced={coalesced}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, default=32)
+    parser.add_argument("--operators", type=int, default=1, help="Операторов (замкнутых циклов) на камеру")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Задержка ответа заглушки")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--base-port", type=int, default=8900)
+    parser.add_argument("--modes", default="async,sync")
+    args = parser.parse_args()
+
+    ports = list(range(args.base_port, args.base_port + args.cameras))
+    stub = start_stub_process(ports, args.latency_ms)
+    try:
+        asyncio.run(wait_until_listening(ports[-1]))
+        hosts = [f"127.0.0.1:{port}" for port in ports]
+        print(f"cameras={args.cameras} operators/camera={args.operators} stub latency={args.latency_ms}ms "
+              f"duration={args.duration}s")
+        for mode in args.modes.split(","):
+            if mode == "async":
+                report(mode, *asyncio.run(run_async(hosts, args.operators, args.duration)))
+            elif mode == "sync":
+                report(mode, *run_sync(hosts, args.operators, args.duration))
+    finally:
+        stub.terminate()
+        stub.join()
+
+
+if __name__ == "__main__":
+    main()
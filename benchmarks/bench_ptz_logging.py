@@ -0,0 +1,127 @@
+"""
+Цена логирования на пути /api/ptz: пропускная способность при одновременных
+клиентах с логированием на INFO и без него.
+
+Режимы логирования сервера:
+  off   - логирование выключено (LOG_LEVEL = "OFF"), нижняя граница;
+  info  - как в работе: JSON через очередь и фоновый поток, ограничение частоты
+          повторяющихся сообщений (structured_logging.py);
+  sync  - для сравнения: StreamHandler без очереди и без ограничений, запись в
+          stderr прямо в потоке запроса, как раньше делал print.
+
+Сервер запускается отдельным процессом через app.run_server(), stderr пишется
+в файл (как journald), камера - сгенерированный H.264 файл, PTZ - заглушка
+ONVIF (stub_onvif.py) с "камерой" на каждого клиента. Клиенты шлют пачки по N
+одновременных PTZ move с "wait": true. Печатаются запросы/с, перцентили
+задержки, ошибки и объем лога за замер.
+
+Запуск: python benchmarks/bench_ptz_logging.py --logging off,info,sync --concurrency 1,12,50 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import aiohttp
+
+from bench_http_modes import CLIENT_TIMEOUT, run_level, wait_until_ready, write_test_video
+from bench_utils import REPO_ROOT, latency_summary
+from stub_onvif import start_stub_process, wait_until_listening
+
+
+# --- Сервер (отдельный процесс) ---
+def serve(log_mode, server_mode, port, signaling_port, video_path):
+    from aiortc.contrib.media import MediaPlayer # type: ignore
+    import app
+    from structured_logging import setup_logging
+
+    async def open_test_video(url, options=None):
+        return MediaPlayer(url, decode=False, loop=True)
+
+    if log_mode == "sync":
+        setup_logging("OFF")
+        logging.disable(logging.NOTSET)
+        logging.basicConfig(level=logging.INFO, stream=sys.stderr, force=True)
+    else:
+        setup_logging("OFF" if log_mode == "off" else "INFO")
+    app.open_rtsp_player = open_test_video
+    app.DEFAULT_RTSP_URL = video_path
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", signaling_port
+    app.run_server(server_mode)
+
+
+def start_server(log_mode, args, video_path, log_file):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", log_mode, "--server", args.server,
+         "--port", str(args.port), "--signaling-port", str(args.port + 1), "--video", video_path],
+        cwd=REPO_ROOT, stdout=log_file, stderr=log_file)
+
+
+# --- Клиенты ---
+async def run_logging_mode(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    timeout = aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_until_ready(session, base_url)
+        for concurrency in args.concurrency:
+            moves = [{"camera_ip": f"127.0.0.1:{args.stub_port + i}", "camera_type": "YCC365",
+                      "onvif_user": "admin", "onvif_password": "admin",
+                      "action": "move", "pan": 0.5, "wait": True} for i in range(concurrency)]
+            # Прогрев: keep-alive соединения к заглушке и первые записи лога
+            await run_level(session, f"{base_url}/api/ptz", moves, 1)
+            results.append((concurrency,) + await run_level(session, f"{base_url}/api/ptz", moves, args.rounds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logging", default="off,info,sync")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--concurrency", default="1,12,50")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--port", type=int, default=5200)
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответа заглушки камеры")
+    parser.add_argument("--serve", choices=("off", "info", "sync"), help=argparse.SUPPRESS)
+    parser.add_argument("--signaling-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--video", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.server, args.port, args.signaling_port, args.video)
+        return
+
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    stub = start_stub_process(list(range(args.stub_port, args.stub_port + max(args.concurrency))), args.latency_ms)
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, "camera.mp4")
+        write_test_video(video_path)
+        asyncio.run(wait_until_listening(args.stub_port))
+        print(f"server={args.server} rounds={args.rounds} camera latency={args.latency_ms}ms")
+        print(f"{'logging':7} {'conc':>4} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>6} {'log KB':>8}")
+        try:
+            for log_mode in args.logging.split(","):
+                log_path = os.path.join(tmp, f"{log_mode}.log")
+                with open(log_path, "wb") as log_file:
+                    server = start_server(log_mode, args, video_path, log_file)
+                    try:
+                        results = asyncio.run(run_logging_mode(args))
+                    finally:
+                        server.terminate()
+                        server.wait()
+                log_kb = os.path.getsize(log_path) / 1024
+                for concurrency, rate, latencies, errors in results:
+                    summary = latency_summary(latencies)
+                    print(f"{log_mode:7} {concurrency:4} {rate:8.1f} {summary['p50_ms']:8.1f} "
+                          f"{summary['p99_ms']:8.1f} {summary['max_ms']:8.1f} {errors:6} {log_kb:8.1f}")
+        finally:
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Журнал для разбора инцидентов: запись в сегменты через mmap (timeseries_recorder.py)
+против строки JSON в файл на каждое событие (json.dumps + write + flush, как
+простой журнал в лог).
+
+Пишется --records записей вперемешку (команды PTZ, вход и статус платформы,
+статистика потока) по --keys ключам; сегменты маленькие (--segment-mb), чтобы
+ротация и удаление старых попадали в замер. Печатаются: время одной записи
+(p50/p99/max - max показывает ротацию), записей в секунду и байт на запись на
+диске. Затем запрос query() за последние 1 с, 60 с записи и все время: время и число
+записей, и тот же запрос одного вида и одного ключа.
+
+Запуск: python benchmarks/bench_recorder.py --records 1000000 --segment-mb 8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from bench_utils import percentile
+from timeseries_recorder import RecordKind, TimeSeriesRecorder
+
+KINDS = (RecordKind.PTZ_COMMAND, RecordKind.DRIVE_INPUT, RecordKind.DRIVE_STATUS, RecordKind.STREAM_STATS)
+
+
+def write_recorder(directory, args):
+    recorder = TimeSeriesRecorder(directory, args.segment_mb * 2**20, args.max_mb * 2**20)
+    keys = [f"key-{i}" for i in range(args.keys)]
+    durations = []
+    clock = time.perf_counter
+    started = clock()
+    for i in range(args.records):
+        t0 = clock()
+        recorder.record(KINDS[i % len(KINDS)], keys[i % args.keys], i & 0xFF, i * 0.5, -i * 0.5, 0.25, float("nan"), i & 1)
+        durations.append(clock() - t0)
+    elapsed = clock() - started
+    recorder.close()
+    return recorder, durations, elapsed
+
+
+def write_jsonl(path, args):
+    keys = [f"key-{i}" for i in range(args.keys)]
+    durations = []
+    clock = time.perf_counter
+    started = clock()
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(args.records):
+            t0 = clock()
+            f.write(json.dumps({"t": time.time(), "kind": KINDS[i % len(KINDS)].name, "key": keys[i % args.keys],
+                                "code": i & 0xFF, "v": [i * 0.5, -i * 0.5, 0.25, None], "flags": i & 1}) + "\n")
+            f.flush()
+            durations.append(clock() - t0)
+    return durations, clock() - started
+
+
+def print_write(name, durations, elapsed, disk_bytes, records):
+    ordered = sorted(durations)
+    print(f"{name:9} {percentile(ordered, 50) * 1e6:8.2f} {percentile(ordered, 99) * 1e6:8.2f} {ordered[-1] * 1e6:9.0f} "
+          f"{records / elapsed:10.0f} {disk_bytes / records:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--keys", type=int, default=8, help="Камер, операторов и сессий")
+    parser.add_argument("--segment-mb", type=int, default=8)
+    parser.add_argument("--max-mb", type=int, default=64, help="Предел всех сегментов (удаление старых)")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов каждого запроса")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_recorder_")
+    try:
+        print(f"records={args.records} keys={args.keys} segment={args.segment_mb}MB max={args.max_mb}MB")
+        print(f"{'writer':9} {'p50 us':>8} {'p99 us':>8} {'max us':>9} {'records/s':>10} {'B/rec':>6}")
+        recorder, durations, elapsed = write_recorder(os.path.join(directory, "segments"), args)
+        written_at = time.time()
+        stored = len(recorder.query())
+        print_write("mmap", durations, elapsed, recorder.snapshot()["disk_bytes"], stored)
+        jsonl_path = os.path.join(directory, "events.jsonl")
+        durations, elapsed = write_jsonl(jsonl_path, args)
+        print_write("jsonl", durations, elapsed, os.path.getsize(jsonl_path), args.records)
+        print(f"(mmap хранит {stored} последних записей в {recorder.snapshot()['segments']} сегментах)")
+
+        print(f"\n{'query':14} {'ms':>8} {'records':>9}")
+        for label, start in (("last 1s", written_at - 1), ("last 60s", written_at - 60), ("all", None)):
+            for suffix, kwargs in (("", {}), (" kind", {"kinds": RecordKind.DRIVE_INPUT}), (" key", {"key": "key-0"})):
+                timings = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    result = recorder.query(start, **kwargs)
+                    timings.append(time.perf_counter() - t0)
+                print(f"{label + suffix:14} {min(timings) * 1000:8.2f} {len(result):9}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Масштабирование перекода по числу зрителей: общий энкодер (одна рендиция на
+всех) против отдельного энкодера aiortc в каждом пире.
+
+Сервер (этот процесс) раздает синтетический источник через MediaRelay в N
+RTCPeerConnection, как offer_async_logic в app.py. Клиенты - локальные aiortc
+пиры в отдельном процессе; они не декодируют видео (NullDecoder только считает
+кадры), чтобы их CPU не попадал в измерение и не отнимал ядро у сервера.
+Для каждого N печатается CPU и RSS серверного процесса и доставленные кадры.
+
+Запуск: python benchmarks/bench_shared_encode.py --peers 1,5,20,50 --duration 10
+"""
+import argparse
+import asyncio
+import fractions
+import multiprocessing
+import time
+
+import av # type: ignore
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender, RTCSessionDescription # type: ignore
+from aiortc.contrib.media import MediaRelay # type: ignore
+
+from bench_utils import rss_bytes
+from shared_encoder import EncodingParams, SharedEncodedTrack
+
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+
+
+class SyntheticVideoTrack(MediaStreamTrack):
+    """Живой источник: движущаяся полоса в реальном времени, кадры заранее сгенерированы."""
+    kind = "video"
+
+    def __init__(self, width, height, fps, patterns=30):
+        super().__init__()
+        self.fps = fps
+        self._frames = []
+        for i in range(patterns):
+            frame = av.VideoFrame(width, height, "yuv420p")
+            bar = (i * width // patterns) & ~1
+            row = bytes(255 if bar <= x < bar + width // 8 else (x * 255 // width) for x in range(width))
+            frame.planes[0].update(row * height)
+            frame.planes[1].update(bytes([128]) * (frame.planes[1].buffer_size))
+            frame.planes[2].update(bytes([128]) * (frame.planes[2].buffer_size))
+            self._frames.append(frame)
+        self._index = 0
+        self._started = None
+
+    async def recv(self):
+        if self._started is None:
+            self._started = time.perf_counter()
+        deadline = self._started + self._index / self.fps
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        template = self._frames[self._index % len(self._frames)]
+        frame = av.VideoFrame(template.width, template.height, "yuv420p")
+        for plane, source in zip(frame.planes, template.planes):
+            plane.update(bytes(source))
+        frame.pts = int(self._index * 90000 / self.fps)
+        frame.time_base = VIDEO_TIME_BASE
+        self._index += 1
+        return frame
+
+
+# --- Клиенты (отдельный процесс) ---
+def _client_process(conn):
+    import aiortc.rtcrtpreceiver as rtcrtpreceiver # type: ignore
+
+    decoders = []
+
+    class NullDecoder:
+        def __init__(self):
+            self.frames = 0
+            decoders.append(self)
+
+        def decode(self, encoded_frame):
+            self.frames += 1
+            return []
+
+    rtcrtpreceiver.get_decoder = lambda codec: NullDecoder()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        pcs = []
+        while True:
+            command, arg = await loop.run_in_executor(None, conn.recv)
+            if command == "offers":
+                offers = []
+                for _ in range(arg):
+                    pc = RTCPeerConnection()
+                    pc.addTransceiver("video", direction="recvonly")
+                    await pc.setLocalDescription(await pc.createOffer())
+                    pcs.append(pc)
+                    offers.append(pc.localDescription.sdp)
+                conn.send(offers)
+            elif command == "answers":
+                for pc, sdp in zip(pcs, arg):
+                    await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="answer"))
+                conn.send(True)
+            elif command == "frames":
+                conn.send(sum(d.frames for d in decoders))
+            elif command == "close":
+                await asyncio.gather(*(pc.close() for pc in pcs))
+                pcs.clear()
+                decoders.clear()
+                conn.send(True)
+            elif command == "exit":
+                return
+
+    asyncio.run(run())
+
+
+async def _client_call(conn, command, arg=None):
+    loop = asyncio.get_running_loop()
+    conn.send((command, arg))
+    return await loop.run_in_executor(None, conn.recv)
+
+
+def h264_capabilities():
+    return [c for c in RTCRtpSender.getCapabilities("video").codecs
+            if c.mimeType.lower() in ("video/h264", "video/rtx")]
+
+
+async def run_case(conn, mode, peers, args):
+    relay = MediaRelay()
+    source = SyntheticVideoTrack(args.width, args.height, args.fps)
+    rendition = None
+    if mode == "shared":
+        rendition = SharedEncodedTrack(relay.subscribe(source, buffered=False),
+                                       EncodingParams("h264", None, None, args.bitrate))
+
+    offers = await _client_call(conn, "offers", peers)
+    server_pcs, answers = [], []
+    for sdp in offers:
+        pc = RTCPeerConnection()
+        if rendition is not None:
+            sender = pc.addTrack(relay.subscribe(rendition))
+            sender._send_keyframe = rendition.request_keyframe
+        else:
+            sender = pc.addTrack(relay.subscribe(source))
+        next(t for t in pc.getTransceivers() if t.sender is sender).setCodecPreferences(h264_capabilities())
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        server_pcs.append(pc)
+        answers.append(pc.localDescription.sdp)
+    await _client_call(conn, "answers", answers)
+
+    await asyncio.sleep(args.warmup)
+    frames_started = await _client_call(conn, "frames")
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.duration)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    frames = await _client_call(conn, "frames") - frames_started
+    rss = rss_bytes()
+
+    await _client_call(conn, "close")
+    await asyncio.gather(*(pc.close() for pc in server_pcs))
+    if rendition is not None:
+        rendition.stop()
+    source.stop()
+    return {
+        "cpu_percent": cpu / wall * 100,
+        "rss_mb": rss / 2**20,
+        "fps_per_peer": frames / wall / peers,
+        "encoders": 1 if rendition is not None else peers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", default="1,5,20,50")
+    parser.add_argument("--modes", default="shared,per-peer")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--bitrate", type=int, default=1_000_000)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    conn, client_conn = multiprocessing.Pipe()
+    client = multiprocessing.Process(target=_client_process, args=(client_conn,), daemon=True)
+    client.start()
+    try:
+        print(f"source {args.width}x{args.height}@{args.fps} h264 {args.bitrate} bps, duration={args.duration}s")
+        print(f"{'mode':9} {'peers':>5} {'encoders':>8} {'cpu %':>7} {'rss MB':>7} {'fps/peer':>8}")
+        for mode in args.modes.split(","):
+            for peers in (int(p) for p in args.peers.split(",")):
+                result = asyncio.run(run_case(conn, mode, peers, args))
+                print(f"{mode:9} {peers:5} {result['encoders']:8} {result['cpu_percent']:7.1f} "
+                      f"{result['rss_mb']:7.1f} {result['fps_per_peer']:8.1f}")
+    finally:
+        conn.send(("exit", None))
+        client.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
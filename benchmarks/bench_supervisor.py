@@ -0,0 +1,323 @@
+"""
+Потоков на хост по числу воркеров супервизора (gateway_supervisor.py).
+
+Шлюз - отдельный процесс: --workers 0 - один процесс (режим asgi, как без
+супервизора), N - фронт и N воркеров (режим supervisor). Камеры - сгенерированный
+H.264 ролик, пакеты которого идут по кругу в темпе камеры вместо RTSP, у каждой камеры
+свой хост в rtsp_url (rtsp://bench-cam-<i>/), поэтому у каждой свой ingest,
+декодер и общий энкодер, и супервизор раскладывает камеры по воркерам. На камеру
+--viewers зрителей: aiortc пиры в отдельном процессе, подключаются через
+/ws/signaling фронта и не декодируют видео (NullDecoder только считает кадры),
+чтобы их CPU не отнимал ядра у шлюза.
+
+Для каждого числа воркеров камеры добавляются по списку --cameras. Печатаются
+кадры/с на зрителя (среднее и минимум), CPU всех процессов шлюза (100% - одно
+ядро), их RSS и держит ли шлюз потоки: минимум не ниже --keep от fps ролика.
+Итог - наибольшее число потоков (камеры * зрители), которое шлюз держит при
+данном числе воркеров. Масштабирование видно, только если у машины больше одного
+ядра: воркеров больше, чем ядер, смысла нет.
+
+Запуск: python benchmarks/bench_supervisor.py --workers 0,1,2,4 --cameras 1,2,4,8 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import av # type: ignore
+from aiortc import RTCPeerConnection, RTCSessionDescription # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from bench_http_modes import write_test_video
+from bench_utils import REPO_ROOT
+from stub_onvif import wait_until_listening
+
+FPS = 30
+READY_TIMEOUT = 60.0
+
+
+# --- Шлюз: фронт и воркеры (отдельные процессы) ---
+class LoopedCameraVideo:
+    """
+    H.264 пакеты ролика по кругу в темпе камеры, pts растут без скачков назад. MediaPlayer
+    aiortc с loop=True без декодирования читает файл без пауз и занял бы ядро сам.
+    """
+
+    def __init__(self, video_path, fps):
+        self._container = av.open(video_path)
+        stream = self._container.streams.video[0]
+        self._packets = [packet for packet in self._container.demux(stream) if packet.size]
+        self._step = int(round(1 / (fps * stream.time_base)))
+        self._fps = fps
+        self._started = None
+        self._sent = 0
+        self._stopped = False
+
+    async def recv(self):
+        if self._stopped:
+            raise MediaStreamError
+        if self._started is None:
+            self._started = time.monotonic()
+        delay = self._started + self._sent / self._fps - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        packet = self._packets[self._sent % len(self._packets)]
+        packet.pts = packet.dts = self._sent * self._step
+        self._sent += 1
+        return packet
+
+    def stop(self):
+        if not self._stopped:
+            self._stopped = True
+            self._container.close()
+
+
+class LoopedCamera:
+    """Замена MediaPlayer для RtspIngest: только видео."""
+
+    def __init__(self, video_path, fps):
+        self.audio = None
+        self.video = LoopedCameraVideo(video_path, fps)
+
+
+def patch_camera(app, video_path):
+    async def open_test_video(url, options=None):
+        return LoopedCamera(video_path, FPS)
+
+    app.open_rtsp_player = open_test_video
+    app.drive_relay.url = ""
+    app.RECORDING = app.recorder.enabled = False
+    app.peer_sessions.max_sessions = app.peer_sessions.max_per_client = 1000  # Все зрители с 127.0.0.1
+
+
+def serve(workers, port, video_path):
+    import app
+    patch_camera(app, video_path)
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", port + 1
+    app.SUPERVISOR_WORKERS = workers
+    app.worker_command = lambda index, socket_path: [
+        sys.executable, os.path.abspath(__file__), "--serve-worker", str(index), "--worker-socket", socket_path,
+        "--video", video_path]
+    app.run_server("supervisor" if workers else "asgi")
+
+
+def serve_worker(index, socket_path, video_path):
+    import app
+    patch_camera(app, video_path)
+    app.run_worker(index, socket_path)
+
+
+def start_gateway(workers, args, video_path):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(workers), "--port", str(args.port),
+         "--video", video_path],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def gateway_pids(session, base_url, front_pid, workers):
+    """pid фронта и воркеров, когда все воркеры прошли проверку."""
+    deadline = time.monotonic() + READY_TIMEOUT
+    while True:
+        if not workers:
+            return [front_pid]
+        try:
+            async with session.get(f"{base_url}/api/workers") as response:
+                state = await response.json()
+            if all(worker["state"] == "up" for worker in state["workers"]):
+                return [front_pid] + [worker["pid"] for worker in state["workers"]]
+        except (aiohttp.ClientError, ValueError):
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("Воркеры не поднялись")
+        await asyncio.sleep(0.2)
+
+
+def process_usage(pids):
+    """(CPU секунд, RSS байт) процессов pids из /proc (Linux)."""
+    ticks, rss = 0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as statm:
+                rss += int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])  # utime, stime
+    return ticks / os.sysconf("SC_CLK_TCK"), rss
+
+
+# --- Зрители (отдельный процесс) ---
+def _client_process(conn):
+    import aiortc.rtcrtpreceiver as rtcrtpreceiver # type: ignore
+
+    decoders = []
+
+    class NullDecoder:
+        def __init__(self):
+            self.frames = 0
+            decoders.append(self)
+
+        def decode(self, encoded_frame):
+            self.frames += 1
+            return []
+
+    rtcrtpreceiver.get_decoder = lambda codec: NullDecoder()
+
+    async def connect(session, url, rtsp_url, pcs, sockets):
+        pc = RTCPeerConnection()
+        pcs.append(pc)
+        pc.addTransceiver("video", direction="recvonly")
+        await pc.setLocalDescription(await pc.createOffer())
+        ws = await session.ws_connect(url)
+        sockets.append(ws)
+        await ws.send_json({"type": "offer", "sdp": pc.localDescription.sdp, "rtsp_url": rtsp_url})
+        message = await ws.receive_json()
+        if message.get("type") != "answer":
+            return False
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=message["sdp"], type="answer"))
+        return True
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        session = aiohttp.ClientSession()
+        pcs, sockets = [], []
+        while True:
+            command, arg = await loop.run_in_executor(None, conn.recv)
+            if command == "connect":
+                url, rtsp_urls = arg
+                results = await asyncio.gather(*(connect(session, url, rtsp_url, pcs, sockets)
+                                                 for rtsp_url in rtsp_urls), return_exceptions=True)
+                conn.send(sum(result is True for result in results))
+            elif command == "frames":
+                conn.send([decoder.frames for decoder in decoders])
+            elif command == "close":
+                await asyncio.gather(*(ws.close() for ws in sockets), *(pc.close() for pc in pcs))
+                pcs.clear()
+                sockets.clear()
+                decoders.clear()
+                conn.send(True)
+            elif command == "exit":
+                await session.close()
+                return
+
+    asyncio.run(run())
+
+
+async def _client_call(conn, command, arg=None):
+    loop = asyncio.get_running_loop()
+    conn.send((command, arg))
+    return await loop.run_in_executor(None, conn.recv)
+
+
+async def run_case(conn, pids, cameras, args):
+    rtsp_urls = [f"rtsp://bench-cam-{camera}/" for camera in range(cameras) for _ in range(args.viewers)]
+    connected = await _client_call(conn, "connect", (f"ws://127.0.0.1:{args.port + 1}/ws/signaling", rtsp_urls))
+    await asyncio.sleep(args.warmup)
+    frames_started = await _client_call(conn, "frames")
+    cpu_started, _ = process_usage(pids)
+    wall_started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    wall = time.perf_counter() - wall_started
+    cpu, rss = process_usage(pids)
+    frames = await _client_call(conn, "frames")
+    await _client_call(conn, "close")
+
+    started = frames_started + [0] * (len(frames) - len(frames_started))
+    rates = [(now - before) / wall for now, before in zip(frames, started)]
+    rates += [0.0] * (len(rtsp_urls) - len(rates))  # Зрители, не получившие ни кадра
+    return {
+        "streams": len(rtsp_urls),
+        "connected": connected,
+        "fps_mean": sum(rates) / len(rates),
+        "fps_min": min(rates),
+        "cpu_percent": (cpu - cpu_started) / wall * 100,
+        "rss_mb": rss / 2**20,
+    }
+
+
+async def run_workers(conn, workers, args, video_path):
+    gateway = start_gateway(workers, args, video_path)
+    results = []
+    try:
+        for port in (args.port, args.port + 1):
+            await wait_until_listening(port, timeout=READY_TIMEOUT)
+        async with aiohttp.ClientSession() as session:
+            pids = await gateway_pids(session, f"http://127.0.0.1:{args.port}", gateway.pid, workers)
+        for cameras in args.cameras:
+            result = await run_case(conn, pids, cameras, args)
+            results.append((cameras, result))
+            if result["fps_min"] < args.keep * FPS / 2:
+                break  # Дальше шлюз только сильнее отстает
+            # Источники прошлого замера закрываются по idle таймауту - не в счет следующему
+            await asyncio.sleep(args.pause)
+    finally:
+        gateway.terminate()
+        gateway.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="0,1,2,4", help="Воркеров, через запятую; 0 - один процесс (asgi)")
+    parser.add_argument("--cameras", default="1,2,4,8", help="Камер, через запятую")
+    parser.add_argument("--viewers", type=int, default=1, help="Зрителей на камеру")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=3.0, help="Секунд до замера (ICE, первый ключевой кадр)")
+    parser.add_argument("--pause", type=float, default=3.0, help="Пауза между замерами")
+    parser.add_argument("--size", default="640x360", help="Кадр ролика камеры")
+    parser.add_argument("--keep", type=float, default=0.9, help="Доля fps ролика, при которой поток держится")
+    parser.add_argument("--port", type=int, default=5500)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serve-worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-socket", help=argparse.SUPPRESS)
+    parser.add_argument("--video", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, args.port, args.video)
+        return
+    if args.serve_worker is not None:
+        serve_worker(args.serve_worker, args.worker_socket, args.video)
+        return
+
+    args.cameras = [int(c) for c in args.cameras.split(",")]
+    parent_conn, child_conn = multiprocessing.Pipe()
+    clients = multiprocessing.Process(target=_client_process, args=(child_conn,), daemon=True)
+    clients.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            video_path = os.path.join(tmp, "camera.mp4")
+            width, height = (int(v) for v in args.size.split("x"))
+            write_test_video(video_path, width, height, fps=FPS)
+            print(f"cpus={os.cpu_count()} viewers/camera={args.viewers} source={args.size}@{FPS}fps duration={args.duration}s "
+                  f"keep>={args.keep:g}")
+            print(f"{'workers':>7} {'cameras':>7} {'streams':>7} {'conn':>4} {'fps avg':>7} {'fps min':>7} "
+                  f"{'cpu %':>6} {'rss MB':>7} {'ok':>3}")
+            summary = []
+            for workers in (int(w) for w in args.workers.split(",")):
+                kept = 0
+                for cameras, result in asyncio.run(run_workers(parent_conn, workers, args, video_path)):
+                    ok = result["connected"] == result["streams"] and result["fps_min"] >= args.keep * FPS
+                    if ok:
+                        kept = max(kept, result["streams"])
+                    print(f"{workers:7} {cameras:7} {result['streams']:7} {result['connected']:4} "
+                          f"{result['fps_mean']:7.1f} {result['fps_min']:7.1f} {result['cpu_percent']:6.0f} "
+                          f"{result['rss_mb']:7.0f} {'yes' if ok else 'no':>3}")
+                summary.append((workers, kept))
+            print("\nstreams per host: " + json.dumps({("asgi" if w == 0 else f"{w} workers"): k for w, k in summary},
+                                                      ensure_ascii=False))
+    finally:
+        parent_conn.send(("exit", None))
+        clients.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Рассылка телеметрии зрителям: хаб с последним значением на подписчика
+(telemetry_hub.py, /ws/telemetry?ack=1, зрители подтверждают сообщения) против
+прежней рассылки - задача отправки на каждое изменение каждому клиенту (как
+DriveRelay._publish до хаба).
+
+Шлюз - отдельный процесс; в нем публикатор --rate раз в секунду публикует тему
+"bench" со временем time.monotonic() (CLOCK_MONOTONIC общий для процессов) и
+--payload байтами состояния. Зрители:
+  быстрые (--viewers) - читают сразу;
+  медленный - читает с паузой --slow-ms после каждого сообщения (слабый Wi-Fi);
+  зависший (--stalled) - подключился и не читает (вкладка в фоне, сеть пропала).
+У медленного и зависшего маленький SO_RCVBUF, чтобы давление дошло до шлюза
+за секунды, а не после мегабайтов буферов ядра.
+
+Печатаются: возраст значения при получении у быстрых (p50/p99) и у медленного
+(p50/max), сообщений в секунду быстрому, задач отправки, ждущих в шлюзе, байт
+в очередях отправки ядра у сокетов шлюза (/proc/net/tcp), RSS шлюза и сколько
+зависших хаб отключил по TELEMETRY_SEND_TIMEOUT.
+
+Запуск: python benchmarks/bench_telemetry.py --modes fanout,hub --viewers 1,10,50 --duration 10
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from bench_utils import REPO_ROOT, latency_summary, rss_bytes
+from stub_onvif import wait_until_listening
+
+SMALL_RCVBUF = 4096
+WARMUP = 1.0
+
+
+def server_send_queue(port):
+    """Байт в очередях отправки ядра у сокетов, слушающих port (Linux /proc/net/tcp)."""
+    total = 0
+    with open("/proc/net/tcp") as table:
+        next(table)
+        for line in table:
+            fields = line.split()
+            if int(fields[1].split(":")[1], 16) == port:
+                total += int(fields[4].split(":")[0], 16)
+    return total
+
+
+# --- Шлюз (отдельный процесс) ---
+def serve(port, signaling_port):
+    import app
+    from asgi_server import WebSocketClosed, json_response
+
+    app.drive_relay.url = ""   # ESP32 нет: в хаб публикует только бенчмарк
+    app.HTTP_HOST, app.HTTP_PORT = "127.0.0.1", port
+    app.WEBRTC_SIGNALING_HOST, app.WEBRTC_SIGNALING_PORT = "127.0.0.1", signaling_port
+    fanout_clients = set()
+    state = {"pending": 0, "publisher": None}
+
+    @app.signaling_app.websocket("/ws/bench-fanout")
+    async def fanout_websocket(websocket):
+        await websocket.accept()
+        fanout_clients.add(websocket)
+        try:
+            while True:
+                await websocket.receive()
+        except WebSocketClosed:
+            pass
+        finally:
+            fanout_clients.discard(websocket)
+
+    async def deliver(websocket, message):
+        state["pending"] += 1
+        try:
+            await websocket.send_json(message)
+        except Exception:
+            pass
+        finally:
+            state["pending"] -= 1
+
+    async def publisher(rate, payload):
+        n = 0
+        while True:
+            n += 1
+            value = {"t": time.monotonic(), "n": n, "state": "x" * payload}
+            app.telemetry.publish("bench", value)
+            message = {"type": "telemetry", "full": False, "seq": n, "topics": {"bench": value}}
+            for websocket in list(fanout_clients):
+                asyncio.ensure_future(deliver(websocket, message))
+            await asyncio.sleep(1.0 / rate)
+
+    @app.asgi_app.route("/bench/start", methods=("POST",))
+    async def bench_start(request):
+        state["publisher"] = asyncio.ensure_future(
+            publisher(float(request.query["rate"]), int(request.query["payload"])))
+        return json_response({"ok": True})
+
+    @app.asgi_app.route("/bench/stats")
+    async def bench_stats(request):
+        return json_response({"pending": state["pending"], "rss": rss_bytes(), "dropped": app.telemetry.dropped})
+
+    app.run_server("asgi")
+
+
+def start_gateway(args):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--gateway-port", str(args.gateway_port)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# --- Зрители: свой WebSocket клиент, чтобы задать SO_RCVBUF до подключения ---
+class Viewer:
+    def __init__(self, delay=0.0, rcvbuf=None, reading=True, ack=False):
+        self.delay = delay
+        self.ack = ack
+        self.rcvbuf = rcvbuf
+        self.reading = reading
+        self.ages = []
+        self.messages = 0
+        self.sock = None
+        self._buffer = bytearray()
+
+    async def connect(self, port, path):
+        loop = asyncio.get_running_loop()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        self.sock.setblocking(False)
+        await loop.sock_connect(self.sock, ("127.0.0.1", port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        await loop.sock_sendall(self.sock, (
+            f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        while b"\r\n\r\n" not in self._buffer:
+            self._buffer += await self._recv()
+        headers, _, rest = bytes(self._buffer).partition(b"\r\n\r\n")
+        if b" 101 " not in headers.split(b"\r\n", 1)[0]:
+            raise RuntimeError(f"WebSocket не принят: {headers[:100]!r}")
+        self._buffer = bytearray(rest)
+
+    async def _recv(self):
+        chunk = await asyncio.get_running_loop().sock_recv(self.sock, 65536)
+        if not chunk:
+            raise ConnectionError("Шлюз закрыл соединение")
+        return chunk
+
+    async def _read_exact(self, size):
+        while len(self._buffer) < size:
+            self._buffer += await self._recv()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def _frame(self):
+        first, second = await self._read_exact(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self._read_exact(8))[0]
+        return first & 0x0F, await self._read_exact(length)
+
+    async def _send_text(self, text):
+        payload = text.encode()
+        mask = os.urandom(4)
+        header = bytes((0x81, 0x80 | len(payload))) if len(payload) < 126 else \
+            bytes((0x81, 0x80 | 126)) + struct.pack("!H", len(payload))
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        await asyncio.get_running_loop().sock_sendall(self.sock, header + mask + masked)
+
+    async def run(self, measure_from):
+        if not self.reading:
+            await asyncio.Event().wait()
+        while True:
+            opcode, payload = await self._frame()
+            if opcode == 0x8:
+                return
+            if opcode != 0x1:
+                continue
+            message = json.loads(payload)
+            value = message["topics"].get("bench")
+            now = time.monotonic()
+            if value is not None and value["t"] >= measure_from:
+                self.ages.append(now - value["t"])
+                self.messages += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.ack:
+                await self._send_text(json.dumps({"type": "ack", "seq": message["seq"]}))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+async def run_mode(mode, viewers, args):
+    hub = mode == "hub"
+    path = "/ws/telemetry?topics=bench&ack=1" if hub else "/ws/bench-fanout"
+    fast = [Viewer(ack=hub) for _ in range(viewers)]
+    slow = Viewer(args.slow_ms / 1000, SMALL_RCVBUF, ack=hub)
+    stalled = [Viewer(rcvbuf=SMALL_RCVBUF, reading=False) for _ in range(args.stalled)]
+    everyone = fast + [slow] + stalled
+    for viewer in everyone:
+        await viewer.connect(args.gateway_port + 1, path)
+    base_url = f"http://127.0.0.1:{args.gateway_port}"
+    measure_from = time.monotonic() + WARMUP
+    tasks = [asyncio.ensure_future(viewer.run(measure_from)) for viewer in everyone]
+    async with aiohttp.ClientSession() as session:
+        await session.post(f"{base_url}/bench/start", params={"rate": str(args.rate), "payload": str(args.payload)})
+        await asyncio.sleep(WARMUP + args.duration)
+        async with session.get(f"{base_url}/bench/stats") as response:
+            stats = await response.json()
+        send_queue = server_send_queue(args.gateway_port + 1)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for viewer in everyone:
+        viewer.close()
+    return {
+        "fast": latency_summary([age for viewer in fast for age in viewer.ages]),
+        "fast_rate": sum(viewer.messages for viewer in fast) / len(fast) / args.duration if fast else 0.0,
+        "slow": latency_summary(slow.ages),
+        "pending": stats["pending"],
+        "send_queue": send_queue,
+        "rss": stats["rss"],
+        "dropped": stats["dropped"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="fanout,hub")
+    parser.add_argument("--viewers", default="1,10,50", help="Быстрых зрителей, через запятую")
+    parser.add_argument("--stalled", type=int, default=2, help="Зрителей, которые не читают")
+    parser.add_argument("--slow-ms", type=float, default=200.0, help="Пауза медленного зрителя после сообщения")
+    parser.add_argument("--rate", type=float, default=10.0, help="Публикаций в секунду")
+    parser.add_argument("--payload", type=int, default=2048, help="Байт состояния в публикации")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--gateway-port", type=int, default=5400)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.gateway_port, args.gateway_port + 1)
+        return
+
+    print(f"duration={args.duration}s rate={args.rate:g}/s payload={args.payload}B stalled={args.stalled} "
+          f"slow={args.slow_ms:g}ms/msg")
+    print(f"{'mode':6} {'fast':>4} {'fast p50':>8} {'fast p99':>8} {'msg/s':>6} {'slow p50':>8} {'slow max':>8} "
+          f"{'pending':>7} {'queue KB':>8} {'rss MB':>6} {'dropped':>7}")
+    for viewers in (int(v) for v in args.viewers.split(",")):
+        for mode in args.modes.split(","):
+            gateway = start_gateway(args)
+            try:
+                for port in (args.gateway_port, args.gateway_port + 1):
+                    asyncio.run(wait_until_listening(port, timeout=30.0))
+                result = asyncio.run(run_mode(mode, viewers, args))
+            finally:
+                gateway.terminate()
+                gateway.wait()
+            print(f"{mode:6} {viewers:4} {result['fast']['p50_ms']:8.1f} {result['fast']['p99_ms']:8.1f} "
+                  f"{result['fast_rate']:6.1f} {result['slow']['p50_ms']:8.1f} {result['slow']['max_ms']:8.1f} "
+                  f"{result['pending']:7} {result['send_queue'] / 1024:8.0f} {result['rss'] / 2**20:6.1f} {result['dropped']:7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Формат сообщений платформы: JSON против бинарного platform_wire.py.
+
+Для drive (браузер/шлюз -> ESP32) и status_update (ESP32 -> шлюз/браузер)
+печатаются: время кодирования и разбора одного сообщения в Python (сторона
+шлюза), размер полезной нагрузки и WebSocket кадра (кадры клиента маскируются:
++4 байта) и трафик в секунду при DRIVE_CONTROL_RATE команд и статусе каждые
+200 мс на ответ и рассылку. Стоимость ArduinoJson на ESP32 здесь не измерить -
+ее снимает бинарный путь прошивки целиком (ни разбора, ни Serial.printf).
+
+Запуск: python benchmarks/bench_wire_format.py --number 200000
+"""
+import argparse
+import json
+import timeit
+
+from bench_utils import REPO_ROOT  # noqa: F401  (путь к модулям репозитория)
+from drive_relay import DRIVE_CONTROL_RATE
+from platform_wire import decode, encode_drive, encode_status
+
+STATUS_RATE = 5.0   # Рассылка статуса прошивкой каждые 200 мс
+
+
+def ws_frame_size(payload_size, masked):
+    header = 2 if payload_size < 126 else 4
+    return header + (4 if masked else 0) + payload_size
+
+
+def json_drive(left, right):
+    return json.dumps({"command": "drive", "payload": {"left": left, "right": right}})
+
+
+def json_status(motor_left, motor_right):
+    return json.dumps({"type": "status_update", "data": {"motorL": motor_left, "motorR": motor_right}})
+
+
+def measure(name, encode, payload, number):
+    encode_s = timeit.timeit(encode, number=number) / number
+    decode_s = timeit.timeit(lambda: (json.loads if isinstance(payload, str) else decode)(payload),
+                             number=number) / number
+    return name, encode_s, decode_s, len(payload.encode() if isinstance(payload, str) else payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000, help="Повторов на замер")
+    args = parser.parse_args()
+
+    rows = [
+        ("drive", measure("json", lambda: json_drive(-73, 100), json_drive(-73, 100), args.number), True,
+         DRIVE_CONTROL_RATE),
+        ("drive", measure("binary", lambda: encode_drive(-73, 100, 4242), encode_drive(-73, 100, 4242), args.number),
+         True, DRIVE_CONTROL_RATE),
+        ("status", measure("json", lambda: json_status(-73, -100), json_status(-73, -100), args.number), False,
+         DRIVE_CONTROL_RATE + STATUS_RATE),
+        ("status", measure("binary", lambda: encode_status(-73, -100, 4242), encode_status(-73, -100, 4242),
+                           args.number), False, DRIVE_CONTROL_RATE + STATUS_RATE),
+    ]
+    print(f"number={args.number} drive {DRIVE_CONTROL_RATE:g}/s, status {DRIVE_CONTROL_RATE + STATUS_RATE:g}/s")
+    print(f"{'message':7} {'format':6} {'encode us':>9} {'decode us':>9} {'payload B':>9} {'frame B':>7} {'B/s':>7}")
+    for message, (name, encode_s, decode_s, size), masked, rate in rows:
+        frame = ws_frame_size(size, masked)
+        print(f"{message:7} {name:6} {encode_s * 1e6:9.2f} {decode_s * 1e6:9.2f} {size:9} {frame:7} {frame * rate:7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Заглушка ESP32 платформы для бенчмарков и проверки ретранслятора: WebSocket
+/ws с протоколом прошивки (esp32_platform_code.ino). На drive выставляет
+скорости моторов (правый инвертирован, пределы -100..100) и отвечает статусом
+отправителю, на get_status - статусом, каждые 200 мс рассылает статус всем
+клиентам. Если скорости ненулевые, а drive не приходил DRIVE_FAILSAFE_MS,
+останавливает моторы, как прошивка. Бинарные кадры platform_wire.py разбираются
+так же, как в прошивке: клиенту, приславшему бинарный кадр, статусы идут
+бинарными; --json-only - старая прошивка, бинарные кадры игнорируются.
+
+Контроллер один и однопоточный: каждое сообщение любого клиента и каждая
+рассылка статуса занимают --handle-ms под общей блокировкой (разбор JSON,
+Serial.printf на 115200 бод), поэтому лишние клиенты и сообщения выстраиваются
+в очередь, как в AsyncWebSocket.
+
+Каждое изменение скоростей моторов (actuation) записывается со временем
+time.monotonic() - на Linux это CLOCK_MONOTONIC, общий для процессов, и
+бенчмарк сравнивает его со своим временем нажатия. GET /stats - счетчики и
+записи, POST /reset - обнулить.
+
+Запуск: python benchmarks/stub_esp32.py --port 8800 --handle-ms 2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+
+from aiohttp import WSMsgType, web
+
+import bench_utils  # noqa: F401  (путь к модулям репозитория)
+from platform_wire import WIRE_FLAG_FAILSAFE, WireFormatError, decode, encode_error, encode_status
+
+STATUS_INTERVAL = 0.2      # statusUpdateInterval прошивки
+DRIVE_FAILSAFE_MS = 1500   # Как DRIVE_FAILSAFE_MS в прошивке
+
+
+def _constrain(value):
+    return min(max(int(value), -100), 100)
+
+
+def make_app(handle_ms=2.0, json_only=False):
+    lock = asyncio.Lock()
+    clients = {}   # ws -> клиент прислал бинарный кадр
+    state = {"motorL": 0, "motorR": 0, "last_drive": 0.0, "seq": 0, "failsafe": False}
+    stats = {"messages": 0, "drive": 0, "bytes": 0, "clients_total": 0, "failsafe_stops": 0, "actuations": []}
+
+    async def handle_time():
+        if handle_ms > 0:
+            await asyncio.sleep(handle_ms / 1000)
+
+    def status():
+        return json.dumps({"type": "status_update", "data": {"motorL": state["motorL"], "motorR": state["motorR"]}})
+
+    async def send_status(ws):
+        if clients.get(ws):
+            await ws.send_bytes(encode_status(state["motorL"], state["motorR"], state["seq"],
+                                              WIRE_FLAG_FAILSAFE if state["failsafe"] else 0))
+        else:
+            await ws.send_str(status())
+
+    def actuate(left, right):
+        if (left, right) != (state["motorL"], state["motorR"]):
+            state["motorL"], state["motorR"] = left, right
+            stats["actuations"].append((time.monotonic(), left, -right))
+
+    async def handle_message(ws, data):
+        async with lock:
+            await handle_time()
+            stats["messages"] += 1
+            stats["bytes"] += len(data)
+            try:
+                if isinstance(data, bytes):
+                    message = decode(data)
+                    clients[ws] = True
+                else:
+                    message = json.loads(data)
+            except WireFormatError as e:
+                await ws.send_bytes(encode_error(e.code))
+                return
+            except ValueError:
+                await ws.send_str(json.dumps({"type": "error", "message": "Invalid JSON"}))
+                return
+            command = message.get("command")
+            if command == "drive":
+                payload = message.get("payload") or {}
+                stats["drive"] += 1
+                state["last_drive"] = time.monotonic()
+                state["seq"], state["failsafe"] = message.get("seq", 0), False
+                actuate(_constrain(payload.get("left", 0)), -_constrain(payload.get("right", 0)))
+                await send_status(ws)
+            elif command == "get_status":
+                await send_status(ws)
+            elif clients.get(ws):
+                await ws.send_bytes(encode_error(3))
+            else:
+                await ws.send_str(json.dumps({"type": "error", "message": f"Unknown command: {command}"}))
+
+    async def websocket(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        clients[ws] = False
+        stats["clients_total"] += 1
+        try:
+            await ws.send_str(status())
+            async for message in ws:
+                if message.type == WSMsgType.TEXT or message.type == WSMsgType.BINARY and not json_only:
+                    await handle_message(ws, message.data)
+        finally:
+            clients.pop(ws, None)
+        return ws
+
+    async def status_loop(app):
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            async with lock:
+                moving = state["motorL"] or state["motorR"]
+                if moving and (time.monotonic() - state["last_drive"]) * 1000 > DRIVE_FAILSAFE_MS:
+                    stats["failsafe_stops"] += 1
+                    state["failsafe"] = True
+                    actuate(0, 0)
+                for ws in list(clients):
+                    await handle_time()
+                    try:
+                        await send_status(ws)
+                    except ConnectionError:
+                        pass
+
+    async def start_status_loop(app):
+        app["status_task"] = asyncio.ensure_future(status_loop(app))
+
+    async def stop_status_loop(app):
+        app["status_task"].cancel()
+
+    async def get_stats(request):
+        return web.json_response(dict(stats, clients=len(clients), now=time.monotonic()))
+
+    async def reset(request):
+        stats.update(messages=0, drive=0, bytes=0, clients_total=len(clients), failsafe_stops=0, actuations=[])
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/ws", websocket)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post("/reset", reset)
+    app.on_startup.append(start_status_loop)
+    app.on_cleanup.append(stop_status_loop)
+    return app
+
+
+def _serve_forever(port, handle_ms, json_only=False, host="127.0.0.1"):
+    try:
+        web.run_app(make_app(handle_ms, json_only), host=host, port=port, access_log=None, print=None, shutdown_timeout=1.0)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_stub_process(port, handle_ms=2.0, json_only=False):
+    """Запускает заглушку в отдельном процессе: у "контроллера" свой CPU и loop."""
+    process = multiprocessing.Process(target=_serve_forever, args=(port, handle_ms, json_only), daemon=True)
+    process.start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--handle-ms", type=float, default=2.0, help="Время обработки одного сообщения контроллером")
+    parser.add_argument("--json-only", action="store_true", help="Старая прошивка: бинарные кадры игнорируются")
+    args = parser.parse_args()
+    _serve_forever(args.port, args.handle_ms, args.json_only)
+
+
+if __name__ == "__main__":
+    main()
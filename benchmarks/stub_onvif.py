@@ -0,0 +1,243 @@
+"""
+Заглушка ONVIF PTZ сервиса для бенчмарков: принимает SOAP POST на любом пути,
+определяет действие по телу запроса и отвечает после заданной задержки.
+На запросы discovery (GetCapabilities, GetProfiles, GetNodes) отвечает как
+камера с PTZ сервисом /onvif/ptz_service на том же порту. Позиция "камеры"
+хранится на каждый порт: RelativeMove и AbsoluteMove меняют ее сразу,
+GetStatus возвращает ее, SetPreset/GotoPreset запоминают и восстанавливают.
+
+С --dialect заглушка ведет себя как камера этого диалекта (SoapDialect в
+onvif_templates.py) и отвечает SOAP Fault на чужой:
+  TPTZ (YCC365) - отклоняет запросы с WS-Security заголовком (400);
+  WSSE (YOOSEE, Y05) - требует UsernameToken с верным PasswordDigest для
+  --password (401 без него или с неверным); как большинство ONVIF камер,
+  GetCapabilities без заголовка отдает и так.
+Тогда же ProfileToken команд должен совпадать с --profile - его же заглушка
+отдает в GetProfiles.
+
+Запуск: python benchmarks/stub_onvif.py --ports 8900-8915 --latency-ms 20
+        python benchmarks/stub_onvif.py --host 127.0.0.2 --ports 5000 --dialect WSSE --profile IPCProfilesToken1
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import multiprocessing
+import random
+import re
+
+from aiohttp import web
+
+_ACTION_RE = re.compile(rb"<(?:\w+:)?(ContinuousMove|Stop|RelativeMove|AbsoluteMove|GotoPreset|SetPreset|GetStatus|"
+                        rb"GetCapabilities|GetProfiles|GetNodes)\b")
+_PAN_TILT_RE = re.compile(rb'PanTilt x="([-\d.e]+)" y="([-\d.e]+)"')
+_ZOOM_RE = re.compile(rb'Zoom x="([-\d.e]+)"')
+_PRESET_RE = re.compile(rb"PresetToken>([^<]+)<")
+_PROFILE_RE = re.compile(rb"ProfileToken>([^<]*)<")
+_USERNAME_TOKEN_RE = re.compile(rb"<(?:\w+:)?Password[^>]*>([^<]*)<.*?<(?:\w+:)?Nonce[^>]*>([^<]*)<.*?"
+                                rb"<(?:\w+:)?Created[^>]*>([^<]*)<", re.S)
+_DISCOVERY_ACTIONS = frozenset({"GetCapabilities", "GetProfiles", "GetNodes"})
+_PRE_AUTH_ACTIONS = frozenset({"GetCapabilities"})  # WSSE отвечает на них и без UsernameToken
+
+_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://www.w3.org/2003/05/soap-envelope" xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl"
+    xmlns:tds="http://www.onvif.org/ver10/device/wsdl" xmlns:trt="http://www.onvif.org/ver10/media/wsdl" xmlns:tt="http://www.onvif.org/ver10/schema"
+    xmlns:ter="http://www.onvif.org/ver10/error">
+<SOAP-ENV:Body>{body}</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+_FAULT_BODY = """<SOAP-ENV:Fault><SOAP-ENV:Code><SOAP-ENV:Value>SOAP-ENV:Sender</SOAP-ENV:Value>
+<SOAP-ENV:Subcode><SOAP-ENV:Value>ter:{subcode}</SOAP-ENV:Value></SOAP-ENV:Subcode></SOAP-ENV:Code>
+<SOAP-ENV:Reason><SOAP-ENV:Text xml:lang="en">{reason}</SOAP-ENV:Text></SOAP-ENV:Reason></SOAP-ENV:Fault>"""
+
+_STATUS_BODY = """<tptz:GetStatusResponse><tptz:PTZStatus>
+<tt:Position><tt:PanTilt x="{pan}" y="{tilt}"/><tt:Zoom x="{zoom}"/></tt:Position>
+<tt:MoveStatus><tt:PanTilt>IDLE</tt:PanTilt><tt:Zoom>IDLE</tt:Zoom></tt:MoveStatus>
+</tptz:PTZStatus></tptz:GetStatusResponse>"""
+
+_DISCOVERY_BODIES = {
+    "GetCapabilities": """<tds:GetCapabilitiesResponse><tds:Capabilities>
+<tt:Media><tt:XAddr>http://{host}/onvif/media_service</tt:XAddr></tt:Media>
+<tt:PTZ><tt:XAddr>http://{host}/onvif/ptz_service</tt:XAddr></tt:PTZ>
+</tds:Capabilities></tds:GetCapabilitiesResponse>""",
+    "GetProfiles": """<trt:GetProfilesResponse><trt:Profiles token="{profile}">
+<tt:Name>main</tt:Name><tt:PTZConfiguration token="ptz0"/></trt:Profiles></trt:GetProfilesResponse>""",
+    "GetNodes": """<tptz:GetNodesResponse><tptz:PTZNode token="node0"><tt:SupportedPTZSpaces>
+<tt:ContinuousPanTiltVelocitySpace><tt:URI>http://www.onvif.org/ver10/tptz/PanTiltSpaces/VelocityGenericSpace</tt:URI>
+<tt:XRange><tt:Min>-1</tt:Min><tt:Max>1</tt:Max></tt:XRange><tt:YRange><tt:Min>-1</tt:Min><tt:Max>1</tt:Max></tt:YRange>
+</tt:ContinuousPanTiltVelocitySpace>
+<tt:ContinuousZoomVelocitySpace><tt:URI>http://www.onvif.org/ver10/tptz/ZoomSpaces/ZoomGenericSpace</tt:URI>
+<tt:XRange><tt:Min>-1</tt:Min><tt:Max>1</tt:Max></tt:XRange></tt:ContinuousZoomVelocitySpace>
+</tt:SupportedPTZSpaces></tptz:PTZNode></tptz:GetNodesResponse>""",
+}
+
+
+def parse_ports(spec):
+    """'8900-8903' или '8900,8901' -> список портов."""
+    ports = []
+    for part in spec.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            ports.extend(range(int(first), int(last) + 1))
+        else:
+            ports.append(int(part))
+    return ports
+
+
+def _clamp(value):
+    return min(max(value, -1.0), 1.0)
+
+
+def _move(position, action, body):
+    """Новая позиция (pan, tilt, zoom) после RelativeMove/AbsoluteMove."""
+    pan_tilt, zoom = _PAN_TILT_RE.search(body), _ZOOM_RE.search(body)
+    vector = [float(pan_tilt.group(1)), float(pan_tilt.group(2)), float(zoom.group(1))]
+    if action == "RelativeMove":
+        vector = [a + b for a, b in zip(position, vector)]
+    return [_clamp(v) for v in vector]
+
+
+def _fault(status, subcode, reason):
+    return web.Response(status=status, text=_RESPONSE.format(body=_FAULT_BODY.format(subcode=subcode, reason=reason)),
+                        content_type="application/soap+xml")
+
+
+def _digest_valid(body, password):
+    """UsernameToken с PasswordDigest = Base64(SHA1(nonce + created + password))."""
+    token = _USERNAME_TOKEN_RE.search(body)
+    if not token:
+        return False
+    digest, nonce, created = token.groups()
+    try:
+        expected = hashlib.sha1(base64.b64decode(nonce) + created + password.encode("utf-8")).digest()
+    except ValueError:
+        return False
+    return base64.b64encode(expected) == digest
+
+
+def dialect_fault(body, action, dialect, password, profile_token):
+    """SOAP Fault, если запрос не на диалекте камеры; None - запрос принят."""
+    has_security = b"UsernameToken" in body
+    if dialect == "TPTZ" and has_security:
+        return _fault(400, "NotAuthorized", "WS-Security is not supported")
+    if dialect == "WSSE" and not (has_security and _digest_valid(body, password)) \
+            and (has_security or action not in _PRE_AUTH_ACTIONS):
+        return _fault(401, "NotAuthorized", "Sender not authorized")
+    if action not in _DISCOVERY_ACTIONS:
+        profile = _PROFILE_RE.search(body)
+        if profile is None or profile.group(1).decode() != profile_token:
+            return _fault(400, "NoProfile", "Unknown profile token")
+    return None
+
+
+def make_app(latency_ms=20.0, jitter_ms=0.0, dialect=None, password="admin", profile_token="StubProfile"):
+    """dialect None - любой запрос принимается; "TPTZ" или "WSSE" - как камера этого диалекта."""
+    counters = {}
+    positions = {}   # (адрес, порт) -> [pan, tilt, zoom]
+    presets = {}     # ((адрес, порт), токен) -> позиция
+
+    async def handle(request):
+        body = await request.read()
+        match = _ACTION_RE.search(body)
+        if not match:
+            return web.Response(status=400, text="Unknown SOAP action")
+        action = match.group(1).decode()
+        counters[action] = counters.get(action, 0) + 1
+        delay = latency_ms + (random.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if dialect is not None:
+            fault = dialect_fault(body, action, dialect, password, profile_token)
+            if fault is not None:
+                counters["Fault"] = counters.get("Fault", 0) + 1
+                return fault
+        port = request.transport.get_extra_info("sockname")[:2]
+        position = positions.setdefault(port, [0.0, 0.0, 0.0])
+        if action in ("RelativeMove", "AbsoluteMove"):
+            positions[port] = _move(position, action, body)
+        elif action in ("GotoPreset", "SetPreset"):
+            token = _PRESET_RE.search(body).group(1).decode()
+            if action == "SetPreset":
+                presets[(port, token)] = list(position)
+            elif (port, token) in presets:
+                positions[port] = list(presets[(port, token)])
+            else:
+                return web.Response(status=400, text="Unknown preset")
+        if action == "GetStatus":
+            pan, tilt, zoom = positions[port]
+            body = _STATUS_BODY.format(pan=pan, tilt=tilt, zoom=zoom)
+        elif action == "SetPreset":
+            body = f"<tptz:SetPresetResponse><tptz:PresetToken>{token}</tptz:PresetToken></tptz:SetPresetResponse>"
+        else:
+            body = _DISCOVERY_BODIES.get(action, "<tptz:{action}Response/>").format(
+                host=request.host, action=action, profile=profile_token)
+        return web.Response(text=_RESPONSE.format(body=body), content_type="application/soap+xml")
+
+    async def stats(request):
+        return web.json_response(counters)
+
+    app = web.Application()
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/{tail:.*}", handle)
+    return app
+
+
+async def serve(ports, latency_ms, jitter_ms, host="127.0.0.1", **camera):
+    runner = web.AppRunner(make_app(latency_ms, jitter_ms, **camera), access_log=None)
+    await runner.setup()
+    for port in ports:
+        await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _serve_forever(ports, latency_ms, jitter_ms, host="127.0.0.1", camera=None):
+    try:
+        asyncio.run(serve(ports, latency_ms, jitter_ms, host, **(camera or {})))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_stub_process(ports, latency_ms=20.0, jitter_ms=0.0, host="127.0.0.1", **camera):
+    """
+    Запускает заглушку в отдельном процессе, чтобы не делить с бенчмарком CPU и loop.
+    camera - dialect, password и profile_token для make_app.
+    """
+    process = multiprocessing.Process(target=_serve_forever, args=(ports, latency_ms, jitter_ms, host, camera),
+                                      daemon=True)
+    process.start()
+    return process
+
+
+async def wait_until_listening(port, host="127.0.0.1", timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ports", default="8900", help="Порт или диапазон портов, например 8900-8915")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Время 'обработки' команды камерой")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--dialect", choices=("TPTZ", "WSSE"), help="Принимать только запросы этого диалекта")
+    parser.add_argument("--password", default="admin", help="Пароль для проверки PasswordDigest (WSSE)")
+    parser.add_argument("--profile", default="StubProfile", help="Токен профиля камеры")
+    args = parser.parse_args()
+    _serve_forever(parse_ports(args.ports), args.latency_ms, args.jitter_ms, args.host,
+                   {"dialect": args.dialect, "password": args.password, "profile_token": args.profile})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Синтетическая RTSP камера для бенчмарков: кодирует тестовую картинку H.264 в
+темпе камеры и отдает ее по RTSP (RTP поверх TCP, interleaved - как
+RTSP_OPTIONS шлюза с rtsp_transport=tcp). Любой путь - своя камера
+(rtsp://127.0.0.1:8554/cam0, /cam1...), картинка у всех одна, энкодер общий.
+
+В верхней полосе каждого кадра время кодирования - time.monotonic() в мс
+(CLOCK_MONOTONIC общий для процессов): 32 бита и контрольный байт черными и
+белыми клетками на всю ширину кадра. Клетки крупные, поэтому переживают
+перекод и уменьшение рендиции шлюзом; decode_timestamp() читает время из
+яркости принятого кадра, разница с моментом приема - задержка от "объектива"
+до экрана зрителя. Ниже полосы бегает светлая полоса, чтобы у энкодеров была
+работа.
+
+Новый зритель получает поток с ближайшего ключевого кадра (--gop кадров, как
+I-frame interval камеры); SPS/PPS повторяются перед каждым ключевым кадром и
+есть в SDP. Зритель, который не успевает читать, пропускает кадры до
+следующего ключевого.
+
+Запуск: python benchmarks/stub_rtsp.py --port 8554 --size 640x360 --fps 30 --gop 30
+"""
+import argparse
+import asyncio
+import base64
+import fractions
+import multiprocessing
+import os
+import struct
+import time
+
+import av # type: ignore
+import numpy as np # type: ignore
+
+RTP_PAYLOAD_TYPE = 96
+RTP_CLOCK = 90000
+RTP_MTU = 1400                    # Наибольший payload RTP; NAL длиннее режется на FU-A
+SEND_BUFFER_LIMIT = 4 * 2**20     # Байт в буфере отправки зрителя, после которых кадры пропускаются
+
+TIMESTAMP_BITS = 32
+CHECK_BITS = 8
+_CELLS = TIMESTAMP_BITS + CHECK_BITS
+_BLACK, _WHITE, _GRAY = 16, 235, 64
+
+
+# --- Метка времени в кадре ---
+def _check_byte(value):
+    return (sum(value.to_bytes(4, "big")) & 0xFF) ^ 0xA5
+
+
+def band_height(height):
+    return max(16, height // 10) & ~1
+
+
+def draw_timestamp(luma, stamp_ms):
+    """Рисует stamp_ms (младшие 32 бита) и контрольный байт клетками в верхней полосе плоскости Y."""
+    height, width = luma.shape
+    value = stamp_ms & 0xFFFFFFFF
+    bits = (value << CHECK_BITS) | _check_byte(value)
+    band = luma[:band_height(height)]
+    for cell in range(_CELLS):
+        bit = (bits >> (_CELLS - 1 - cell)) & 1
+        band[:, cell * width // _CELLS:(cell + 1) * width // _CELLS] = _WHITE if bit else _BLACK
+
+
+def decode_timestamp(luma):
+    """Метка времени (мс, 32 бита) из плоскости Y принятого кадра; None - полоса не читается."""
+    height, width = luma.shape
+    band = band_height(height)
+    rows = luma[band // 4:band * 3 // 4]
+    bits = 0
+    for cell in range(_CELLS):
+        left, right = cell * width // _CELLS, (cell + 1) * width // _CELLS
+        quarter = (right - left) // 4
+        bits = (bits << 1) | int(rows[:, left + quarter:right - quarter].mean() > 128)
+    value = bits >> CHECK_BITS
+    return value if bits & 0xFF == _check_byte(value) else None
+
+
+def age_ms(stamp_ms, now_ms):
+    """Возраст метки с учетом переполнения 32 бит."""
+    return (now_ms - stamp_ms) & 0xFFFFFFFF
+
+
+# --- Энкодер тестовой картинки ---
+def _split_nals(data):
+    """NAL юниты Annex B буфера без стартовых кодов."""
+    nals = []
+    start = data.find(b"\x00\x00\x01")
+    while start != -1:
+        start += 3
+        end = data.find(b"\x00\x00\x01", start)
+        nal = data[start:] if end == -1 else data[start:end - 1 if data[end - 1] == 0 else end]
+        if nal:
+            nals.append(nal)
+        start = end
+    return nals
+
+
+class TestPattern:
+    """Кадры с меткой времени, закодированные libx264 как у камеры: без B-кадров, ключевой раз в gop кадров."""
+
+    def __init__(self, width, height, fps, gop):
+        self.width, self.height, self.fps = width, height, fps
+        self.codec = av.CodecContext.create("libx264", "w")
+        self.codec.width, self.codec.height, self.codec.pix_fmt = width, height, "yuv420p"
+        self.codec.time_base = fractions.Fraction(1, RTP_CLOCK)
+        self.codec.framerate = fractions.Fraction(fps, 1)
+        self.codec.options = {"preset": "ultrafast", "tune": "zerolatency", "profile": "baseline",
+                              "x264-params": f"keyint={gop}:min-keyint={gop}:scenecut=0"}
+        self._yuv = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+        self.frames = 0
+        self.sps = self.pps = None
+
+    def encode(self):
+        """(ключевой ли кадр, NAL юниты, метка RTP) следующего кадра."""
+        luma = self._yuv[:self.height]
+        luma[:] = _GRAY
+        bar = (self.frames * 8) % self.width
+        luma[band_height(self.height):, bar:bar + self.width // 16] = 200
+        now = time.monotonic()
+        draw_timestamp(luma, int(now * 1000))
+        frame = av.VideoFrame.from_ndarray(self._yuv, format="yuv420p")
+        frame.pts = rtp_time = int(now * RTP_CLOCK)
+        self.frames += 1
+        nals, keyframe = [], False
+        for packet in self.codec.encode(frame):
+            for nal in _split_nals(bytes(packet)):
+                nal_type = nal[0] & 0x1F
+                if nal_type == 7:
+                    self.sps = nal
+                elif nal_type == 8:
+                    self.pps = nal
+                elif nal_type == 5:
+                    keyframe = True
+                if nal_type != 9:   # AUD не нужен в RTP
+                    nals.append(nal)
+        return keyframe, nals, rtp_time & 0xFFFFFFFF
+
+    def sdp(self, address):
+        profile_level_id = self.sps[1:4].hex()
+        sprop = b",".join(base64.b64encode(nal) for nal in (self.sps, self.pps)).decode()
+        return (f"v=0\r\no=- 0 0 IN IP4 {address}\r\ns=RoverPilot test pattern\r\nc=IN IP4 0.0.0.0\r\nt=0 0\r\n"
+                f"a=control:*\r\nm=video 0 RTP/AVP {RTP_PAYLOAD_TYPE}\r\n"
+                f"a=rtpmap:{RTP_PAYLOAD_TYPE} H264/{RTP_CLOCK}\r\n"
+                f"a=fmtp:{RTP_PAYLOAD_TYPE} packetization-mode=1;profile-level-id={profile_level_id};"
+                f"sprop-parameter-sets={sprop}\r\n"
+                f"a=framerate:{self.fps}\r\na=control:track1\r\n")
+
+
+def rtp_packets(nals, rtp_time, ssrc, seq):
+    """RTP пакеты кадра (RFC 6184: одиночные NAL и FU-A), marker на последнем. Возвращает (пакеты, следующий seq)."""
+    payloads = []
+    for nal in nals:
+        if len(nal) <= RTP_MTU:
+            payloads.append(nal)
+            continue
+        indicator, nal_type = (nal[0] & 0xE0) | 28, nal[0] & 0x1F
+        chunks = [nal[i:i + RTP_MTU - 2] for i in range(1, len(nal), RTP_MTU - 2)]
+        for i, chunk in enumerate(chunks):
+            header = nal_type | (0x80 if i == 0 else 0) | (0x40 if i == len(chunks) - 1 else 0)
+            payloads.append(bytes((indicator, header)) + chunk)
+    packets = []
+    for i, payload in enumerate(payloads):
+        marker = 0x80 if i == len(payloads) - 1 else 0
+        packets.append(struct.pack("!BBHII", 0x80, marker | RTP_PAYLOAD_TYPE, seq, rtp_time, ssrc) + payload)
+        seq = (seq + 1) & 0xFFFF
+    return packets, seq
+
+
+# --- RTSP сервер ---
+class RtspSession:
+    def __init__(self, writer, channel):
+        self.writer = writer
+        self.channel = channel
+        self.ssrc = struct.unpack("!I", os.urandom(4))[0]
+        self.seq = struct.unpack("!H", os.urandom(2))[0]
+        self.playing = False
+        self.waiting_keyframe = True
+
+    def send(self, keyframe, nals, rtp_time):
+        if self.writer.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+            self.waiting_keyframe = True
+        if self.waiting_keyframe and not keyframe:
+            return
+        self.waiting_keyframe = False
+        packets, self.seq = rtp_packets(nals, rtp_time, self.ssrc, self.seq)
+        self.writer.write(b"".join(struct.pack("!cBH", b"$", self.channel, len(p)) + p for p in packets))
+
+
+class RtspServer:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.sessions = set()
+        self.connections = 0
+
+    async def run_encoder(self):
+        fps = self.pattern.fps
+        started = time.monotonic()
+        while True:
+            keyframe, nals, rtp_time = self.pattern.encode()
+            for session in list(self.sessions):
+                if session.playing:
+                    session.send(keyframe, nals, rtp_time)
+            delay = started + self.pattern.frames / fps - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _read_request(self, reader):
+        """(метод, URL, заголовки) следующего запроса; RTCP клиента в interleaved кадрах пропускается."""
+        while True:
+            first = await reader.readexactly(1)
+            if first == b"$":
+                _, length = struct.unpack("!BH", await reader.readexactly(3))
+                await reader.readexactly(length)
+                continue
+            head = first + await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("utf-8", "replace").split("\r\n")
+            method, url, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            if int(headers.get("content-length", 0)):
+                await reader.readexactly(int(headers["content-length"]))
+            return method, url, headers
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        session = None
+        session_id = os.urandom(8).hex()
+        try:
+            while True:
+                method, url, headers = await self._read_request(reader)
+                reply, body = {}, b""
+                status = "200 OK"
+                if method == "OPTIONS":
+                    reply["Public"] = "OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN, GET_PARAMETER"
+                elif method == "DESCRIBE":
+                    body = self.pattern.sdp(writer.get_extra_info("sockname")[0]).encode()
+                    reply.update({"Content-Base": url.rstrip("/") + "/", "Content-Type": "application/sdp"})
+                elif method == "SETUP":
+                    transport = headers.get("transport", "")
+                    if "TCP" not in transport:
+                        status = "461 Unsupported Transport"
+                    else:
+                        channel = 0
+                        if "interleaved=" in transport:
+                            channel = int(transport.split("interleaved=")[1].split("-")[0].split(";")[0])
+                        session = RtspSession(writer, channel)
+                        reply["Transport"] = f"RTP/AVP/TCP;unicast;interleaved={channel}-{channel + 1}"
+                elif method == "PLAY":
+                    if session is None:
+                        status = "455 Method Not Valid in This State"
+                    else:
+                        session.playing = True
+                        self.sessions.add(session)
+                        reply["Range"] = "npt=0.000-"
+                elif method == "TEARDOWN":
+                    self._reply(writer, headers, "200 OK", {"Session": session_id})
+                    return
+                elif method not in ("GET_PARAMETER", "SET_PARAMETER"):
+                    status = "501 Not Implemented"
+                if session is not None:
+                    reply["Session"] = f"{session_id};timeout=60"
+                self._reply(writer, headers, status, reply, body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    @staticmethod
+    def _reply(writer, headers, status, reply, body=b""):
+        lines = [f"RTSP/1.0 {status}", f"CSeq: {headers.get('cseq', '0')}", "Server: RoverPilot stub"]
+        lines += [f"{name}: {value}" for name, value in reply.items()]
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+
+async def serve(port, width, height, fps, gop, host="127.0.0.1"):
+    pattern = TestPattern(width, height, fps, gop)
+    while pattern.sps is None or pattern.pps is None:
+        pattern.encode()   # SPS/PPS для SDP - из первого ключевого кадра
+    server = RtspServer(pattern)
+    encoder = asyncio.ensure_future(server.run_encoder())
+    listener = await asyncio.start_server(server.handle, host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        encoder.cancel()
+        listener.close()
+
+
+def _serve_forever(port, width, height, fps, gop, host="127.0.0.1"):
+    try:
+        asyncio.run(serve(port, width, height, fps, gop, host))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_stub_process(port, width=640, height=360, fps=30, gop=30, host="127.0.0.1"):
+    """Запускает камеру в отдельном процессе: кодирование не делит CPU и loop с бенчмарком."""
+    process = multiprocessing.Process(target=_serve_forever, args=(port, width, height, fps, gop, host), daemon=True)
+    process.start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8554)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30, help="Кадров между ключевыми")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split("x"))
+    _serve_forever(args.port, width, height, args.fps, args.gop, args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Кольцевой буфер закодированных пакетов источника для снимков и коротких клипов.
+
+Рекордер подписан на пакеты RtspIngest через MediaRelay, как passthrough
+зритель, поэтому второго подключения к камере нет. В буфере хранятся копии
+пакетов за последние CLIP_BUFFER_SECONDS, но не больше CLIP_BUFFER_MAX_BYTES:
+старые пакеты вытесняются целыми GOP, и буфер всегда начинается с ключевого
+кадра. Если кадры не помещаются, буфер пустеет до следующего ключевого кадра,
+но лимит памяти не превышается.
+
+Клип - MP4 из пакетов буфера без перекодирования, снимок - JPEG последнего
+кадра (декодируется GOP от последнего ключевого кадра). Сборка идет в пуле
+потоков; в loop только копируется список ссылок на пакеты, поэтому выгрузка
+не задерживает доставку видео зрителям.
+"""
+import asyncio
+import concurrent.futures
+import io
+import logging
+import time
+from collections import deque, namedtuple
+from fractions import Fraction
+
+import av # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from media_sources import mask_credentials
+
+logger = logging.getLogger(__name__)
+
+CLIP_BUFFER_SECONDS = 30.0               # Глубина буфера по времени (сек)
+CLIP_BUFFER_MAX_BYTES = 32 * 1024 * 1024 # Жесткий лимит памяти буфера на источник
+CLIP_DEFAULT_SECONDS = 10.0              # Длина клипа, если не указана
+CLIP_EXPORT_WORKERS = 1                  # Потоки сборки клипов и снимков на весь шлюз
+CLIP_MAX_PENDING_EXPORTS = 4             # Одновременных выгрузок (каждая держит готовый MP4 в памяти)
+SNAPSHOT_JPEG_QMAX = 5                   # Качество JPEG снимка: 2 - лучшее, 31 - худшее
+
+# Учет служебных байт на пакет (кортеж, объект bytes, ячейка deque) сверх самих данных
+_PACKET_OVERHEAD = 160
+
+BufferedPacket = namedtuple("BufferedPacket", ("data", "pts", "dts", "is_keyframe", "arrived_at"))
+
+_export_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CLIP_EXPORT_WORKERS,
+                                                         thread_name_prefix="clip-export")
+
+
+class ClipUnavailable(Exception):
+    """В буфере нет ключевого кадра (источник только открылся или пакеты не помещаются в лимит)."""
+
+
+class ExportBusy(Exception):
+    """Уже выполняется CLIP_MAX_PENDING_EXPORTS выгрузок."""
+
+
+class PacketRingBuffer:
+    """Пакеты одного подключения камеры; используется только из background_loop."""
+
+    def __init__(self, max_seconds=CLIP_BUFFER_SECONDS, max_bytes=CLIP_BUFFER_MAX_BYTES):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self._packets = deque()
+        self.bytes = 0
+        self.evicted = 0
+        self.rejected = 0   # Пакеты, не принятые до ключевого кадра
+
+    def __len__(self):
+        return len(self._packets)
+
+    def clear(self):
+        self._packets.clear()
+        self.bytes = 0
+
+    def append(self, packet):
+        if not self._packets and not packet.is_keyframe:
+            self.rejected += 1  # Без ключевого кадра в начале пакеты бесполезны
+            return
+        size = len(packet.data) + _PACKET_OVERHEAD
+        if size > self.max_bytes:
+            self.rejected += 1
+            self.clear()
+            return
+        self._packets.append(packet)
+        self.bytes += size
+        while self._packets and (self.bytes > self.max_bytes or
+                                 packet.arrived_at - self._packets[0].arrived_at > self.max_seconds):
+            self._evict_gop()
+
+    def _evict_gop(self):
+        """Удаляет первый GOP целиком: буфер снова начинается с ключевого кадра или пуст."""
+        self._pop()
+        while self._packets and not self._packets[0].is_keyframe:
+            self._pop()
+
+    def _pop(self):
+        packet = self._packets.popleft()
+        self.bytes -= len(packet.data) + _PACKET_OVERHEAD
+        self.evicted += 1
+
+    def clip(self, seconds):
+        """Пакеты последних seconds секунд, начиная с ключевого кадра не позже начала окна."""
+        if not self._packets:
+            raise ClipUnavailable("Буфер пуст")
+        since = self._packets[-1].arrived_at - seconds
+        start = 0
+        for i, packet in enumerate(self._packets):
+            if packet.arrived_at > since:
+                break
+            if packet.is_keyframe:
+                start = i
+        return list(self._packets)[start:]
+
+    def last_gop(self):
+        """Пакеты от последнего ключевого кадра до конца буфера."""
+        for i in range(len(self._packets) - 1, -1, -1):
+            if self._packets[i].is_keyframe:
+                return list(self._packets)[i:]
+        raise ClipUnavailable("Буфер пуст")
+
+    def duration(self):
+        if not self._packets:
+            return 0.0
+        return self._packets[-1].arrived_at - self._packets[0].arrived_at
+
+
+def mux_mp4(template, time_base, packets):
+    """MP4 (bytes) из закодированных пакетов; метки времени сдвигаются к нулю."""
+    output = io.BytesIO()
+    with av.open(output, "w", format="mp4") as container:
+        stream = container.add_stream_from_template(template)
+        origin = packets[0].dts if packets[0].dts is not None else packets[0].pts
+        for buffered in packets:
+            packet = av.Packet(buffered.data)
+            packet.pts = buffered.pts - origin
+            packet.dts = (buffered.dts if buffered.dts is not None else buffered.pts) - origin
+            packet.time_base = time_base
+            packet.is_keyframe = buffered.is_keyframe
+            packet.stream = stream
+            container.mux(packet)
+    return output.getvalue()
+
+
+def encode_jpeg(codec_name, extradata, packets):
+    """JPEG последнего кадра: декодируется GOP от ключевого кадра, кодируется только последний кадр."""
+    decoder = av.CodecContext.create(codec_name, "r")
+    if extradata:
+        decoder.extradata = extradata
+    frame = None
+    for buffered in packets:
+        for decoded in decoder.decode(av.Packet(buffered.data)):
+            frame = decoded
+    for decoded in decoder.decode(None):
+        frame = decoded
+    if frame is None:
+        raise ClipUnavailable("Не удалось декодировать кадр")
+    encoder = av.CodecContext.create("mjpeg", "w")
+    encoder.width, encoder.height, encoder.pix_fmt = frame.width, frame.height, "yuvj420p"
+    encoder.time_base = Fraction(1, 25)
+    encoder.options = {"qmin": "2", "qmax": str(SNAPSHOT_JPEG_QMAX)}
+    return b"".join(bytes(packet) for packet in encoder.encode(frame.reformat(format="yuvj420p")))
+
+
+class ClipRecorder:
+    """
+    Буфер одного источника. packets - подписка MediaRelay на ingest.packets;
+    параметры потока (шаблон для MP4, extradata для декодера) берутся у ingest
+    и сбрасываются вместе с буфером при переподключении камеры.
+    """
+
+    def __init__(self, ingest, packets, max_seconds=CLIP_BUFFER_SECONDS, max_bytes=CLIP_BUFFER_MAX_BYTES):
+        self._ingest = ingest
+        self._packets = packets
+        self.buffer = PacketRingBuffer(max_seconds, max_bytes)
+        self._generation = None
+        self._template = None   # Копия параметров потока камеры (живет дольше плеера)
+        self._template_holder = None
+        self._retired_holders = []  # Контейнеры прежних шаблонов: закрываются, когда нет выгрузок
+        self._time_base = None
+        self._codec_name = None
+        self._extradata = None
+        self._pending_exports = 0
+        self.clips_exported = 0
+        self.snapshots_exported = 0
+        self.export_ms = None
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                packet = await self._packets.recv()
+                if self._generation != self._ingest.generation:
+                    self._reset()
+                self.buffer.append(BufferedPacket(bytes(packet), packet.pts, packet.dts,
+                                                  packet.is_keyframe, time.monotonic()))
+                self._time_base = packet.time_base
+        except MediaStreamError:
+            pass
+
+    def _reset(self):
+        """Новое подключение к камере: пакеты старого потока с новыми не смешиваются."""
+        self._generation = self._ingest.generation
+        self.buffer.clear()
+        self._retire_template()
+        self._template_holder = av.open(io.BytesIO(), "w", format="mp4")
+        self._template = self._template_holder.add_stream_from_template(self._ingest.stream)
+        self._codec_name = self._ingest.codec_name
+        self._extradata = self._ingest.extradata
+
+    def _retire_template(self):
+        """Закрывает контейнер шаблона; если идут выгрузки (им нужен шаблон) - после последней."""
+        if self._template_holder is not None:
+            self._retired_holders.append(self._template_holder)
+            self._template_holder = None
+        self._close_retired()
+
+    def _close_retired(self):
+        if not self._pending_exports:
+            while self._retired_holders:
+                self._retired_holders.pop().close()
+
+    async def _export(self, function, *args):
+        if self._pending_exports >= CLIP_MAX_PENDING_EXPORTS:
+            raise ExportBusy(f"Уже выполняется {CLIP_MAX_PENDING_EXPORTS} выгрузок")
+        self._pending_exports += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_export_executor, function, *args)
+        finally:
+            self._pending_exports -= 1
+            self._close_retired()
+            self.export_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def export_clip(self, seconds=CLIP_DEFAULT_SECONDS):
+        packets = self.buffer.clip(min(seconds, self.buffer.max_seconds))
+        data = await self._export(mux_mp4, self._template, self._time_base, packets)
+        self.clips_exported += 1
+        return data
+
+    async def export_snapshot(self):
+        packets = self.buffer.last_gop()
+        data = await self._export(encode_jpeg, self._codec_name, self._extradata, packets)
+        self.snapshots_exported += 1
+        return data
+
+    def stop(self):
+        self._packets.stop()
+        self._task.cancel()
+        self.buffer.clear()
+        self._retire_template()
+
+    def as_dict(self):
+        return {
+            "buffered_seconds": round(self.buffer.duration(), 2),
+            "buffered_packets": len(self.buffer),
+            "buffered_bytes": self.buffer.bytes,
+            "max_bytes": self.buffer.max_bytes,
+            "evicted_packets": self.buffer.evicted,
+            "rejected_packets": self.buffer.rejected,
+            "clips_exported": self.clips_exported,
+            "snapshots_exported": self.snapshots_exported,
+            "last_export_ms": self.export_ms,
+        }
+
+
+def create_clip_recorder(ingest, packets):
+    """create_recorder для RtspSourceRegistry."""
+    logger.info(f"Буфер клипов для {mask_credentials(ingest.url)}: {CLIP_BUFFER_SECONDS} с, "
+                f"до {CLIP_BUFFER_MAX_BYTES // (1024 * 1024)} МБ")
+    return ClipRecorder(ingest, packets)
@@ -0,0 +1,374 @@
+"""
+Управление платформой (ESP32) через шлюз.
+
+Браузеры подключаются к /ws/drive шлюза, а не к ESP32: у контроллера одно
+постоянное WebSocket соединение - от шлюза, сколько бы вкладок ни было открыто.
+Ввод операторов сводится в одну цель: управляет оператор, который последним
+изменил свой ввод (вкладка, которая просто держит нули, управление не
+перехватывает, а нажатие ручника - перехватывает). В ESP32 уходят только
+изменения цели, не чаще DRIVE_CONTROL_RATE раз в секунду, и повтор текущей
+команды раз в DRIVE_HEARTBEAT_INTERVAL, по которому прошивка понимает, что
+шлюз жив. Если управляющий оператор не присылал ввод DRIVE_INPUT_TIMEOUT
+секунд (вкладка зависла, пропала сеть) или отключился, шлюз сам командует
+остановку.
+
+С ESP32 шлюз говорит бинарным форматом platform_wire.py, если прошивка ответила
+на бинарный GET_STATUS, иначе JSON (DRIVE_WIRE_FORMAT = "json" - всегда JSON).
+
+Статус ESP32 публикуется в хаб телеметрии (telemetry_hub.py, тема
+DRIVE_TELEMETRY_TOPIC): операторы и зрители получают его оттуда, каждый со
+своей скоростью, а медленные - только последнее значение. Ошибки ESP32 идут
+операторам напрямую.
+
+Протокол /ws/drive совпадает с протоколом ESP32, в том числе бинарный формат:
+  клиент -> {"command": "drive", "payload": {"left", "right"}} и {"command": "get_status"};
+  сервер -> {"type": "status_update", "data": {"motorL", "motorR", ..., "esp32Connected"}}
+            и {"type": "error", "message"}.
+Используется только из background_loop.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import aiohttp
+
+from metrics import DriveMetrics
+from platform_wire import WireFormatError, decode, encode_drive, encode_get_status
+from telemetry_hub import TelemetryHub
+from timeseries_recorder import DRIVE_REASON_CODES, RecordKind
+
+logger = logging.getLogger(__name__)
+
+DRIVE_CONTROL_RATE = 20.0         # Не больше команд в секунду к ESP32 (как UPDATE_INTERVAL_MS = 50 в браузере)
+DRIVE_HEARTBEAT_INTERVAL = 0.5    # Повтор неизменной команды (сек), чтобы прошивка видела живой шлюз
+DRIVE_INPUT_TIMEOUT = 0.5         # Без ввода от управляющего оператора дольше этого - остановка (сек)
+DRIVE_MAX_SPEED = 100             # Предел left/right, как constrain(-100, 100) в прошивке
+DRIVE_CONNECT_TIMEOUT = 3.0       # Подключение к ESP32 (сек)
+DRIVE_STATUS_TIMEOUT = 2.0        # ESP32 шлет статус каждые 200 мс; молчание дольше - соединение мертво
+DRIVE_RECONNECT_INTERVAL = 1.0    # Пауза между попытками подключения к ESP32 (сек)
+DRIVE_WIRE_FORMAT = "binary"      # "binary" - platform_wire.py, если прошивка его понимает; "json" - только JSON
+DRIVE_TELEMETRY_TOPIC = "platform"  # Тема статуса ESP32 в хабе телеметрии
+
+STOP = (0, 0)
+
+
+def _speed(value):
+    """Скорость мотора из ввода оператора: число в пределах DRIVE_MAX_SPEED."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Скорость должна быть числом: {value!r}")
+    return int(round(min(max(value, -DRIVE_MAX_SPEED), DRIVE_MAX_SPEED)))
+
+
+class _Operator:
+    __slots__ = ("client", "listener", "command", "updated_at", "changed_at", "inputs")
+
+    def __init__(self, client, listener):
+        self.client = client
+        self.listener = listener
+        self.command = STOP
+        self.updated_at = time.monotonic()
+        self.changed_at = None
+        self.inputs = 0
+
+
+class DriveRelay:
+    """
+    Одно соединение с ESP32 по url и операторы по id из attach(). listener(message) -
+    корутина, которой оператору доставляются ошибки ESP32; статус - в telemetry.
+    recorder (TimeSeriesRecorder) получает ввод операторов, команды в ESP32 и статусы.
+    """
+
+    def __init__(self, url, control_rate=DRIVE_CONTROL_RATE, heartbeat_interval=DRIVE_HEARTBEAT_INTERVAL,
+                 input_timeout=DRIVE_INPUT_TIMEOUT, wire_format=DRIVE_WIRE_FORMAT, telemetry=None, recorder=None):
+        self.url = url
+        self.recorder = recorder
+        self.telemetry = telemetry if telemetry is not None else TelemetryHub()
+        self.wire_format = wire_format
+        self.control_rate = control_rate
+        self.heartbeat_interval = heartbeat_interval
+        self.input_timeout = input_timeout
+        self.metrics = DriveMetrics()
+        self.status = None           # data последнего status_update от ESP32
+        self.status_at = None
+        self.connects = 0
+        self.deadman_stops = 0
+        self._operators = {}
+        self._ids = itertools.count(1)
+        self._owner = None           # id оператора, который управляет
+        self._deadman = False        # Остановка по молчанию оператора уже скомандована
+        self._ws = None
+        self._session = None
+        self._sent = None            # Последняя отправленная команда; None - после подключения еще ничего
+        self._sent_at = 0.0
+        self._pending = None         # (команда, seq, время отправки) до статуса ESP32 с этими скоростями
+        self._seq = 0                # Номер drive в бинарном формате; ESP32 возвращает его в статусе
+        self._binary = False         # ESP32 ответил бинарным статусом - команды идут бинарными кадрами
+        self._wakeup = None
+        self._tasks = []
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    @property
+    def connected(self):
+        return self._ws is not None
+
+    @property
+    def operator_count(self):
+        return len(self._operators)
+
+    async def start(self):
+        if not self.enabled or self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=DRIVE_CONNECT_TIMEOUT))
+        self._tasks = [asyncio.ensure_future(self._connection_loop()), asyncio.ensure_future(self._control_loop())]
+        self._publish_status()
+        logger.info(f"Ретранслятор платформы запущен: {self.url}")
+
+    # --- Операторы ---
+    def attach(self, listener, client=None):
+        operator_id = next(self._ids)
+        self._operators[operator_id] = _Operator(client, listener)
+        return operator_id
+
+    def detach(self, operator_id):
+        self._operators.pop(operator_id, None)
+        if operator_id == self._owner:
+            # Управляющий оператор ушел - платформа останавливается сразу, а не по таймауту
+            self._owner = None
+            self._wake()
+
+    def set_input(self, operator_id, left, right):
+        operator = self._operators.get(operator_id)
+        if operator is None:
+            return
+        command = (_speed(left), _speed(right))
+        now = time.monotonic()
+        operator.updated_at = now
+        operator.inputs += 1
+        self.metrics.inputs.inc()
+        if self.recorder is not None:
+            self.recorder.record(RecordKind.DRIVE_INPUT, operator.client, 0, command[0], command[1])
+        if command != operator.command:
+            operator.command = command
+            operator.changed_at = now
+            self._owner = operator_id
+            self._deadman = False
+            self._wake()
+        elif operator_id == self._owner and self._deadman:
+            # Оператор снова на связи и держит ту же команду
+            self._deadman = False
+            self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _target(self, now):
+        """Команда, которую сейчас должна выполнять платформа, и причина, если это остановка по молчанию."""
+        operator = self._operators.get(self._owner)
+        if operator is None:
+            return STOP, None
+        if now - operator.updated_at >= self.input_timeout:
+            if operator.command != STOP and not self._deadman:
+                self._deadman = True
+                self.deadman_stops += 1
+                logger.warning(f"Оператор {operator.client} молчит {now - operator.updated_at:.1f} с, остановка платформы")
+            return STOP, "deadman"
+        return operator.command, None
+
+    # --- Отправка в ESP32 ---
+    async def _control_loop(self):
+        period = 1.0 / self.control_rate
+        next_send = 0.0
+        while True:
+            now = time.monotonic()
+            target, reason = self._target(now)
+            if self._ws is not None and (target != self._sent or now - self._sent_at >= self.heartbeat_interval):
+                if target == self._sent:
+                    reason = "heartbeat"
+                if await self._send(target, now, reason or "change"):
+                    next_send = now + period
+            await self._wait(self._next_deadline(now))
+            # Изменения, пришедшие чаще DRIVE_CONTROL_RATE, сливаются: уйдет последнее
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def _next_deadline(self, now):
+        deadlines = []
+        if self._ws is not None:
+            deadlines.append(self._sent_at + self.heartbeat_interval)
+        operator = self._operators.get(self._owner)
+        if operator is not None and operator.command != STOP and not self._deadman:
+            deadlines.append(operator.updated_at + self.input_timeout)
+        return min(deadlines) if deadlines else None
+
+    async def _wait(self, deadline):
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _send(self, command, now, reason):
+        left, right = command
+        self._seq = (self._seq + 1) & 0xFFFF
+        try:
+            if self._binary:
+                await self._ws.send_bytes(encode_drive(left, right, self._seq))
+            else:
+                await self._ws.send_str(json.dumps({"command": "drive", "payload": {"left": left, "right": right}}))
+        except (ConnectionError, RuntimeError) as e:
+            logger.debug(f"Команда в ESP32 не отправлена: {e}")
+            return False
+        if command != self._sent:
+            self._pending = (command, self._seq, now)
+        self._sent, self._sent_at = command, now
+        self.metrics.messages.inc(reason)
+        if self.recorder is not None:
+            self.recorder.record(RecordKind.DRIVE_SENT, self.url, DRIVE_REASON_CODES[reason], left, right)
+        return True
+
+    # --- Соединение с ESP32 ---
+    async def _connection_loop(self):
+        while True:
+            try:
+                async with self._session.ws_connect(self.url, receive_timeout=DRIVE_STATUS_TIMEOUT) as ws:
+                    self._ws, self._sent, self._pending, self._binary = ws, None, None, False
+                    self.connects += 1
+                    logger.info(f"ESP32 подключен: {self.url}")
+                    if self.wire_format == "binary":
+                        # Старая прошивка бинарный кадр игнорирует, и соединение остается на JSON
+                        await ws.send_bytes(encode_get_status())
+                    self._wake()
+                    await self._read(ws)
+                logger.warning(f"ESP32 закрыл соединение: {self.url}")
+            except asyncio.TimeoutError:
+                logger.warning(f"ESP32 не отвечает {DRIVE_STATUS_TIMEOUT} с, переподключение: {self.url}")
+            except (aiohttp.ClientError, OSError) as e:
+                logger.warning(f"Нет соединения с ESP32 {self.url}: {type(e).__name__}: {e}")
+            finally:
+                if self._ws is not None:
+                    self._ws = None
+                    self._publish_status()
+            await asyncio.sleep(DRIVE_RECONNECT_INTERVAL)
+
+    async def _read(self, ws):
+        while True:
+            message = await ws.receive()
+            if message.type == aiohttp.WSMsgType.TEXT:
+                self._handle_text(message.data)
+            elif message.type == aiohttp.WSMsgType.BINARY:
+                self._handle_binary(message.data)
+            elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                  aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                return
+
+    def _handle_text(self, text):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            logger.warning(f"ESP32 прислал не JSON: {text[:100]!r}")
+            return
+        self._handle_message(message)
+
+    def _handle_binary(self, frame):
+        try:
+            message = decode(frame)
+        except WireFormatError as e:
+            logger.warning(f"ESP32 прислал неразборчивый кадр: {e}")
+            return
+        if not self._binary and message.get("type") == "status_update" and self.wire_format == "binary":
+            self._binary = True
+            logger.info(f"ESP32 понимает бинарный формат, команды идут бинарными кадрами: {self.url}")
+        self._handle_message(message)
+
+    def _handle_message(self, message):
+        if message.get("type") == "status_update" and isinstance(message.get("data"), dict):
+            self.status, self.status_at = message["data"], time.monotonic()
+            self._observe_actuation(self.status)
+            self._publish_status()
+        elif message.get("type") == "error":
+            logger.warning(f"Ошибка ESP32: {message.get('message')}")
+            self._publish(message)
+
+    def _observe_actuation(self, data):
+        if self._pending is None:
+            return
+        (left, right), seq, sent_at = self._pending
+        # Бинарный статус несет seq примененной команды; в JSON сверяем скорости
+        # (прошивка инвертирует правый мотор: motorR = -right)
+        applied = data["seq"] == seq if "seq" in data else data.get("motorL") == left and data.get("motorR") == -right
+        if applied:
+            self.metrics.actuation_seconds.labels().observe(time.monotonic() - sent_at)
+            self._pending = None
+
+    # --- Статус операторам ---
+    def status_data(self):
+        # seq - деталь канала с ESP32: с ним каждый heartbeat выглядел бы новым статусом
+        data = {key: value for key, value in (self.status or {}).items() if key != "seq"}
+        data["esp32Connected"] = self.connected
+        return data
+
+    def status_message(self):
+        return {"type": "status_update", "data": self.status_data()}
+
+    def _publish_status(self):
+        data = self.status_data()
+        if self.recorder is not None:
+            self.recorder.record(RecordKind.DRIVE_STATUS, self.url, 0, data.get("motorL"), data.get("motorR"),
+                                 flags=int(bool(data.get("failsafe"))) | (2 if data["esp32Connected"] else 0))
+        self.telemetry.publish(DRIVE_TELEMETRY_TOPIC, data)
+
+    def _publish(self, message):
+        for operator in list(self._operators.values()):
+            asyncio.ensure_future(self._deliver(operator.listener, message))
+
+    async def _deliver(self, listener, message):
+        try:
+            await listener(message)
+        except Exception as e:
+            logger.debug(f"Статус платформы не доставлен: {e}")
+
+    def snapshot(self):
+        now = time.monotonic()
+        target, _ = self._target(now)
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "connects": self.connects,
+            "wire_format": "binary" if self._binary else "json",
+            "target": list(target),
+            "sent": list(self._sent) if self._sent is not None else None,
+            "sent_age": round(now - self._sent_at, 3) if self._sent is not None else None,
+            "status": self.status,
+            "status_age": round(now - self.status_at, 3) if self.status_at is not None else None,
+            "deadman_stops": self.deadman_stops,
+            "operators": [{
+                "id": operator_id,
+                "client": operator.client,
+                "command": list(operator.command),
+                "input_age": round(now - operator.updated_at, 3),
+                "inputs": operator.inputs,
+                "owner": operator_id == self._owner,
+            } for operator_id, operator in list(self._operators.items())],
+        }
+
+    async def close(self):
+        """Останавливает платформу и закрывает соединение с ESP32."""
+        if self._ws is not None:
+            await self._send(STOP, time.monotonic(), "shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._operators.clear()
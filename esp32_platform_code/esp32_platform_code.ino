@@ -31,6 +31,33 @@ String lastCommand = "None";
 int currentLeftSpeed = 0;
 int currentRightSpeed = 0;
 
+// Failsafe: моторы останавливаются, если drive не приходил дольше этого (мс).
+// Шлюз (drive_relay.py) повторяет текущую команду каждые 500 мс, поэтому при живом
+// шлюзе failsafe не срабатывает, а при его падении или обрыве Wi-Fi платформа встает.
+const unsigned long DRIVE_FAILSAFE_MS = 1500;
+unsigned long lastDriveCommandTime = 0;
+bool failsafeStopped = false;
+
+// Бинарный формат (platform_wire.py в шлюзе, PlatformController.js): фиксированные
+// кадры little-endian [версия, тип, ...]. Клиенту, приславшему бинарный кадр, статусы
+// идут бинарными кадрами, остальным - JSON, как раньше.
+const uint8_t WIRE_VERSION = 1;
+const uint8_t WIRE_DRIVE = 0x01;       // int8 left, int8 right, uint16 seq - 6 байт
+const uint8_t WIRE_GET_STATUS = 0x02;  // 2 байта
+const uint8_t WIRE_STATUS = 0x81;      // int8 motorL, int8 motorR, uint16 seq, uint8 flags, резерв - 8 байт
+const uint8_t WIRE_ERROR = 0x82;       // uint8 code, резерв - 4 байта
+const uint8_t WIRE_FLAG_FAILSAFE = 0x01;
+const uint8_t WIRE_ERROR_VERSION = 1;
+const uint8_t WIRE_ERROR_LENGTH = 2;
+const uint8_t WIRE_ERROR_TYPE = 3;
+uint16_t lastDriveSeq = 0;
+
+// Подключенные клиенты и их формат (id AsyncWebSocketClient; 0 - свободный слот),
+// по размеру DEFAULT_MAX_WS_CLIENTS библиотеки
+const int MAX_WS_CLIENTS = 8;
+uint32_t clientIds[MAX_WS_CLIENTS] = {0};
+bool clientBinary[MAX_WS_CLIENTS] = {false};
+
 // HTML-код страницы (остается как есть, т.к. JS будет изменен отдельно)
 const char index_html[] PROGMEM = R"rawliteral(
 // ... (ваш существующий HTML код остается здесь без изменений) ...
@@ -126,11 +153,55 @@ void setPlatformSpeed(int leftSpeedPercent, int rightSpeedPercent) {
   teaserServoRight.writeMicroseconds(rightPulse);
 }
 
+int findClient(uint32_t id) {
+  for (int i = 0; i < MAX_WS_CLIENTS; i++) {
+    if (clientIds[i] == id) return i;
+  }
+  return -1;
+}
+
+void addClient(uint32_t id) {
+  int slot = findClient(0);
+  if (slot >= 0) {
+    clientIds[slot] = id;
+    clientBinary[slot] = false;
+  }
+}
+
+void removeClient(uint32_t id) {
+  int slot = findClient(id);
+  if (slot >= 0) {
+    clientIds[slot] = 0;
+    clientBinary[slot] = false;
+  }
+}
+
+bool isBinaryClient(uint32_t id) {
+  int slot = findClient(id);
+  return slot >= 0 && clientBinary[slot];
+}
+
+void sendBinaryStatus(AsyncWebSocketClient *client) {
+  uint8_t frame[8] = {WIRE_VERSION, WIRE_STATUS, (uint8_t)(int8_t)currentLeftSpeed, (uint8_t)(int8_t)currentRightSpeed,
+                      (uint8_t)(lastDriveSeq & 0xFF), (uint8_t)(lastDriveSeq >> 8),
+                      (uint8_t)(failsafeStopped ? WIRE_FLAG_FAILSAFE : 0), 0};
+  client->binary(frame, sizeof(frame));
+}
+
+void sendBinaryError(AsyncWebSocketClient *client, uint8_t code) {
+  uint8_t frame[4] = {WIRE_VERSION, WIRE_ERROR, code, 0};
+  client->binary(frame, sizeof(frame));
+}
+
 // Функция для отправки текущего статуса платформы клиенту WebSocket
 void sendPlatformStatus(AsyncWebSocketClient *client) {
   if (!client || client->status() != WS_CONNECTED) {
     return;
   }
+  if (isBinaryClient(client->id())) {
+    sendBinaryStatus(client);
+    return;
+  }
 
   StaticJsonDocument<256> doc; // Документ для исходящего JSON
   doc["type"] = "status_update";
@@ -158,18 +229,66 @@ void sendWsError(AsyncWebSocketClient *client, const String& message) {
   client->text(output);
 }
 
+// Команда drive (из JSON или бинарного кадра): скорости моторов и отметка для failsafe
+void applyDrive(int conceptualL, int conceptualR) {
+  int actualLeftForMotor = conceptualL;
+  int actualRightForMotor = -conceptualR; // Инверсия правого мотора
+
+  actualLeftForMotor = constrain(actualLeftForMotor, -100, 100);
+  actualRightForMotor = constrain(actualRightForMotor, -100, 100);
+
+  setPlatformSpeed(actualLeftForMotor, actualRightForMotor);
+  lastDriveCommandTime = millis();
+  failsafeStopped = false;
+
+  currentLeftSpeed = actualLeftForMotor;
+  currentRightSpeed = actualRightForMotor;
+  lastCommand = "WS Drive (L:" + String(conceptualL) + " R:" + String(conceptualR) +
+                " -> M_L:" + String(actualLeftForMotor) + " M_R:" + String(actualRightForMotor) + ")";
+}
+
+// Бинарный кадр: без JSON разбора и без вывода в Serial на каждую команду
+void handleBinaryFrame(AsyncWebSocketClient *client, const uint8_t *data, size_t len) {
+  int slot = findClient(client->id());
+  if (slot >= 0) clientBinary[slot] = true;
+  if (len < 2 || data[0] != WIRE_VERSION) {
+    sendBinaryError(client, len < 2 ? WIRE_ERROR_LENGTH : WIRE_ERROR_VERSION);
+    return;
+  }
+  switch (data[1]) {
+    case WIRE_DRIVE:
+      if (len != 6) { sendBinaryError(client, WIRE_ERROR_LENGTH); return; }
+      lastDriveSeq = (uint16_t)data[4] | ((uint16_t)data[5] << 8);
+      applyDrive((int8_t)data[2], (int8_t)data[3]);
+      sendBinaryStatus(client);
+      break;
+    case WIRE_GET_STATUS:
+      if (len != 2) { sendBinaryError(client, WIRE_ERROR_LENGTH); return; }
+      sendBinaryStatus(client);
+      break;
+    default:
+      sendBinaryError(client, WIRE_ERROR_TYPE);
+  }
+}
+
 // Обработчик событий WebSocket
 void onWsEvent(AsyncWebSocket *server, AsyncWebSocketClient *client, AwsEventType type, void *arg, uint8_t *data, size_t len) {
   switch (type) {
     case WS_EVT_CONNECT:
       Serial.printf("WebSocket client #%u connected from %s\n", client->id(), client->remoteIP().toString().c_str());
+      addClient(client->id());
       sendPlatformStatus(client); // Отправляем начальный статус при подключении
       break;
     case WS_EVT_DISCONNECT:
       Serial.printf("WebSocket client #%u disconnected\n", client->id());
+      removeClient(client->id());
       break;
     case WS_EVT_DATA: {
       AwsFrameInfo *info = (AwsFrameInfo*)arg;
+      if (info->final && info->index == 0 && info->len == len && info->opcode == WS_BINARY) {
+        handleBinaryFrame(client, data, len);
+        break;
+      }
       if (info->final && info->index == 0 && info->len == len && info->opcode == WS_TEXT) {
         // Данные пришли целиком и это текст
         char* msg_char = (char*)data;
@@ -195,20 +314,8 @@ void onWsEvent(AsyncWebSocket *server, AsyncWebSocketClient *client, AwsEventTyp
             int conceptualL = payload["left"].as<int>();   // .as<int>() вернет 0 если ключ не найден или тип не тот
             int conceptualR = payload["right"].as<int>();
 
-            int actualLeftForMotor = conceptualL;
-            int actualRightForMotor = -conceptualR; // Инверсия правого мотора
-
-            actualLeftForMotor = constrain(actualLeftForMotor, -100, 100);
-            actualRightForMotor = constrain(actualRightForMotor, -100, 100);
-
-            setPlatformSpeed(actualLeftForMotor, actualRightForMotor);
-
-            currentLeftSpeed = actualLeftForMotor;
-            currentRightSpeed = actualRightForMotor;
-            lastCommand = "WS Drive (L:" + String(conceptualL) + " R:" + String(conceptualR) +
-                          " -> M_L:" + String(actualLeftForMotor) + " M_R:" + String(actualRightForMotor) + ")";
+            applyDrive(conceptualL, conceptualR);
             Serial.println(lastCommand);
-            
             sendPlatformStatus(client); // Отправляем обновленный статус
 
           } else {
@@ -297,20 +404,38 @@ const long statusUpdateInterval = 200; // Отправлять статус ка
 
 void loop() {
   unsigned long currentTime = millis();
+  if ((currentLeftSpeed != 0 || currentRightSpeed != 0) && currentTime - lastDriveCommandTime > DRIVE_FAILSAFE_MS) {
+    setPlatformSpeed(0, 0);
+    currentLeftSpeed = 0;
+    currentRightSpeed = 0;
+    failsafeStopped = true;
+    lastCommand = "Failsafe stop";
+    Serial.println(lastCommand);
+  }
   if (currentTime - lastStatusUpdateTime > statusUpdateInterval) {
     lastStatusUpdateTime = currentTime;
     if (ws.count() > 0) { // Если есть подключенные клиенты
-      // Создаем JSON для статуса
-      StaticJsonDocument<256> doc; // Документ для исходящего JSON
-      doc["type"] = "status_update";
-      JsonObject data = doc.createNestedObject("data");
-      data["motorL"] = currentLeftSpeed;
-      data["motorR"] = currentRightSpeed;
-      // data["lastCommand"] = lastCommand; // Раскомментируйте, если нужно, но может быть длинным для частых обновлений
-
+      // JSON собирается, только если есть текстовые клиенты; бинарным уходит 8-байтный кадр
       String output;
-      serializeJson(doc, output);
-      ws.textAll(output); // Отправляем всем подключенным клиентам
+      for (int i = 0; i < MAX_WS_CLIENTS; i++) {
+        if (clientIds[i] == 0) continue;
+        AsyncWebSocketClient *client = ws.client(clientIds[i]);
+        if (!client || client->status() != WS_CONNECTED) continue;
+        if (clientBinary[i]) {
+          sendBinaryStatus(client);
+          continue;
+        }
+        if (output.length() == 0) {
+          StaticJsonDocument<256> doc; // Документ для исходящего JSON
+          doc["type"] = "status_update";
+          JsonObject data = doc.createNestedObject("data");
+          data["motorL"] = currentLeftSpeed;
+          data["motorR"] = currentRightSpeed;
+          // data["lastCommand"] = lastCommand; // Раскомментируйте, если нужно, но может быть длинным для частых обновлений
+          serializeJson(doc, output);
+        }
+        client->text(output);
+      }
     }
   }
   ws.cleanupClients(); // Важно для корректной работы AsyncWebSocket
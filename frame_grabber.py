@@ -0,0 +1,105 @@
+"""
+Захват кадров cv2.VideoCapture в отдельном потоке для локальной консоли.
+
+Поток захвата читает и декодирует поток камеры без остановок, а в слоте
+хранится только последний кадр: если отображение не успевает, старые кадры
+выбрасываются, и буфер OpenCV не копит задержку. Цикл отображения берет
+самый свежий кадр и не ждет ничего, кроме него.
+
+LatencyProbe меряет задержку от получения кадра потоком захвата до его показа.
+"""
+import threading
+import time
+from collections import deque, namedtuple
+
+GRABBER_READ_TIMEOUT = 0.03        # Сколько цикл отображения ждет новый кадр, прежде чем обработать клавиши (сек)
+LATENCY_WINDOW = 300               # Кадров в окне статистики задержки
+LATENCY_REPORT_INTERVAL = 5.0      # Как часто печатать сводку задержки (сек)
+
+# captured_at - time.perf_counter() сразу после декодирования кадра
+GrabbedFrame = namedtuple("GrabbedFrame", ("image", "seq", "captured_at"))
+
+
+class LatestFrameGrabber:
+    """Поток захвата с одним слотом: read() всегда отдает самый свежий кадр."""
+
+    def __init__(self, capture, name="frame-grabber"):
+        self._capture = capture
+        self._cond = threading.Condition()
+        self._slot = None
+        self._last_read_seq = 0
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.ended = False     # Камера перестала отдавать кадры
+        self.frames = 0        # Декодировано кадров
+        self.dropped = 0       # Перезаписано в слоте, не дойдя до отображения
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                ok, image = self._capture.read()
+                if not ok:
+                    break
+                with self._cond:
+                    self.frames += 1
+                    if self._slot is not None and self._slot.seq > self._last_read_seq:
+                        self.dropped += 1
+                    self._slot = GrabbedFrame(image, self.frames, time.perf_counter())
+                    self._cond.notify_all()
+        finally:
+            # release() в том же потоке, что и read(): OpenCV не потокобезопасен для одного capture
+            self._capture.release()
+            with self._cond:
+                self.ended = True
+                self._cond.notify_all()
+
+    def read(self, timeout=GRABBER_READ_TIMEOUT):
+        """Кадр новее последнего прочитанного; None, если за timeout его нет или поток закончился."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.ended or (self._slot is not None and self._slot.seq > self._last_read_seq),
+                                timeout)
+            if self._slot is None or self._slot.seq <= self._last_read_seq:
+                return None
+            self._last_read_seq = self._slot.seq
+            return self._slot
+
+    def stop(self, timeout=2.0):
+        self._stopping = True
+        self._thread.join(timeout)
+
+
+class LatencyProbe:
+    """Задержка захват -> показ по скользящему окну кадров."""
+
+    def __init__(self, window=LATENCY_WINDOW, report_interval=LATENCY_REPORT_INTERVAL):
+        self._samples = deque(maxlen=window)
+        self._report_interval = report_interval
+        self._last_report_at = time.monotonic()
+        self.last_ms = None
+
+    def record(self, captured_at, displayed_at):
+        self.last_ms = (displayed_at - captured_at) * 1000
+        self._samples.append(self.last_ms)
+
+    def summary(self):
+        ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return {
+            "count": len(ordered),
+            "p50_ms": ordered[len(ordered) // 2],
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            "max_ms": ordered[-1],
+        }
+
+    def due(self):
+        """Пора печатать сводку (не чаще report_interval)."""
+        now = time.monotonic()
+        if now - self._last_report_at < self._report_interval:
+            return False
+        self._last_report_at = now
+        return True
@@ -0,0 +1,372 @@
+"""
+Режим супервизора: шлюз из нескольких процессов, чтобы камеры не делили одно ядро.
+
+В одном процессе CPython прием RTSP, декодирование, общие энкодеры и отправка
+RTP всех камер делят один GIL, и шлюз упирается в одно ядро, сколько бы камер
+ни было. Супервизор запускает несколько процессов-воркеров - каждый обычный
+шлюз app.py в ASGI режиме на своем Unix сокете - и закрепляет каждую камеру за
+одним из них: ingest, энкодеры и пиры камеры живут в одном процессе, а камеры
+разных воркеров кодируются на разных ядрах.
+
+Фронт (процесс супервизора) принимает браузеры на обычных портах и по хосту
+камеры (camera_host) передает ее воркеру /offer, /api/ptz, /api/snapshot и
+/api/clip - HTTP поверх Unix сокета, - а WebSocket сигнализации соединяет с
+воркером целиком. Медиа идет от воркера к браузеру напрямую, фронт участвует
+только в сигнализации. Новая камера закрепляется за воркером с наименьшим
+числом камер и больше не переезжает: два воркера с одной камерой открыли бы ее
+RTSP дважды. Ретранслятор платформы и хаб телеметрии остаются во фронте, а темы
+хабов воркеров (позиции PTZ) фронт читает из их /ws/telemetry и публикует в
+свой хаб.
+
+Воркер проверяется GET WORKER_HEALTH_PATH каждые SUPERVISOR_HEALTH_INTERVAL
+секунд. Завершившийся или не ответивший SUPERVISOR_HEALTH_FAILURES раз подряд
+воркер перезапускается; пока он не поднялся, запросы к его камерам получают
+WorkerUnavailable, а зрители переподключаются к новому процессу.
+Используется только из background_loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from asgi_server import WebSocketClosed
+
+logger = logging.getLogger(__name__)
+
+SUPERVISOR_HEALTH_INTERVAL = 2.0        # Период проверки воркера (сек)
+SUPERVISOR_HEALTH_TIMEOUT = 2.0         # Проверка дольше - не пройдена
+SUPERVISOR_HEALTH_FAILURES = 3          # Непройденных проверок подряд до перезапуска
+SUPERVISOR_START_TIMEOUT = 30.0         # Сколько новый воркер может не отвечать (импорт aiortc и av)
+SUPERVISOR_RESTART_DELAY = 1.0          # Пауза перед перезапуском; удваивается, пока воркер падает до первой проверки
+SUPERVISOR_RESTART_MAX_DELAY = 30.0
+SUPERVISOR_STOP_TIMEOUT = 5.0           # Ожидание выхода по SIGTERM до SIGKILL (сек)
+SUPERVISOR_REQUEST_TIMEOUT = 30.0       # Запрос к воркеру целиком; /offer ждет камеру до OFFER_TIMEOUT
+WORKER_HEALTH_PATH = "/api/worker/health"
+
+_STARTING_POLL_INTERVAL = 0.2           # Проверки нового воркера чаще: камеры ждут его готовности
+_WORKER_URL = "http://worker"           # Хост не важен: соединение идет в Unix сокет воркера
+
+
+class WorkerUnavailable(Exception):
+    """Воркер камеры не запущен или не ответил."""
+
+
+def camera_host(address):
+    """Ключ закрепления камеры за воркером: хост из RTSP URL или из адреса PTZ (IP[:порт])."""
+    try:
+        host = urlsplit(address if "://" in address else f"//{address}").hostname
+    except ValueError:
+        host = None
+    return host or address
+
+
+class WorkerProcess:
+    """
+    Процесс-воркер: запуск командой command(index, socket_path), проверки, перезапуск,
+    HTTP запросы и WebSocket к нему через Unix сокет.
+    """
+
+    def __init__(self, index, socket_path, command):
+        self.index = index
+        self.socket_path = socket_path
+        self.state = "stopped"      # starting, up, down, stopped
+        self.restarts = 0
+        self.failures = 0           # Непройденных проверок подряд
+        self.health = None          # Последний ответ WORKER_HEALTH_PATH
+        self.started_at = None
+        self.cameras = set()
+        self.process = None
+        self._command = command
+        self._session = None
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def start(self):
+        # Без общего таймаута сессии: он оборвал бы долгие WebSocket; запросам - свой
+        self._session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.socket_path),
+                                              timeout=aiohttp.ClientTimeout(total=None))
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._supervise())
+
+    async def _supervise(self):
+        crashes = 0  # Перезапусков подряд без пройденной проверки
+        while True:
+            self._spawn()
+            reached_up = await self._watch()
+            await self._stop_process()
+            self.restarts += 1
+            crashes = 0 if reached_up else crashes + 1
+            delay = min(SUPERVISOR_RESTART_DELAY * 2 ** crashes, SUPERVISOR_RESTART_MAX_DELAY)
+            logger.warning(f"Воркер {self.index} будет перезапущен через {delay:g} с")
+            await asyncio.sleep(delay)
+
+    def _spawn(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # Сокет упавшего процесса
+        # Своя группа процессов: Ctrl+C в терминале получает только фронт, а он останавливает воркеры сам,
+        # иначе супервизор успел бы перезапустить вышедший по Ctrl+C воркер
+        self.process = subprocess.Popen(self._command(self.index, self.socket_path), start_new_session=True)
+        self.state, self.failures, self.health = "starting", 0, None
+        self.started_at = time.monotonic()
+        logger.info(f"Воркер {self.index} запущен: pid {self.process.pid}, сокет {self.socket_path}")
+
+    async def _watch(self):
+        """Ждет выхода или зависания процесса; True, если воркер успел пройти проверку."""
+        reached_up = False
+        while True:
+            # Неудачный запрос к воркеру будит проверку сразу, не дожидаясь периода
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), _STARTING_POLL_INTERVAL if self.state == "starting"
+                                       else SUPERVISOR_HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            code = self.process.poll()
+            if code is not None:
+                self.state = "down"
+                logger.error(f"Воркер {self.index} (pid {self.process.pid}) завершился с кодом {code}")
+                return reached_up
+            try:
+                async with self._session.get(_WORKER_URL + WORKER_HEALTH_PATH,
+                                             timeout=aiohttp.ClientTimeout(total=SUPERVISOR_HEALTH_TIMEOUT)) as response:
+                    response.raise_for_status()
+                    self.health = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if self.state == "starting" and time.monotonic() - self.started_at < SUPERVISOR_START_TIMEOUT:
+                    continue
+                self.failures += 1
+                logger.warning(f"Воркер {self.index}: проверка не пройдена "
+                               f"({self.failures}/{SUPERVISOR_HEALTH_FAILURES}): {e!r}")
+                if self.failures >= SUPERVISOR_HEALTH_FAILURES:
+                    self.state = "down"
+                    logger.error(f"Воркер {self.index} (pid {self.process.pid}) не отвечает, перезапуск")
+                    return reached_up
+                continue
+            if self.state != "up":
+                logger.info(f"Воркер {self.index} готов за {time.monotonic() - self.started_at:.1f} с")
+            self.state, self.failures, reached_up = "up", 0, True
+
+    async def _stop_process(self):
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, process.wait, SUPERVISOR_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Воркер {self.index} (pid {process.pid}) не завершился за "
+                           f"{SUPERVISOR_STOP_TIMEOUT:g} с, SIGKILL")
+            process.kill()
+            await loop.run_in_executor(None, process.wait)
+
+    def _check_up(self):
+        if self.state == "up" and self.process.poll() is not None:
+            self.state = "down"
+            self._wakeup.set()
+        if self.state != "up":
+            raise WorkerUnavailable(f"Воркер {self.index} не готов ({self.state})")
+
+    def _failed(self, message):
+        self._wakeup.set()
+        return WorkerUnavailable(message)
+
+    @staticmethod
+    def _headers(client):
+        # Воркер считает лимиты сессий по адресу браузера, а не фронта
+        return {"X-Forwarded-For": client} if client else {}
+
+    async def request(self, method, path, body=None, query=None, content_type=None, client=None):
+        """(HTTP статус, тело, content-type) ответа воркера; WorkerUnavailable, если он не готов или не ответил."""
+        self._check_up()
+        headers = self._headers(client)
+        if content_type:
+            headers["Content-Type"] = content_type
+        try:
+            async with self._session.request(method, _WORKER_URL + path, data=body, params=query, headers=headers,
+                                             timeout=aiohttp.ClientTimeout(total=SUPERVISOR_REQUEST_TIMEOUT)) as response:
+                return (response.status, await response.read(),
+                        response.headers.get("Content-Type", "application/octet-stream"))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise self._failed(f"Воркер {self.index} не ответил на {method} {path}: {e or type(e).__name__}")
+
+    async def websocket(self, path, client=None):
+        """aiohttp WebSocket к пути воркера; WorkerUnavailable, если он не готов или не принял соединение."""
+        self._check_up()
+        try:
+            return await self._session.ws_connect(_WORKER_URL + path, headers=self._headers(client))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise self._failed(f"Воркер {self.index} не принял WebSocket {path}: {e or type(e).__name__}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._stop_process()
+        self.state = "stopped"
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def as_dict(self, now):
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "state": self.state,
+            "uptime": round(now - self.started_at, 1) if self.state == "up" else None,
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "cameras": sorted(self.cameras),
+            "health": self.health,
+        }
+
+
+class GatewaySupervisor:
+    """
+    workers процессов-воркеров, закрепление камер за ними и пересылка запросов.
+    telemetry - хаб фронта, в который публикуются темы хабов воркеров с префиксами
+    telemetry_prefixes.
+    """
+
+    def __init__(self, workers, command, telemetry=None, telemetry_prefixes=()):
+        self.socket_dir = tempfile.mkdtemp(prefix="roverpilot-workers-")
+        self.workers = [WorkerProcess(index, os.path.join(self.socket_dir, f"worker-{index}.sock"), command)
+                        for index in range(workers)]
+        self.forwarded = 0          # HTTP запросов передано воркерам
+        self.websockets = 0         # WebSocket соединено с воркерами
+        self.unavailable = 0        # Запросов и соединений без готового воркера
+        self._assignments = {}
+        self._telemetry = telemetry
+        self._telemetry_path = "/ws/telemetry?ack=1" + \
+            (f"&topics={','.join(telemetry_prefixes)}" if telemetry_prefixes else "")
+        self._telemetry_tasks = []
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        if self._telemetry is not None:
+            self._telemetry_tasks = [asyncio.ensure_future(self._follow_telemetry(worker)) for worker in self.workers]
+        logger.info(f"Супервизор: {len(self.workers)} воркеров, сокеты в {self.socket_dir}")
+
+    def worker_for(self, key):
+        """Воркер камеры key (camera_host); новая камера достается воркеру с наименьшим числом камер."""
+        index = self._assignments.get(key)
+        if index is None:
+            worker = min(self.workers, key=lambda w: len(w.cameras))
+            worker.cameras.add(key)
+            index = self._assignments[key] = worker.index
+            logger.info(f"Камера {key} закреплена за воркером {index}")
+        return self.workers[index]
+
+    async def request(self, key, method, path, body=None, query=None, content_type=None, client=None):
+        """Запрос к воркеру камеры key: (HTTP статус, тело, content-type); WorkerUnavailable."""
+        try:
+            result = await self.worker_for(key).request(method, path, body, query, content_type, client)
+        except WorkerUnavailable:
+            self.unavailable += 1
+            raise
+        self.forwarded += 1
+        return result
+
+    async def proxy_websocket(self, websocket, key, path, first_message):
+        """
+        Соединяет WebSocket клиента с тем же путем воркера камеры key: first_message, уже
+        прочитанное фронтом, уходит первым, дальше кадры идут в обе стороны как есть,
+        пока одна из сторон не закроется. WorkerUnavailable - воркер не принял соединение.
+        """
+        try:
+            upstream = await self.worker_for(key).websocket(path, websocket.client_host)
+        except WorkerUnavailable:
+            self.unavailable += 1
+            raise
+        self.websockets += 1
+        pumps = []
+        try:
+            await upstream.send_str(first_message)
+            pumps = [asyncio.ensure_future(_client_to_worker(websocket, upstream)),
+                     asyncio.ensure_future(_worker_to_client(upstream, websocket))]
+            await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            await asyncio.gather(*pumps, return_exceptions=True)
+            await upstream.close()
+
+    async def _follow_telemetry(self, worker):
+        """Темы хаба воркера - в хаб фронта; при обрыве соединения с воркером его темы удаляются."""
+        topics = set()
+        while True:
+            if worker.state == "up":
+                try:
+                    upstream = await worker.websocket(self._telemetry_path)
+                    try:
+                        async for message in upstream:
+                            if message.type != aiohttp.WSMsgType.TEXT:
+                                continue
+                            data = json.loads(message.data)
+                            for topic, value in data.get("topics", {}).items():
+                                if value is None:
+                                    self._telemetry.remove(topic)
+                                    topics.discard(topic)
+                                else:
+                                    self._telemetry.publish(topic, value)
+                                    topics.add(topic)
+                            await upstream.send_str(json.dumps({"type": "ack", "seq": data.get("seq")}))
+                    finally:
+                        await upstream.close()
+                except (WorkerUnavailable, aiohttp.ClientError, ValueError, AttributeError) as e:
+                    logger.debug(f"Телеметрия воркера {worker.index} недоступна: {e!r}")
+                for topic in topics:
+                    self._telemetry.remove(topic)
+                topics.clear()
+            await asyncio.sleep(SUPERVISOR_HEALTH_INTERVAL)
+
+    async def close(self):
+        for task in self._telemetry_tasks:
+            task.cancel()
+        await asyncio.gather(*self._telemetry_tasks, return_exceptions=True)
+        self._telemetry_tasks = []
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "socket_dir": self.socket_dir,
+            "forwarded": self.forwarded,
+            "websockets": self.websockets,
+            "unavailable": self.unavailable,
+            "workers": [worker.as_dict(now) for worker in self.workers],
+        }
+
+
+async def _client_to_worker(websocket, upstream):
+    try:
+        while True:
+            data = await websocket.receive()
+            if isinstance(data, str):
+                await upstream.send_str(data)
+            else:
+                await upstream.send_bytes(data)
+    except WebSocketClosed:
+        pass
+
+
+async def _worker_to_client(upstream, websocket):
+    async for message in upstream:
+        if message.type == aiohttp.WSMsgType.TEXT:
+            await websocket.send_text(message.data)
+        elif message.type == aiohttp.WSMsgType.BINARY:
+            await websocket.send_bytes(message.data)
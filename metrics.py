@@ -0,0 +1,150 @@
+"""
+Метрики шлюза в текстовом формате Prometheus (GET /metrics).
+
+Гистограммы с фиксированными границами корзин: observe() - один bisect и два
+сложения, без выделения памяти на горячем пути. Счетчики и гистограммы с
+метками хранятся по кортежу значений меток. Все изменения идут из
+background_loop, там же собирается и текст для /metrics.
+"""
+import bisect
+import math
+
+# Сборка SOAP запроса: форматирование готового шаблона, микросекунды
+PTZ_BUILD_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+# Ответ камеры: от LAN до зависшей прошивки под таймаутом чтения
+PTZ_RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Команда платформы: от отправки в ESP32 до его статуса с новыми скоростями (Wi-Fi LAN)
+DRIVE_ACTUATION_BUCKETS = (0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """Распределение значений по фиксированным корзинам (верхние границы включительно)."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(int(value))
+
+
+class HistogramFamily:
+    """Гистограммы одной метрики по значениям меток."""
+
+    def __init__(self, name, help_text, label_names, bounds):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.bounds = bounds
+        self._series = {}
+
+    def labels(self, *values):
+        histogram = self._series.get(values)
+        if histogram is None:
+            histogram = self._series[values] = Histogram(self.bounds)
+        return histogram
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, histogram in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), histogram.counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, values, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(histogram.sum)}")
+            lines.append(f"{self.name}_count{labels} {histogram.count}")
+        return lines
+
+
+class CounterFamily:
+    """Монотонные счетчики одной метрики по значениям меток."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, *values, amount=1):
+        self._series[values] = self._series.get(values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, count in list(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(count)}")
+        return lines
+
+
+def render_samples(name, help_text, metric_type, label_names, samples):
+    """Строки метрики, значения которой считаются при сборе: samples - [(значения меток, значение)]."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for values, value in samples:
+        lines.append(f"{name}{_format_labels(label_names, values)} {_format_value(value)}")
+    return lines
+
+
+class PtzMetrics:
+    """Телеметрия ONVIF вызовов по типу камеры и действию."""
+
+    def __init__(self):
+        labels = ("camera_type", "action")
+        self.build_seconds = HistogramFamily(
+            "ptz_request_build_seconds", "Время сборки SOAP запроса PTZ", labels, PTZ_BUILD_BUCKETS)
+        self.rtt_seconds = HistogramFamily(
+            "ptz_request_rtt_seconds", "Время от отправки PTZ запроса до ответа камеры", labels, PTZ_RTT_BUCKETS)
+        self.requests = CounterFamily(
+            "ptz_requests_total", "PTZ запросы по результату: HTTP код, timeout, error или unavailable",
+            labels + ("status",))
+
+    def observe(self, camera_type, action, status, build_seconds=None, rtt_seconds=None):
+        if build_seconds is not None:
+            self.build_seconds.labels(camera_type, action).observe(build_seconds)
+        if rtt_seconds is not None:
+            self.rtt_seconds.labels(camera_type, action).observe(rtt_seconds)
+        self.requests.inc(camera_type, action, str(status))
+
+    def render(self):
+        return self.build_seconds.render() + self.rtt_seconds.render() + self.requests.render()
+
+
+class DriveMetrics:
+    """Телеметрия ретранслятора платформы: команды в ESP32 и задержка их исполнения."""
+
+    def __init__(self):
+        self.actuation_seconds = HistogramFamily(
+            "drive_actuation_seconds", "От отправки команды в ESP32 до статуса с новыми скоростями", (),
+            DRIVE_ACTUATION_BUCKETS)
+        self.messages = CounterFamily(
+            "drive_messages_sent_total", "Команд drive отправлено в ESP32 по причине: change, heartbeat, deadman, shutdown",
+            ("reason",))
+        self.inputs = CounterFamily("drive_operator_inputs_total", "Сообщений drive от операторов", ())
+
+    def render(self):
+        return self.actuation_seconds.render() + self.messages.render() + self.inputs.render()
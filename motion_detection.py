@@ -0,0 +1,252 @@
+"""
+Детектор движения на кадрах RTSP источника.
+
+Анализатор подписан на декодированные кадры источника через MediaRelay без
+буфера, как зритель с перекодом, и берет кадр не чаще MOTION_SAMPLE_FPS.
+Сам анализ - яркость, уменьшение блочным средним до MOTION_ANALYSIS_WIDTH и
+разность с фоном (экспоненциальное среднее) на NumPy - идет в пуле потоков.
+У каждого анализатора не больше одного кадра в работе: если пул не успевает,
+кадр пропускается, поэтому очередь ограничена, а loop и зрители анализа не ждут.
+
+События начала и конца движения получают слушатели источника (сигнализация
+зрителя) и история для GET /api/motion.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import time
+from collections import Counter, deque
+
+import numpy as np # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from media_sources import mask_credentials
+
+logger = logging.getLogger(__name__)
+
+MOTION_SAMPLE_FPS = 5.0           # Сколько кадров в секунду анализировать на источник
+MOTION_ANALYSIS_WIDTH = 160       # Ширина уменьшенного кадра (пикс)
+MOTION_PIXEL_THRESHOLD = 25       # Отличие яркости от фона, при котором пиксель считается изменившимся
+MOTION_BACKGROUND_ALPHA = 0.05    # Скорость обновления фона (доля нового кадра)
+MOTION_AREA_START = 0.02          # Доля изменившихся пикселей для начала движения
+MOTION_AREA_END = 0.005           # Ниже этой доли движение считается затихшим
+MOTION_END_HOLD = 2.0             # Сколько секунд движение должно отсутствовать до события конца (сек)
+MOTION_WORKERS = 1                # Потоки анализа на все источники
+MOTION_EVENT_HISTORY = 50         # Последние события для /api/motion
+
+# Форматы, у которых первая плоскость - яркость
+_LUMA_FIRST_FORMATS = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12", "nv21", "gray"}
+
+
+def luma_plane(frame):
+    """Яркость av.VideoFrame как uint8 массив (h, w); для YUV без копирования."""
+    if frame.format.name in _LUMA_FIRST_FORMATS:
+        plane = frame.planes[0]
+        return np.frombuffer(plane, np.uint8).reshape(plane.height, plane.line_size)[:, :plane.width]
+    return frame.to_ndarray(format="gray")
+
+
+def downscale(gray, width=MOTION_ANALYSIS_WIDTH):
+    """Уменьшение в целое число раз блочным средним (float32); заодно гасит шум матрицы."""
+    factor = min(max(1, gray.shape[1] // width), 257)  # 257 * 255 еще помещается в uint16
+    h, w = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    # Сначала складываем строки блока целиком (непрерывные векторы), потом столбцы:
+    # в разы быстрее, чем mean по осям (1, 3) четырехмерного представления
+    rows = gray[:h, :w].reshape(h // factor, factor, w).sum(axis=1, dtype=np.uint16)
+    blocks = rows.reshape(h // factor, w // factor, factor).sum(axis=2, dtype=np.uint32)
+    return blocks.astype(np.float32) * np.float32(1.0 / (factor * factor))
+
+
+class MotionDetector:
+    """Вычитание фона: фон - экспоненциальное среднее уменьшенных кадров."""
+
+    def __init__(self, pixel_threshold=MOTION_PIXEL_THRESHOLD, alpha=MOTION_BACKGROUND_ALPHA):
+        self.pixel_threshold = pixel_threshold
+        self.alpha = alpha
+        self._background = None
+
+    def update(self, small):
+        """
+        (доля изменившихся пикселей, bbox) для уменьшенного кадра и обновление фона.
+        bbox - (x0, y0, x1, y1) в долях кадра или None, если изменений нет.
+        """
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.copy()
+            return 0.0, None
+        delta = small - self._background
+        self._background += self.alpha * delta
+        # Общая смена яркости (автоэкспозиция, облако) сдвигает весь кадр - это не движение
+        delta -= delta.mean()
+        mask = np.abs(delta) > self.pixel_threshold
+        changed = np.count_nonzero(mask)
+        if not changed:
+            return 0.0, None
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        h, w = mask.shape
+        bbox = (cols[0] / w, rows[0] / h, (cols[-1] + 1) / w, (rows[-1] + 1) / h)
+        return changed / mask.size, tuple(round(float(v), 3) for v in bbox)
+
+
+def analyze_frame(detector, frame, width=MOTION_ANALYSIS_WIDTH):
+    """Полный шаг анализа одного av.VideoFrame; выполняется в потоке пула."""
+    return detector.update(downscale(luma_plane(frame), width))
+
+
+class MotionAnalyzer:
+    """Анализ одного источника, пока у него есть зрители."""
+
+    def __init__(self, monitor, url):
+        self.url = url
+        self._monitor = monitor
+        self._detector = MotionDetector()
+        self._pending = None
+        self.active = False
+        self._last_motion_at = None
+        self.area = 0.0
+        self.frames_seen = 0
+        self.frames_analyzed = 0
+        self.skipped_busy = 0     # Пропущено, потому что предыдущий кадр еще анализируется
+        self.analysis_time = 0.0
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self._monitor.sample_fps
+        try:
+            subscription = await self._monitor.registry.acquire(self.url)
+        except Exception as e:
+            logger.error(f"Детектор движения {mask_credentials(self.url)}: источник не открылся: {e}")
+            return
+        next_sample_at = 0.0
+        try:
+            while True:
+                frame = await subscription.track.recv()
+                self.frames_seen += 1
+                now = time.monotonic()
+                if now < next_sample_at:
+                    continue
+                if self._pending is not None:
+                    self.skipped_busy += 1
+                    continue
+                next_sample_at = now + interval
+                self._pending = loop.run_in_executor(self._monitor.executor, self._analyze, frame)
+                self._pending.add_done_callback(self._on_analyzed)
+        except MediaStreamError:
+            logger.info(f"Детектор движения {mask_credentials(self.url)}: источник закрыт")
+        finally:
+            self._monitor.registry.release(subscription)
+
+    def _analyze(self, frame):
+        started = time.perf_counter()
+        area, bbox = analyze_frame(self._detector, frame)
+        return area, bbox, time.perf_counter() - started
+
+    def _on_analyzed(self, future):
+        self._pending = None
+        if future.cancelled():
+            return
+        try:
+            area, bbox, elapsed = future.result()
+        except Exception as e:
+            logger.error(f"Детектор движения {mask_credentials(self.url)}: ошибка анализа: {e}", exc_info=True)
+            return
+        self.frames_analyzed += 1
+        self.analysis_time += elapsed
+        self.area = area
+        now = time.monotonic()
+        if area >= MOTION_AREA_END:
+            self._last_motion_at = now
+        if not self.active and area >= MOTION_AREA_START:
+            self.active = True
+            self._monitor.publish(self.url, self._event("start", area, bbox))
+        elif self.active and now - self._last_motion_at >= MOTION_END_HOLD:
+            self.active = False
+            self._monitor.publish(self.url, self._event("end", area, bbox))
+
+    def _event(self, state, area, bbox):
+        return {"type": "motion", "state": state, "url": mask_credentials(self.url),
+                "area": round(area, 4), "bbox": bbox, "time": time.time()}
+
+    def stop(self):
+        self._task.cancel()
+        if self._pending is not None:
+            self._pending.cancel()
+
+    def as_dict(self):
+        return {
+            "url": mask_credentials(self.url),
+            "active": self.active,
+            "area": round(self.area, 4),
+            "frames_seen": self.frames_seen,
+            "frames_analyzed": self.frames_analyzed,
+            "skipped_busy": self.skipped_busy,
+            "avg_analysis_ms": round(self.analysis_time / self.frames_analyzed * 1000, 2) if self.frames_analyzed else None,
+        }
+
+
+class MotionMonitor:
+    """
+    Анализаторы по источникам: watch(url) на каждого зрителя, unwatch(url) при его
+    уходе; анализ идет, пока у источника есть зрители. Используется только из background_loop.
+    """
+
+    def __init__(self, registry, sample_fps=MOTION_SAMPLE_FPS, workers=MOTION_WORKERS):
+        self.registry = registry
+        self.sample_fps = sample_fps
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="motion")
+        self._analyzers = {}
+        self._watchers = Counter()
+        self._listeners = {}   # url -> set(async listener(event))
+        self.events = deque(maxlen=MOTION_EVENT_HISTORY)
+
+    def watch(self, url):
+        self._watchers[url] += 1
+        if url not in self._analyzers:
+            self._analyzers[url] = MotionAnalyzer(self, url)
+
+    def unwatch(self, url):
+        self._watchers[url] -= 1
+        if self._watchers[url] > 0:
+            return
+        del self._watchers[url]
+        analyzer = self._analyzers.pop(url, None)
+        if analyzer is not None:
+            analyzer.stop()
+
+    def add_listener(self, url, listener):
+        self._listeners.setdefault(url, set()).add(listener)
+
+    def remove_listener(self, url, listener):
+        listeners = self._listeners.get(url)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self._listeners[url]
+
+    def publish(self, url, event):
+        logger.info(f"Движение {event['state']}: {event['url']}, площадь {event['area']:.1%}")
+        self.events.append(event)
+        for listener in list(self._listeners.get(url, ())):
+            asyncio.ensure_future(self._deliver(listener, event))
+
+    async def _deliver(self, listener, event):
+        try:
+            await listener(event)
+        except Exception as e:
+            logger.debug(f"Событие движения не доставлено: {e}")
+
+    def snapshot(self):
+        return {
+            "sample_fps": self.sample_fps,
+            "analysis_width": MOTION_ANALYSIS_WIDTH,
+            "analyzers": [analyzer.as_dict() for analyzer in list(self._analyzers.values())],
+            "events": list(self.events),
+        }
+
+    def close(self):
+        for analyzer in list(self._analyzers.values()):
+            analyzer.stop()
+        self._analyzers.clear()
+        self._watchers.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,457 @@
+"""
+Параметры ONVIF PTZ камер: discovery, кэш на диске и фоновое обновление.
+
+Для каждой камеры один раз выполняются GetCapabilities (адрес PTZ и Media
+сервисов, режим авторизации), GetProfiles (токен профиля с PTZ) и GetNodes
+(диапазоны скоростей). Результат хранится в ONVIF_CACHE_PATH (без паролей) и
+обновляется в фоне раз в ONVIF_REFRESH_INTERVAL. На пути PTZ команды берется
+готовая запись из памяти: без проб портов и повторов. Пока камеры нет в кэше,
+команды идут по встроенным параметрам CameraType, а discovery выполняется в
+фоне; камера без известного типа (camera_type "AUTO" или новая модель) ждет
+один проход discovery.
+
+Discovery ходит через собственную aiohttp сессию с коротким таймаутом, чтобы
+пробы неверных портов не портили учет здоровья хостов в AsyncPtzTransport.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from enum import Enum
+from urllib.parse import urlsplit, urlunsplit
+
+import aiohttp
+
+from onvif_templates import SoapDialect, build_soap_request
+
+logger = logging.getLogger(__name__)
+
+ONVIF_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onvif_cache.json")
+ONVIF_DISCOVERY_TIMEOUT = 3.0      # Таймаут одного запроса discovery (сек)
+ONVIF_REFRESH_INTERVAL = 6 * 3600  # Как часто перепроверять камеру из кэша (сек)
+ONVIF_RETRY_INTERVAL = 300.0       # Пауза перед повтором после неудачного discovery (сек)
+ONVIF_REFRESH_CHECK = 60.0         # Период проверки устаревших записей фоновой задачей (сек)
+ONVIF_DEVICE_PORTS = (80, 5000, 6688, 8899, 8080)  # Порты device service, если тип камеры неизвестен
+
+CAMERA_TYPE_AUTO = "AUTO"          # camera_type без встроенных параметров: только discovery
+
+
+class CameraType(Enum):
+    YOOSEE = "YOOSEE"
+    YCC365 = "YCC365"
+    Y05 = "Y05"
+
+
+CameraDefaults = namedtuple("CameraDefaults", ("profile_token", "service_path", "dialect"))
+
+# Встроенные параметры моделей: используются до первого discovery и если камера его не поддерживает
+CAMERA_DEFAULTS = {
+    CameraType.Y05: CameraDefaults("PROFILE_000", ":6688/onvif/ptz_service", SoapDialect.WSSE),
+    CameraType.YOOSEE: CameraDefaults("IPCProfilesToken1", ":5000/onvif/ptz_service", SoapDialect.WSSE),
+    CameraType.YCC365: CameraDefaults("Profile_1", "/onvif/PTZ", SoapDialect.TPTZ),
+}
+
+_GENERIC_RANGE = (-1.0, 1.0)
+
+# Порядок проб авторизации: сначала без нее - YCC365 и подобные отклоняют WS-Security заголовок
+_DISCOVERY_DIALECTS = (SoapDialect.TPTZ, SoapDialect.WSSE)
+
+_GET_CAPABILITIES = '<GetCapabilities xmlns="http://www.onvif.org/ver10/device/wsdl"><Category>All</Category></GetCapabilities>'
+_GET_PROFILES = '<GetProfiles xmlns="http://www.onvif.org/ver10/media/wsdl"/>'
+_GET_NODES = '<GetNodes xmlns="http://www.onvif.org/ver20/ptz/wsdl"/>'
+
+
+class DiscoveryFailed(Exception):
+    """Камера не ответила на discovery ни по одному адресу."""
+
+
+def parse_camera_type(camera_type_str):
+    """CameraType по строке из запроса или None (AUTO и неизвестные модели)."""
+    try:
+        return CameraType[str(camera_type_str).upper()]
+    except KeyError:
+        return None
+
+
+class CameraPtzInfo:
+    """Все, что нужно для PTZ команды камере; неизменяемый после создания."""
+    __slots__ = ("host", "ptz_url", "profile_token", "dialect", "pan_range", "tilt_range", "zoom_range",
+                 "source", "updated_at")
+
+    def __init__(self, host, ptz_url, profile_token, dialect, pan_range=_GENERIC_RANGE,
+                 tilt_range=_GENERIC_RANGE, zoom_range=_GENERIC_RANGE, source="defaults", updated_at=None):
+        self.host = host
+        self.ptz_url = ptz_url
+        self.profile_token = profile_token
+        self.dialect = dialect
+        self.pan_range = tuple(pan_range)
+        self.tilt_range = tuple(tilt_range)
+        self.zoom_range = tuple(zoom_range)
+        self.source = source   # "discovery" или "defaults"
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    @property
+    def auth(self):
+        return "wsse" if self.dialect == SoapDialect.WSSE else "none"
+
+    def clamp_velocity(self, x, y, z):
+        """Скорости в пределах, которые камера объявила в GetNodes."""
+        return (min(max(float(x), self.pan_range[0]), self.pan_range[1]),
+                min(max(float(y), self.tilt_range[0]), self.tilt_range[1]),
+                min(max(float(z), self.zoom_range[0]), self.zoom_range[1]))
+
+    def as_dict(self):
+        return {
+            "host": self.host,
+            "ptz_url": self.ptz_url,
+            "profile_token": self.profile_token,
+            "auth": self.auth,
+            "pan_range": list(self.pan_range),
+            "tilt_range": list(self.tilt_range),
+            "zoom_range": list(self.zoom_range),
+            "source": self.source,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        dialect = SoapDialect.WSSE if data["auth"] == "wsse" else SoapDialect.TPTZ
+        return cls(data["host"], data["ptz_url"], data["profile_token"], dialect, data["pan_range"],
+                   data["tilt_range"], data["zoom_range"], data.get("source", "discovery"), data["updated_at"])
+
+
+def default_info(host, camera_type):
+    """Параметры из CAMERA_DEFAULTS; None, если тип неизвестен."""
+    defaults = CAMERA_DEFAULTS.get(camera_type)
+    if defaults is None:
+        return None
+    return CameraPtzInfo(host, f"http://{host}{defaults.service_path}", defaults.profile_token, defaults.dialect)
+
+
+# --- Разбор ответов ---
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _find_all(root, name):
+    return [element for element in root.iter() if _local(element.tag) == name]
+
+
+def _is_fault(root):
+    return bool(_find_all(root, "Fault"))
+
+
+def _service_xaddr(root, service):
+    for element in _find_all(root, service):
+        for xaddr in _children(element, "XAddr"):
+            if xaddr.text and xaddr.text.strip():
+                return xaddr.text.strip()
+    return None
+
+
+def parse_capabilities(text):
+    """(PTZ XAddr, Media XAddr) из GetCapabilitiesResponse."""
+    root = ET.fromstring(text)
+    return _service_xaddr(root, "PTZ"), _service_xaddr(root, "Media")
+
+
+def parse_profile_token(text):
+    """Токен первого профиля с PTZ конфигурацией (или просто первого профиля)."""
+    profiles = _find_all(ET.fromstring(text), "Profiles")
+    for profile in profiles:
+        if profile.get("token") and _children(profile, "PTZConfiguration"):
+            return profile.get("token")
+    for profile in profiles:
+        if profile.get("token"):
+            return profile.get("token")
+    return None
+
+
+def _range(space, axis):
+    """(min, max) оси; None, если диапазона нет или он не число (пустой <Min/> и т.п.)."""
+    for element in _children(space, axis):
+        low, high = _children(element, "Min"), _children(element, "Max")
+        if low and high:
+            try:
+                return float(low[0].text), float(high[0].text)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def _velocity_space(spaces, name):
+    """Предпочтительно generic пространство: шаблоны команд шлют скорости в нем."""
+    candidates = [space for space in spaces if _local(space.tag) == name]
+    for space in candidates:
+        if "Generic" in "".join(uri.text or "" for uri in _children(space, "URI")):
+            return space
+    return candidates[0] if candidates else None
+
+
+def parse_velocity_ranges(text):
+    """(pan, tilt, zoom) диапазоны скоростей из GetNodesResponse; недостающие - (-1, 1)."""
+    pan, tilt, zoom = _GENERIC_RANGE, _GENERIC_RANGE, _GENERIC_RANGE
+    for supported in _find_all(ET.fromstring(text), "SupportedPTZSpaces"):
+        spaces = list(supported)
+        pan_tilt = _velocity_space(spaces, "ContinuousPanTiltVelocitySpace")
+        if pan_tilt is not None:
+            pan = _range(pan_tilt, "XRange") or pan
+            tilt = _range(pan_tilt, "YRange") or tilt
+        zoom_space = _velocity_space(spaces, "ContinuousZoomVelocitySpace")
+        if zoom_space is not None:
+            zoom = _range(zoom_space, "XRange") or zoom
+        break
+    return pan, tilt, zoom
+
+
+def rebase_url(xaddr, host):
+    """
+    XAddr с адресом, по которому камера доступна шлюзу: камеры часто объявляют
+    свой внутренний IP. Порт и путь из XAddr сохраняются.
+    """
+    parts = urlsplit(xaddr)
+    hostname = urlsplit(f"http://{host}").hostname
+    netloc = f"{hostname}:{parts.port}" if parts.port else hostname
+    return urlunsplit((parts.scheme or "http", netloc, parts.path, parts.query, ""))
+
+
+def device_service_urls(host, camera_type=None):
+    """Адреса device service для проб: сначала порт известной модели."""
+    if urlsplit(f"http://{host}").port:
+        return [f"http://{host}/onvif/device_service"]
+    ports = []
+    defaults = CAMERA_DEFAULTS.get(camera_type)
+    if defaults is not None and defaults.service_path.startswith(":"):
+        ports.append(int(defaults.service_path[1:].split("/", 1)[0]))
+    ports += [port for port in ONVIF_DEVICE_PORTS if port not in ports]
+    return [f"http://{host}/onvif/device_service" if port == 80 else f"http://{host}:{port}/onvif/device_service"
+            for port in ports]
+
+
+# --- Кэш на диске ---
+def load_cache(path=ONVIF_CACHE_PATH):
+    """host -> CameraPtzInfo; поврежденный или отсутствующий файл - пустой кэш."""
+    try:
+        with open(path, encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+        return {host: CameraPtzInfo.from_dict(entry) for host, entry in data.items()}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Кэш ONVIF {path} не прочитан: {e}")
+        return {}
+
+
+def save_cache(path, entries):
+    """Атомарная запись: читатель никогда не видит половину файла."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as cache_file:
+        json.dump({host: info.as_dict() for host, info in entries.items()}, cache_file, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class OnvifDiscovery:
+    """
+    Кэш параметров камер по хосту. lookup() - синхронный и без сети, для пути
+    команды; discovery и обновление идут задачами в background_loop.
+    """
+
+    def __init__(self, cache_path=ONVIF_CACHE_PATH, refresh_interval=ONVIF_REFRESH_INTERVAL,
+                 timeout=ONVIF_DISCOVERY_TIMEOUT):
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._entries = load_cache(cache_path) if cache_path else {}
+        self._credentials = {}   # host -> (user, password, CameraType или None); только в памяти
+        self._pending = {}       # host -> задача discovery
+        self._failed_at = {}     # host -> time.monotonic() последней неудачи
+        self._session = None
+        self._refresher = None
+        self._save_lock = asyncio.Lock()
+        self.discoveries = 0
+        self.failures = 0
+
+    def lookup(self, host, camera_type_str, user, password):
+        """
+        Параметры камеры без ожидания сети: запись кэша или встроенные параметры
+        модели. None - камеры нет в кэше и тип неизвестен, нужен resolve().
+        """
+        camera_type = parse_camera_type(camera_type_str)
+        self._credentials[host] = (user, password, camera_type)
+        if self._refresher is None:
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+        info = self._entries.get(host)
+        if info is None or self._is_stale(info):
+            self.schedule(host)
+        if info is not None:
+            return info
+        return default_info(host, camera_type)
+
+    async def resolve(self, host):
+        """
+        Ждет discovery камеры (уже идущий или новый); None, если не удалось. После
+        неудачи новый проход не раньше ONVIF_RETRY_INTERVAL: команды к недоступной
+        камере не должны каждый раз пробовать все порты.
+        """
+        task = self.schedule(host)
+        if task is not None:
+            await asyncio.shield(task)
+        return self._entries.get(host)
+
+    def _is_stale(self, info):
+        return time.time() - info.updated_at > self.refresh_interval
+
+    def schedule(self, host):
+        """Задача discovery для хоста, не больше одной одновременно; после неудачи - пауза."""
+        task = self._pending.get(host)
+        if task is not None:
+            return task
+        failed_at = self._failed_at.get(host)
+        if failed_at is not None and time.monotonic() - failed_at < ONVIF_RETRY_INTERVAL:
+            return None
+        task = self._pending[host] = asyncio.ensure_future(self._discover_and_store(host))
+        task.add_done_callback(lambda _: self._pending.pop(host, None))
+        return task
+
+    async def _discover_and_store(self, host):
+        user, password, camera_type = self._credentials[host]
+        try:
+            info = await self.discover(host, user, password, camera_type)
+        except DiscoveryFailed as e:
+            self.failures += 1
+            self._failed_at[host] = time.monotonic()
+            logger.warning(f"ONVIF discovery {host}: {e}; используются встроенные параметры",
+                           extra={"camera": host})
+            return
+        self.discoveries += 1
+        self._failed_at.pop(host, None)
+        previous = self._entries.get(host)
+        self._entries[host] = info
+        if previous is None or previous.ptz_url != info.ptz_url or previous.profile_token != info.profile_token:
+            logger.info(f"ONVIF discovery {host}: PTZ {info.ptz_url}, профиль {info.profile_token}, "
+                        f"авторизация {info.auth}", extra={"camera": host})
+        if self.cache_path:
+            async with self._save_lock:
+                await asyncio.get_running_loop().run_in_executor(None, save_cache, self.cache_path, dict(self._entries))
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def _call(self, url, body, dialect, user, password):
+        """Тело ответа или None (SOAP Fault, не 200); сетевые ошибки пробрасываются."""
+        payload, headers = build_soap_request(body, dialect, user, password)
+        async with self._get_session().post(url, data=payload, headers=headers) as response:
+            text = await response.text()
+            if response.status != 200:
+                return None
+        try:
+            return None if _is_fault(ET.fromstring(text)) else text
+        except ET.ParseError:
+            return None
+
+    async def discover(self, host, user, password, camera_type=None):
+        """Один проход discovery камеры: CameraPtzInfo или DiscoveryFailed."""
+        errors = []
+        for device_url in device_service_urls(host, camera_type):
+            for index, dialect in enumerate(_DISCOVERY_DIALECTS):
+                try:
+                    text = await self._call(device_url, _GET_CAPABILITIES, dialect, user, password)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    errors.append(f"{device_url}: {type(e).__name__}")
+                    break  # Порт не отвечает - второй вариант авторизации не поможет
+                if text is None:
+                    continue
+                ptz_xaddr, media_xaddr = parse_capabilities(text)
+                if ptz_xaddr is None:
+                    raise DiscoveryFailed(f"{device_url}: камера не объявила PTZ сервис")
+                return await self._describe(host, device_url, _DISCOVERY_DIALECTS[index:], user, password,
+                                            ptz_xaddr, media_xaddr)
+            else:
+                errors.append(f"{device_url}: отказ GetCapabilities")
+        raise DiscoveryFailed("; ".join(errors) or "нет адресов для проб")
+
+    async def _describe(self, host, device_url, dialects, user, password, ptz_xaddr, media_xaddr):
+        """
+        GetProfiles и GetNodes. Камеры обычно отвечают на GetCapabilities без
+        авторизации, поэтому режим авторизации выбирается по GetProfiles: первый
+        из dialects, который камера приняла.
+        """
+        ptz_url = rebase_url(ptz_xaddr, host)
+        media_url = rebase_url(media_xaddr, host) if media_xaddr else device_url
+        try:
+            for dialect in dialects:
+                profiles = await self._call(media_url, _GET_PROFILES, dialect, user, password)
+                if profiles is not None:
+                    break
+            else:
+                raise DiscoveryFailed(f"{media_url}: отказ GetProfiles")
+            nodes = await self._call(ptz_url, _GET_NODES, dialect, user, password)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DiscoveryFailed(f"{device_url}: {type(e).__name__} при GetProfiles/GetNodes")
+        try:
+            profile_token = parse_profile_token(profiles)
+            pan, tilt, zoom = parse_velocity_ranges(nodes) if nodes else (_GENERIC_RANGE,) * 3
+        except (ET.ParseError, TypeError, ValueError) as e:
+            # Исключение мимо DiscoveryFailed не записало бы неудачу, и каждый lookup() начинал бы новый проход
+            raise DiscoveryFailed(f"{device_url}: ответ не разобран: {e}")
+        if profile_token is None:
+            raise DiscoveryFailed(f"{media_url}: нет профилей")
+        return CameraPtzInfo(host, ptz_url, profile_token, dialect, pan, tilt, zoom, source="discovery")
+
+    async def _refresh_loop(self):
+        """Перепроверяет устаревшие записи камер, к которым шли команды."""
+        while True:
+            await asyncio.sleep(ONVIF_REFRESH_CHECK)
+            for host in list(self._credentials):
+                info = self._entries.get(host)
+                if info is None or self._is_stale(info):
+                    self.schedule(host)
+
+    def snapshot(self):
+        return {
+            "cache_path": self.cache_path,
+            "discoveries": self.discoveries,
+            "failures": self.failures,
+            "pending": sorted(self._pending),
+            "cameras": [info.as_dict() for info in self._entries.values()],
+        }
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def resolve_camera_info(host, camera_type_str, user, password, cache_path=ONVIF_CACHE_PATH):
+    """
+    Синхронный вариант для скриптов (camera_simple.py): свежая запись кэша или
+    один проход discovery при запуске; при неудаче - встроенные параметры модели.
+    """
+    camera_type = parse_camera_type(camera_type_str)
+    info = load_cache(cache_path).get(host)
+    if info is not None and time.time() - info.updated_at <= ONVIF_REFRESH_INTERVAL:
+        return info
+
+    async def discover_once():
+        discovery = OnvifDiscovery(cache_path)
+        discovery.lookup(host, camera_type_str, user, password)
+        try:
+            return await discovery.resolve(host)
+        finally:
+            await discovery.close()
+
+    return asyncio.run(discover_once()) or info or default_info(host, camera_type)
@@ -0,0 +1,277 @@
+"""
+Предкомпилированные SOAP шаблоны для ONVIF PTZ команд.
+
+Статические части конверта для каждой пары (диалект камеры, действие) один раз
+рендерятся в bytes. При отправке команды подставляются только вектор x/y/z
+(скорость, смещение или позиция), токены профиля и пресета и поля WS-Security.
+"""
+import base64
+import hashlib
+import re
+import secrets
+import time
+from enum import Enum
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+ONVIF_PTZ_WSDL = "http://www.onvif.org/ver20/ptz/wsdl"
+
+_SLOT_RE = re.compile(r"\{(\w+)\}")
+
+
+class SoapDialect(Enum):
+    # s:Envelope с WS-Security UsernameToken (YOOSEE, Y05)
+    WSSE = "WSSE"
+    # soap:Envelope с префиксами tptz/tt без авторизации (YCC365)
+    TPTZ = "TPTZ"
+
+
+class PtzAction(Enum):
+    CONTINUOUS_MOVE = "ContinuousMove"
+    STOP = "Stop"
+    RELATIVE_MOVE = "RelativeMove"
+    ABSOLUTE_MOVE = "AbsoluteMove"
+    GOTO_PRESET = "GotoPreset"
+    SET_PRESET = "SetPreset"
+    GET_STATUS = "GetStatus"
+
+
+# Действия с вектором x/y/z (скорость, смещение или позиция) и с токеном пресета
+VECTOR_ACTIONS = frozenset({PtzAction.CONTINUOUS_MOVE, PtzAction.RELATIVE_MOVE, PtzAction.ABSOLUTE_MOVE})
+PRESET_ACTIONS = frozenset({PtzAction.GOTO_PRESET, PtzAction.SET_PRESET})
+
+
+class CompiledTemplate:
+    """
+    Шаблон, предкомпилированный в bytes строку формата.
+    Слоты записываются как {name}; других фигурных скобок в XML нет.
+    Числовые слоты форматируются как %a (repr float), остальные - как %s (bytes).
+    """
+
+    def __init__(self, text, numeric_slots=()):
+        # Убираем отступы между тегами: камере они не нужны, а байты на проводе лишние
+        text = re.sub(r">\s+<", "><", text.strip()).replace("%", "%%")
+        self.slots = tuple(_SLOT_RE.findall(text))
+        fmt = _SLOT_RE.sub(lambda m: "%a" if m.group(1) in numeric_slots else "%s", text)
+        self._fmt = fmt.encode("utf-8")
+
+    def render(self, values):
+        """values: кортеж значений в порядке self.slots. Возвращает payload в bytes."""
+        return self._fmt % values
+
+
+# --- Тела команд ---
+_WSSE_BODIES = {
+    PtzAction.CONTINUOUS_MOVE: """
+<ContinuousMove xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <Velocity>
+        <PanTilt x="{x}" y="{y}" space="http://www.onvif.org/ver10/tptz/PanTiltSpaces/VelocityGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+        <Zoom x="{z}" space="http://www.onvif.org/ver10/tptz/ZoomSpaces/VelocityGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+    </Velocity>
+</ContinuousMove>""",
+    PtzAction.STOP: """
+<Stop xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <PanTilt>true</PanTilt>
+    <Zoom>true</Zoom>
+</Stop>""",
+    PtzAction.RELATIVE_MOVE: """
+<RelativeMove xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <Translation>
+        <PanTilt x="{x}" y="{y}" space="http://www.onvif.org/ver10/tptz/PanTiltSpaces/TranslationGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+        <Zoom x="{z}" space="http://www.onvif.org/ver10/tptz/ZoomSpaces/TranslationGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+    </Translation>
+</RelativeMove>""",
+    PtzAction.ABSOLUTE_MOVE: """
+<AbsoluteMove xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <Position>
+        <PanTilt x="{x}" y="{y}" space="http://www.onvif.org/ver10/tptz/PanTiltSpaces/PositionGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+        <Zoom x="{z}" space="http://www.onvif.org/ver10/tptz/ZoomSpaces/PositionGenericSpace" xmlns="http://www.onvif.org/ver10/schema"/>
+    </Position>
+</AbsoluteMove>""",
+    PtzAction.GOTO_PRESET: """
+<GotoPreset xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <PresetToken>{preset}</PresetToken>
+</GotoPreset>""",
+    PtzAction.SET_PRESET: """
+<SetPreset xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+    <PresetToken>{preset}</PresetToken>
+</SetPreset>""",
+    PtzAction.GET_STATUS: """
+<GetStatus xmlns="http://www.onvif.org/ver20/ptz/wsdl">
+    <ProfileToken>{profile}</ProfileToken>
+</GetStatus>""",
+}
+
+_TPTZ_BODIES = {
+    PtzAction.CONTINUOUS_MOVE: """
+<tptz:ContinuousMove>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:Velocity>
+        <tt:PanTilt x="{x}" y="{y}"/>
+        <tt:Zoom x="{z}"/>
+    </tptz:Velocity>
+</tptz:ContinuousMove>""",
+    PtzAction.STOP: """
+<tptz:Stop>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:PanTilt>true</tptz:PanTilt>
+    <tptz:Zoom>true</tptz:Zoom>
+</tptz:Stop>""",
+    PtzAction.RELATIVE_MOVE: """
+<tptz:RelativeMove>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:Translation>
+        <tt:PanTilt x="{x}" y="{y}"/>
+        <tt:Zoom x="{z}"/>
+    </tptz:Translation>
+</tptz:RelativeMove>""",
+    PtzAction.ABSOLUTE_MOVE: """
+<tptz:AbsoluteMove>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:Position>
+        <tt:PanTilt x="{x}" y="{y}"/>
+        <tt:Zoom x="{z}"/>
+    </tptz:Position>
+</tptz:AbsoluteMove>""",
+    PtzAction.GOTO_PRESET: """
+<tptz:GotoPreset>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:PresetToken>{preset}</tptz:PresetToken>
+</tptz:GotoPreset>""",
+    PtzAction.SET_PRESET: """
+<tptz:SetPreset>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+    <tptz:PresetToken>{preset}</tptz:PresetToken>
+</tptz:SetPreset>""",
+    PtzAction.GET_STATUS: """
+<tptz:GetStatus>
+    <tptz:ProfileToken>{profile}</tptz:ProfileToken>
+</tptz:GetStatus>""",
+}
+
+# --- Конверты ---
+_WSSE_ENVELOPE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+    <s:Header>
+        <Security s:mustUnderstand="1" xmlns="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
+            <UsernameToken>
+                <Username>{user}</Username>
+                <Password Type="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-username-token-profile-1.0#PasswordDigest">{digest}</Password>
+                <Nonce EncodingType="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-soap-message-security-1.0#Base64Binary">{nonce}</Nonce>
+                <Created xmlns="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd">{created}</Created>
+            </UsernameToken>
+        </Security>
+    </s:Header>
+    <s:Body>
+    %s
+    </s:Body>
+</s:Envelope>"""
+
+_TPTZ_ENVELOPE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl" xmlns:tt="http://www.onvif.org/ver10/schema">
+    <soap:Body>
+    %s
+    </soap:Body>
+</soap:Envelope>"""
+
+_TPTZ_HEADERS = {'Content-Type': 'application/soap+xml;charset=UTF8'}
+
+
+_WSSE_SLOTS = ("user", "digest", "nonce", "created")
+_VECTOR_SLOTS = ("x", "y", "z")
+
+
+@lru_cache(maxsize=256)
+def _xml_text(value):
+    """Экранированное значение для XML в bytes; токены и логины повторяются, поэтому кэшируем."""
+    return escape(value).encode("utf-8")
+
+
+def wssecurity_fields(user, password):
+    """
+    Поля UsernameToken (в порядке _WSSE_SLOTS) с
+    PasswordDigest = Base64(SHA1(nonce + created + password)).
+    """
+    now = time.time()
+    created = (time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + ".%03dZ" % (int(now * 1000) % 1000)).encode("ascii")
+    nonce = secrets.token_bytes(16)
+    digest = hashlib.sha1(nonce + created + password.encode("utf-8")).digest()
+    return (_xml_text(user), base64.b64encode(digest), base64.b64encode(nonce), created)
+
+
+class PtzTemplateSet:
+    """Все шаблоны PTZ команд одного диалекта, скомпилированные один раз."""
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.uses_wssecurity = dialect == SoapDialect.WSSE
+        if self.uses_wssecurity:
+            envelope, bodies = _WSSE_ENVELOPE, _WSSE_BODIES
+        else:
+            envelope, bodies = _TPTZ_ENVELOPE, _TPTZ_BODIES
+        self._templates = {}
+        for action, body in bodies.items():
+            template = CompiledTemplate(envelope % body, numeric_slots=_VECTOR_SLOTS)
+            expected = self._slot_order(action)
+            if template.slots != expected:
+                raise ValueError(f"Шаблон {dialect.name}/{action.value}: слоты {template.slots}, ожидались {expected}")
+            self._templates[action] = template
+        self._headers = {action: self._build_headers(action) for action in bodies}
+
+    def _slot_order(self, action):
+        slots = _WSSE_SLOTS if self.uses_wssecurity else ()
+        slots += ("profile",)
+        if action in VECTOR_ACTIONS:
+            slots += _VECTOR_SLOTS
+        elif action in PRESET_ACTIONS:
+            slots += ("preset",)
+        return slots
+
+    def _build_headers(self, action):
+        if not self.uses_wssecurity:
+            return _TPTZ_HEADERS
+        action_url = f"{ONVIF_PTZ_WSDL}/{action.value}"
+        return {'Content-Type': f'application/soap+xml;charset=UTF8;action="{action_url}"'}
+
+    def headers(self, action):
+        return self._headers[action]
+
+    def render(self, action, profile_token, user="", password="", x=0.0, y=0.0, z=0.0, preset=None):
+        """Возвращает (payload bytes, headers) для действия."""
+        if action in VECTOR_ACTIONS:
+            values = (_xml_text(profile_token), float(x), float(y), float(z))
+        elif action in PRESET_ACTIONS:
+            if not preset:
+                raise ValueError(f"{action.value}: не указан токен пресета")
+            values = (_xml_text(profile_token), _xml_text(str(preset)))
+        else:
+            values = (_xml_text(profile_token),)
+        if self.uses_wssecurity:
+            values = wssecurity_fields(user, password) + values
+        return self._templates[action].render(values), self._headers[action]
+
+
+def build_soap_request(body, dialect, user="", password=""):
+    """
+    (payload, headers) для произвольного тела (discovery: GetCapabilities, GetProfiles...).
+    Тело - XML со своим xmlns; шаблон собирается при каждом вызове, не для пути PTZ команд.
+    """
+    if dialect == SoapDialect.WSSE:
+        payload = CompiledTemplate(_WSSE_ENVELOPE % body).render(wssecurity_fields(user, password))
+        return payload, {'Content-Type': 'application/soap+xml;charset=UTF8'}
+    return CompiledTemplate(_TPTZ_ENVELOPE % body).render(()), _TPTZ_HEADERS
+
+
+_TEMPLATE_SETS = {dialect: PtzTemplateSet(dialect) for dialect in SoapDialect}
+
+
+def get_template_set(dialect):
+    return _TEMPLATE_SETS[dialect]
@@ -0,0 +1,293 @@
+"""
+Сессии WebRTC зрителей: лимиты, сроки и учет ресурсов.
+
+Каждый RTCPeerConnection живет в PeerSession менеджера. Менеджер:
+  * не пускает новую сессию сверх общего лимита и лимита на клиента (IP);
+  * закрывает сессию, которая не подключилась за срок согласования (вкладка
+    ушла посреди ICE), и подключенную сессию, по которой долго нет ни
+    отправленных байт, ни Receiver Report от браузера;
+  * закрывает сессию одним путем: сначала отпускает медиа (подписки MediaRelay,
+    рендиции, источник), затем pc.close();
+  * считает закрытые по причинам и PeerConnection, которые после закрытия
+    все еще живы в памяти (признак утечки ссылок).
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+import weakref
+from collections import Counter
+
+from media_sources import mask_credentials
+
+logger = logging.getLogger(__name__)
+
+PEER_MAX_SESSIONS = 32                # Всего сессий на шлюз
+PEER_MAX_SESSIONS_PER_CLIENT = 4      # Сессий с одного IP
+PEER_NEGOTIATION_TIMEOUT = 20.0       # От offer до connected (сек)
+PEER_IDLE_TIMEOUT = 120.0             # Подключена, но нет ни RTP, ни RR от клиента (сек); больше паузы переподключения RTSP
+PEER_REAP_INTERVAL = 5.0              # Период проверки сроков и опроса статистики (сек)
+
+
+class SessionLimitExceeded(Exception):
+    """Новая сессия превысила бы общий лимит или лимит клиента."""
+
+
+def _process_rss_bytes():
+    """RSS процесса (Linux /proc), None на других платформах."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _queued_bytes(track):
+    """Байты, ожидающие в буфере прокси MediaRelay (пакеты и кадры)."""
+    queue = getattr(track, "_queue", None)
+    total = 0
+    for item in list(getattr(queue, "_queue", ())):
+        if item is None:
+            continue
+        size = getattr(item, "size", None)  # av.Packet
+        if size is None:
+            size = sum(plane.buffer_size for plane in getattr(item, "planes", ()))
+        total += size
+    return total
+
+
+class PeerSession:
+    """Один зритель: PeerConnection, его sender и функция, отпускающая медиа."""
+
+    def __init__(self, manager, client):
+        self.id = str(uuid.uuid4())
+        self.client = client
+        self.manager = manager
+        self.created_at = time.monotonic()
+        self.started_at = time.time()
+        self.pc = None
+        self.sender = None
+        self.url = None
+        self.mode = None
+        self._release = None
+        self.connected_at = None
+        self.last_activity_at = self.created_at
+        self.bytes_sent = 0
+        self.packets_sent = 0
+        self.packets_lost = 0       # По Receiver Report браузера
+        self.fraction_lost = None
+        self.rtt = None             # Сек, по RR
+        self.bitrate_bps = None     # Между двумя опросами статистики
+        self.fps = None
+        self._last_poll = None      # (время, байт, кадров) прошлого опроса
+        self._last_report_at = None
+        self.close_reason = None
+        self._closed = asyncio.Event()
+
+    @property
+    def label(self):
+        return f"PeerConnection({self.id})"
+
+    def attach(self, pc, url, mode, release):
+        """Передает сессии pc и медиа; release() отпускает подписки на источник. sender задается после addTrack."""
+        self.pc, self.url, self.mode, self._release = pc, url, mode, release
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            if pc.connectionState == "connected" and self.connected_at is None:
+                self.connected_at = self.last_activity_at = time.monotonic()
+                logger.info(f"{self.label}: подключен за {self.connected_at - self.created_at:.2f} с")
+            elif pc.connectionState in ("failed", "closed"):
+                await self.close(f"connection {pc.connectionState}")
+
+    async def close(self, reason):
+        """Единый путь закрытия; повторные вызовы ждут первого."""
+        if self.close_reason is not None:
+            await self._closed.wait()
+            return
+        self.close_reason = reason
+        try:
+            if self._release is not None:
+                # Сначала отцепляем подписчиков MediaRelay, чтобы relay не копил кадры для закрытого пира
+                self._release()
+            if self.pc is not None:
+                await self.pc.close()
+        except Exception as e:
+            logger.error(f"{self.label}: ошибка при закрытии: {e}", exc_info=True)
+        finally:
+            self.manager._forget(self)
+            self._closed.set()
+        logger.info(f"{self.label}: закрыт ({reason}), прожил {time.monotonic() - self.created_at:.1f} с")
+
+    async def poll_stats(self, now):
+        """Обновляет счетчики sender'а; активность - рост байт или новый Receiver Report."""
+        if self.sender is None:
+            return
+        report = await self.sender.getStats()
+        for stats in report.values():
+            if stats.type == "outbound-rtp":
+                if stats.bytesSent > self.bytes_sent:
+                    self.last_activity_at = now
+                self.bytes_sent, self.packets_sent = stats.bytesSent, stats.packetsSent
+            elif stats.type == "remote-inbound-rtp":
+                if stats.timestamp != self._last_report_at:
+                    self._last_report_at = stats.timestamp
+                    self.last_activity_at = now
+                self.packets_lost, self.fraction_lost, self.rtt = \
+                    stats.packetsLost, stats.fractionLost, stats.roundTripTime
+        # Кадры считает только адаптивный трек; у остальных режимов частота - у источника и рендиции
+        frames = getattr(self.sender.track, "frames_sent", None)
+        if self._last_poll is not None and now > self._last_poll[0]:
+            elapsed = now - self._last_poll[0]
+            self.bitrate_bps = round((self.bytes_sent - self._last_poll[1]) * 8 / elapsed)
+            if frames is not None:
+                self.fps = round((frames - self._last_poll[2]) / elapsed, 1)
+        self._last_poll = (now, self.bytes_sent, frames)
+
+    def memory_bytes(self):
+        """
+        Оценка памяти сессии: история RTP для ретрансляций sender'а и то, что
+        ждет в буферах прокси MediaRelay этой сессии.
+        """
+        total = 0
+        if self.sender is not None:
+            # Внутреннее поле aiortc: в другой версии его может не быть или оно устроено иначе
+            history = getattr(self.sender, "_RTCRtpSender__rtp_history", {})
+            try:
+                total += sum(len(packet.payload) + 12 for packet in list(history.values()))
+            except (AttributeError, TypeError) as e:
+                logger.debug(f"{self.label}: история RTP не учтена: {e}")
+            track = self.sender.track
+            relay_tracks = track.relay_tracks() if hasattr(track, "relay_tracks") else [track]
+            for relay_track in relay_tracks:
+                total += _queued_bytes(relay_track)
+        return total
+
+    def as_dict(self, now):
+        pc = self.pc
+        return {
+            "id": self.id,
+            "client": self.client,
+            "url": mask_credentials(self.url) if self.url else None,
+            "mode": self.mode,
+            "age_s": round(now - self.created_at, 1),
+            "state": pc.connectionState if pc is not None else "negotiating",
+            "ice_state": pc.iceConnectionState if pc is not None else None,
+            "connect_time_s": round(self.connected_at - self.created_at, 3) if self.connected_at else None,
+            "idle_s": round(now - self.last_activity_at, 1),
+            "bytes_sent": self.bytes_sent,
+            "packets_sent": self.packets_sent,
+            "packets_lost": self.packets_lost,
+            "fraction_lost": self.fraction_lost,
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "bitrate_bps": self.bitrate_bps,
+            "fps": self.fps,
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+class PeerSessionManager:
+    """
+    Все сессии зрителей шлюза; используется только из background_loop.
+    on_stats(session) вызывается после каждого опроса статистики подключенной сессии.
+    """
+
+    def __init__(self, max_sessions=PEER_MAX_SESSIONS, max_per_client=PEER_MAX_SESSIONS_PER_CLIENT,
+                 negotiation_timeout=PEER_NEGOTIATION_TIMEOUT, idle_timeout=PEER_IDLE_TIMEOUT,
+                 reap_interval=PEER_REAP_INTERVAL, on_stats=None):
+        self.max_sessions = max_sessions
+        self.max_per_client = max_per_client
+        self.negotiation_timeout = negotiation_timeout
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._on_stats = on_stats
+        self.sessions = {}
+        self._closed_pcs = weakref.WeakSet()
+        self._reaper = None
+        self.opened_total = 0
+        self.rejected_total = 0
+        self.close_reasons = Counter()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def open(self, client):
+        """Резервирует место под новую сессию; SessionLimitExceeded, если лимит исчерпан."""
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected_total += 1
+            raise SessionLimitExceeded(f"Достигнут лимит сессий шлюза ({self.max_sessions})")
+        if sum(1 for s in self.sessions.values() if s.client == client) >= self.max_per_client:
+            self.rejected_total += 1
+            raise SessionLimitExceeded(f"Достигнут лимит сессий клиента {client} ({self.max_per_client})")
+        session = PeerSession(self, client)
+        self.sessions[session.id] = session
+        self.opened_total += 1
+        if self._reaper is None:
+            self._reaper = asyncio.ensure_future(self._reap_loop())
+        return session
+
+    def _forget(self, session):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        self.close_reasons[session.close_reason] += 1
+        if session.pc is not None:
+            self._closed_pcs.add(session.pc)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap(time.monotonic())
+            except Exception as e:
+                logger.error(f"Ошибка проверки сессий: {e}", exc_info=True)
+
+    async def reap(self, now):
+        """Опрашивает статистику и закрывает просроченные сессии."""
+        for session in list(self.sessions.values()):
+            if session.close_reason is not None:
+                continue
+            if session.connected_at is None:
+                if now - session.created_at > self.negotiation_timeout:
+                    await session.close("negotiation timeout")
+                continue
+            try:
+                await session.poll_stats(now)
+                if self._on_stats is not None:
+                    self._on_stats(session)
+            except Exception as e:
+                # Ошибка одной сессии не останавливает проход: остальные опрашиваются и закрываются.
+                # Без статистики активность не растет, и зависшая сессия закроется как idle
+                logger.debug(f"{session.label}: статистика не получена: {type(e).__name__}: {e}")
+            if now - session.last_activity_at > self.idle_timeout:
+                await session.close("idle")
+
+    async def close_all(self, reason="shutdown"):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        await asyncio.gather(*(s.close(reason) for s in list(self.sessions.values())), return_exceptions=True)
+
+    def snapshot(self):
+        now = time.monotonic()
+        sessions = [s.as_dict(now) for s in list(self.sessions.values())]
+        return {
+            "limits": {
+                "max_sessions": self.max_sessions,
+                "max_per_client": self.max_per_client,
+                "negotiation_timeout_s": self.negotiation_timeout,
+                "idle_timeout_s": self.idle_timeout,
+            },
+            "totals": {
+                "active": len(sessions),
+                "opened": self.opened_total,
+                "rejected": self.rejected_total,
+                "closed": sum(self.close_reasons.values()),
+                "close_reasons": dict(self.close_reasons),
+                # Закрытые PeerConnection, которые еще не собрал GC: растущее число - утечка ссылок
+                "closed_pcs_alive": len(self._closed_pcs),
+                "memory_bytes": sum(s["memory_bytes"] for s in sessions),
+                "process_rss_bytes": _process_rss_bytes(),
+            },
+            "sessions": sessions,
+        }
@@ -0,0 +1,122 @@
+"""
+Бинарный формат сообщений платформы (ESP32) - замена JSON для drive и статуса.
+
+Сообщение - один бинарный WebSocket кадр фиксированной длины, little-endian:
+
+  смещение  размер  поле
+  0         1       версия формата (WIRE_VERSION)
+  1         1       тип (WireType)
+  DRIVE       (6 байт):  2 int8 left, 3 int8 right, 4 uint16 seq
+  GET_STATUS  (2 байта)
+  STATUS      (8 байт):  2 int8 motorL, 3 int8 motorR, 4 uint16 seq последнего
+                         примененного drive, 6 uint8 флаги (WIRE_FLAG_*), 7 резерв
+  ERROR       (4 байта): 2 uint8 код (WIRE_ERROR_MESSAGES), 3 резерв
+
+Формат выбирается на каждом соединении: клиент начинает с JSON и посылает
+бинарный GET_STATUS; ответ бинарным STATUS значит, что собеседник формат
+понимает, и дальше клиент шлет бинарные кадры. Старая прошивка бинарные кадры
+игнорирует - соединение остается на JSON. Декодер возвращает те же словари,
+что JSON протокол, поэтому обработчики у обоих форматов общие.
+Тот же формат разбирают esp32_platform_code.ino и PlatformController.js.
+"""
+import struct
+from enum import IntEnum
+
+WIRE_VERSION = 1
+
+WIRE_FLAG_FAILSAFE = 0x01    # Моторы остановлены failsafe прошивки
+WIRE_FLAG_LINK_DOWN = 0x02   # Статус от шлюза: соединения с ESP32 нет
+
+WIRE_ERROR_MESSAGES = {
+    0: "Error",
+    1: "Unsupported wire version",
+    2: "Invalid message length",
+    3: "Unknown message type",
+}
+
+
+class WireType(IntEnum):
+    DRIVE = 0x01
+    GET_STATUS = 0x02
+    STATUS = 0x81
+    ERROR = 0x82
+
+
+class WireFormatError(ValueError):
+    """Кадр не разбирается: другая версия, длина или тип. code - для ответа ERROR."""
+
+    def __init__(self, message, code=0):
+        super().__init__(message)
+        self.code = code
+
+
+_HEADER = struct.Struct("<BB")
+_DRIVE = struct.Struct("<BBbbH")
+_STATUS = struct.Struct("<BBbbHBx")
+_ERROR = struct.Struct("<BBBx")
+_GET_STATUS = _HEADER.pack(WIRE_VERSION, WireType.GET_STATUS)
+_SIZES = {WireType.DRIVE: _DRIVE.size, WireType.GET_STATUS: _HEADER.size,
+          WireType.STATUS: _STATUS.size, WireType.ERROR: _ERROR.size}
+
+
+def _int8(value):
+    return min(max(int(value), -127), 127)
+
+
+def encode_drive(left, right, seq=0):
+    return _DRIVE.pack(WIRE_VERSION, WireType.DRIVE, _int8(left), _int8(right), seq & 0xFFFF)
+
+
+def encode_get_status():
+    return _GET_STATUS
+
+
+def encode_status(motor_left, motor_right, seq=0, flags=0):
+    return _STATUS.pack(WIRE_VERSION, WireType.STATUS, _int8(motor_left), _int8(motor_right), seq & 0xFFFF, flags)
+
+
+def encode_error(code=0):
+    return _ERROR.pack(WIRE_VERSION, WireType.ERROR, code)
+
+
+def encode_message(message):
+    """Бинарный кадр из словаря JSON протокола (status_update, error, drive, get_status)."""
+    if message.get("type") == "status_update":
+        data = message.get("data") or {}
+        flags = (WIRE_FLAG_FAILSAFE if data.get("failsafe") else 0) | \
+                (WIRE_FLAG_LINK_DOWN if data.get("esp32Connected") is False else 0)
+        return encode_status(data.get("motorL", 0), data.get("motorR", 0), data.get("seq", 0), flags)
+    if message.get("type") == "error":
+        return encode_error(message.get("code", 0))
+    if message.get("command") == "drive":
+        payload = message.get("payload") or {}
+        return encode_drive(payload.get("left", 0), payload.get("right", 0), message.get("seq", 0))
+    if message.get("command") == "get_status":
+        return encode_get_status()
+    raise ValueError(f"Сообщение не кодируется в бинарный формат: {message}")
+
+
+def decode(frame):
+    """Словарь JSON протокола из бинарного кадра; WireFormatError, если кадр не разбирается."""
+    if len(frame) < _HEADER.size:
+        raise WireFormatError(f"Кадр короче заголовка: {len(frame)} байт", 2)
+    version, message_type = _HEADER.unpack_from(frame)
+    if version != WIRE_VERSION:
+        raise WireFormatError(f"Неподдерживаемая версия формата: {version}", 1)
+    expected = _SIZES.get(message_type)
+    if expected is None:
+        raise WireFormatError(f"Неизвестный тип сообщения: {message_type:#x}", 3)
+    if len(frame) != expected:
+        raise WireFormatError(f"Длина {len(frame)} вместо {expected} для типа {message_type:#x}", 2)
+    if message_type == WireType.DRIVE:
+        _, _, left, right, seq = _DRIVE.unpack(frame)
+        return {"command": "drive", "payload": {"left": left, "right": right}, "seq": seq}
+    if message_type == WireType.GET_STATUS:
+        return {"command": "get_status"}
+    if message_type == WireType.STATUS:
+        _, _, motor_left, motor_right, seq, flags = _STATUS.unpack(frame)
+        return {"type": "status_update", "data": {
+            "motorL": motor_left, "motorR": motor_right, "seq": seq,
+            "failsafe": bool(flags & WIRE_FLAG_FAILSAFE), "esp32Connected": not flags & WIRE_FLAG_LINK_DOWN}}
+    _, _, code = _ERROR.unpack(frame)
+    return {"type": "error", "code": code, "message": WIRE_ERROR_MESSAGES.get(code, WIRE_ERROR_MESSAGES[0])}
@@ -0,0 +1,187 @@
+"""
+Текущая позиция PTZ камер по GetStatus.
+
+После каждой команды камеры ее позиция опрашивается из background_loop:
+часто (PTZ_STATUS_ACTIVE_INTERVAL), пока камера недавно получала команды или
+сообщает, что еще движется, и редко (PTZ_STATUS_IDLE_INTERVAL) после этого.
+Если команд нет PTZ_STATUS_FORGET_AFTER секунд, опрос камеры прекращается до
+следующей команды. GetStatus идет через ту же очередь камеры, что и команды,
+поэтому одновременно к камере по-прежнему не больше одного запроса.
+"""
+import asyncio
+import logging
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+PTZ_STATUS_ACTIVE_INTERVAL = 0.5   # Период опроса во время и сразу после движения (сек)
+PTZ_STATUS_IDLE_INTERVAL = 10.0    # Период опроса неподвижной камеры (сек)
+PTZ_STATUS_ACTIVE_WINDOW = 3.0     # Сколько секунд после команды опрашивать часто
+PTZ_STATUS_FORGET_AFTER = 600.0    # Без команд дольше этого опрос камеры прекращается (сек)
+PTZ_STATUS_MAX_FAILURES = 3        # Подряд SOAP Fault на GetStatus - камера его не поддерживает
+
+PtzPosition = namedtuple("PtzPosition", ("pan", "tilt", "zoom", "moving", "updated_at"))
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_ptz_status(text):
+    """PtzPosition из GetStatusResponse; None, если позиции в ответе нет."""
+    root = ET.fromstring(text)
+    pan = tilt = zoom = None
+    moving = False
+    for element in root.iter():
+        name = _local(element.tag)
+        if name == "Position":
+            for axis in element:
+                if _local(axis.tag) == "PanTilt":
+                    pan, tilt = float(axis.get("x")), float(axis.get("y"))
+                elif _local(axis.tag) == "Zoom":
+                    zoom = float(axis.get("x"))
+        elif name == "MoveStatus":
+            moving = any((axis.text or "").strip().upper() == "MOVING" for axis in element)
+    if pan is None and zoom is None:
+        return None
+    return PtzPosition(pan, tilt, zoom, moving, time.time())
+
+
+def parse_preset_token(text):
+    """Токен из SetPresetResponse (камера может выдать свой вместо запрошенного)."""
+    for element in ET.fromstring(text).iter():
+        if _local(element.tag) == "PresetToken" and element.text:
+            return element.text.strip()
+    return None
+
+
+def is_soap_fault(body):
+    """
+    Ответ API шлюза содержит SOAP Fault камеры (ActionNotSupported и т.п.). Таймауты,
+    сетевые ошибки и пауза хоста тоже дают 500, но камера при этом не отвечала.
+    """
+    details = body.get("details") if isinstance(body, dict) else None
+    return bool(details) and "Fault" in details
+
+
+class _CameraState:
+    __slots__ = ("args", "position", "last_command_at", "failures", "supported", "warned", "polls", "task", "wakeup")
+
+    def __init__(self, args):
+        self.args = args
+        self.position = None
+        self.last_command_at = time.monotonic()
+        self.failures = 0
+        self.supported = True
+        self.warned = False
+        self.polls = 0
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+
+class PtzPositionTracker:
+    """
+    Позиции камер по ключу камеры. request_status(camera_key, args) - корутина,
+    которая ставит GetStatus в очередь камеры и возвращает (тело, HTTP статус);
+    позицию из ответа сообщает update(), а tracker передает ее в on_change(camera_key,
+    позиция) - так позиции попадают в хаб телеметрии. Используется только из background_loop.
+    """
+
+    def __init__(self, request_status, on_change=None):
+        self._request_status = request_status
+        self._on_change = on_change
+        self._cameras = {}
+
+    def touch(self, camera_key, args):
+        """Камера получила команду: запомнить параметры доступа и ускорить опрос."""
+        state = self._cameras.get(camera_key)
+        if state is None:
+            state = self._cameras[camera_key] = _CameraState(args)
+        state.args = args
+        state.last_command_at = time.monotonic()
+        if not state.supported:
+            # Одна проба GetStatus на новую команду: ошибка могла быть временной (прошивка,
+            # перезагрузка камеры), а еще один SOAP Fault снова отключит опрос
+            state.supported = True
+            state.failures = PTZ_STATUS_MAX_FAILURES - 1
+        if state.task is None:
+            state.task = asyncio.ensure_future(self._poll(camera_key, state))
+        state.wakeup.set()
+
+    def update(self, camera_key, position):
+        state = self._cameras.get(camera_key)
+        if state is not None and position is not None:
+            state.position = position
+            if self._on_change is not None:
+                self._on_change(camera_key, position)
+
+    def get(self, camera_key):
+        state = self._cameras.get(camera_key)
+        return None if state is None or state.position is None else state.position._asdict()
+
+    def _interval(self, state, now):
+        moving = state.position is not None and state.position.moving
+        if moving or now - state.last_command_at < PTZ_STATUS_ACTIVE_WINDOW:
+            return PTZ_STATUS_ACTIVE_INTERVAL
+        return PTZ_STATUS_IDLE_INTERVAL
+
+    async def _poll(self, camera_key, state):
+        try:
+            while state.supported:
+                # Первый опрос - через активный интервал после команды: камера уже начала движение
+                try:
+                    await asyncio.wait_for(state.wakeup.wait(), self._interval(state, time.monotonic()))
+                    state.wakeup.clear()
+                    await asyncio.sleep(PTZ_STATUS_ACTIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if time.monotonic() - state.last_command_at > PTZ_STATUS_FORGET_AFTER:
+                    return
+                await self._poll_once(camera_key, state)
+        finally:
+            state.task = None
+
+    async def _poll_once(self, camera_key, state):
+        try:
+            body, status_code = await self._request_status(camera_key, state.args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Stop вытесняет GetStatus из очереди - это не ошибка камеры
+            logger.debug(f"GetStatus {camera_key}: {type(e).__name__}: {e}")
+            return
+        state.polls += 1
+        if 200 <= status_code < 300:
+            state.failures = 0
+            state.warned = False
+            return
+        if not is_soap_fault(body):
+            # Камера недоступна: опрос продолжается и возобновится, когда связь вернется
+            logger.debug(f"GetStatus {camera_key}: {status_code} без ответа камеры")
+            return
+        state.failures += 1
+        if state.failures >= PTZ_STATUS_MAX_FAILURES:
+            state.supported = False
+            if not state.warned:
+                state.warned = True
+                logger.warning(f"Камера {camera_key} отклоняет GetStatus ({status_code}), опрос позиции отключен "
+                               f"до следующей команды", extra={"camera": str(camera_key)})
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [{
+            "camera": str(camera_key),
+            "position": None if state.position is None else state.position._asdict(),
+            "polling": state.task is not None,
+            "poll_interval": self._interval(state, now) if state.supported else None,
+            "polls": state.polls,
+            "supported": state.supported,
+        } for camera_key, state in list(self._cameras.items())]
+
+    def close(self):
+        for state in self._cameras.values():
+            if state.task is not None:
+                state.task.cancel()
+        self._cameras.clear()
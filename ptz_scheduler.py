@@ -0,0 +1,273 @@
+"""
+Планировщик PTZ команд: по одной очереди на камеру, не больше одного запроса
+к камере одновременно.
+
+Правила очереди:
+  * команды из coalesce_actions (ContinuousMove) схлопываются - в очереди остается
+    только самая новая скорость;
+  * команды из preempt_actions (Stop) выбрасывают из очереди все, что там было;
+  * команды из accumulate_actions (RelativeMove) сливаются с такой же командой в
+    конце очереди: смещения x/y/z складываются, и автоповтор клавиши не копит
+    очередь движений, которые камера отрабатывала бы после отпускания;
+  * остальные команды выполняются по порядку.
+
+PtzCommandScheduler отправляет команды через send_fn(command) в рабочем потоке камеры
+и возвращает concurrent.futures.Future. AsyncPtzScheduler делает то же самое
+задачами asyncio: send_fn там - корутина, результат - asyncio.Future.
+"""
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+PTZ_LANE_IDLE_TIMEOUT = 30.0  # Через сколько секунд без команд рабочий поток камеры завершается
+PTZ_VECTOR_ARGS = ("x", "y", "z")  # Аргументы смещения, которые складываются в accumulate_actions
+PTZ_VECTOR_LIMIT = 1.0        # Предел суммы смещения: generic пространство ONVIF [-1, 1]
+
+
+class PtzCommandDropped(Exception):
+    """Команда не была отправлена: ее заменила более новая команда."""
+
+    def __init__(self, command, replaced_by):
+        super().__init__(f"{command.action} заменена на {replaced_by.action}")
+        self.command = command
+        self.replaced_by = replaced_by
+
+
+class PtzCommand:
+    __slots__ = ("camera_key", "action", "args", "future", "created")
+
+    def __init__(self, camera_key, action, args=None, future=None):
+        self.camera_key = camera_key
+        self.action = action
+        self.args = args or {}
+        self.future = Future() if future is None else future
+        self.created = time.monotonic()
+
+
+class _CameraLane:
+    """Очередь одной камеры и ее рабочий поток."""
+
+    def __init__(self, camera_key):
+        self.camera_key = camera_key
+        self.pending = collections.deque()
+        self.in_flight = None
+        self.thread = None  # threading.Thread или asyncio.Task рабочего цикла
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.preempted = 0
+        self.last_latency = None
+
+    def enqueue(self, command, coalesce_actions, preempt_actions, accumulate_actions=frozenset()):
+        """Добавляет команду по правилам очереди. Возвращает список выброшенных команд."""
+        self.submitted += 1
+        if command.action in accumulate_actions and self.pending and self.pending[-1].action == command.action:
+            # Сливается только с последней командой: смещение до и после другой команды - разные движения
+            previous = self.pending.pop()
+            for key in PTZ_VECTOR_ARGS:
+                total = float(previous.args.get(key, 0.0)) + float(command.args.get(key, 0.0))
+                command.args[key] = min(max(total, -PTZ_VECTOR_LIMIT), PTZ_VECTOR_LIMIT)
+            dropped = [previous]
+            self.coalesced += 1
+        elif command.action in preempt_actions:
+            dropped = list(self.pending)
+            self.pending.clear()
+            self.preempted += len(dropped)
+        elif command.action in coalesce_actions:
+            dropped = [c for c in self.pending if c.action in coalesce_actions]
+            if dropped:
+                self.pending = collections.deque(c for c in self.pending if c.action not in coalesce_actions)
+            self.coalesced += len(dropped)
+        else:
+            dropped = []
+        self.pending.append(command)
+        return dropped
+
+    def as_dict(self):
+        return {
+            "camera": str(self.camera_key),
+            "pending": [str(getattr(c.action, "value", c.action)) for c in self.pending],
+            "in_flight": None if self.in_flight is None else str(getattr(self.in_flight.action, "value", self.in_flight.action)),
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "preempted": self.preempted,
+            "last_latency_ms": None if self.last_latency is None else round(self.last_latency * 1000, 1),
+        }
+
+
+class PtzCommandScheduler:
+    """Latest-wins планировщик PTZ команд с отдельным рабочим потоком на камеру."""
+
+    def __init__(self, send_fn, coalesce_actions=(), preempt_actions=(), accumulate_actions=(),
+                 idle_timeout=PTZ_LANE_IDLE_TIMEOUT):
+        self._send_fn = send_fn
+        self._coalesce_actions = frozenset(coalesce_actions)
+        self._preempt_actions = frozenset(preempt_actions)
+        self._accumulate_actions = frozenset(accumulate_actions)
+        self._idle_timeout = idle_timeout
+        self._lanes = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def submit(self, camera_key, action, **args):
+        """Ставит команду в очередь камеры и сразу возвращает ее Future."""
+        command = PtzCommand(camera_key, action, args)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Планировщик PTZ остановлен")
+            lane = self._lanes.get(camera_key)
+            if lane is None:
+                lane = self._lanes[camera_key] = _CameraLane(camera_key)
+            for old in lane.enqueue(command, self._coalesce_actions, self._preempt_actions, self._accumulate_actions):
+                old.future.set_exception(PtzCommandDropped(old, command))
+            if lane.thread is None:
+                lane.thread = threading.Thread(target=self._run_lane, args=(lane,),
+                                               name=f"ptz-lane-{camera_key}", daemon=True)
+                lane.thread.start()
+            self._cond.notify_all()
+        return command.future
+
+    def _run_lane(self, lane):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self._idle_timeout
+                while not lane.pending and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not lane.pending:
+                    # Простой или остановка: поток завершается, следующий submit запустит новый
+                    lane.thread = None
+                    if self._closed:
+                        self._lanes.pop(lane.camera_key, None)
+                    return
+                command = lane.pending.popleft()
+                lane.in_flight = command
+
+            started = time.monotonic()
+            try:
+                result = self._send_fn(command)
+            except Exception as e:
+                command.future.set_exception(e)
+            else:
+                command.future.set_result(result)
+            finally:
+                with self._cond:
+                    lane.in_flight = None
+                    lane.sent += 1
+                    lane.last_latency = time.monotonic() - started
+
+    def snapshot(self):
+        with self._cond:
+            return [lane.as_dict() for lane in self._lanes.values()]
+
+    def close(self):
+        """Отменяет ожидающие команды и будит рабочие потоки, чтобы они завершились."""
+        with self._cond:
+            self._closed = True
+            for lane in self._lanes.values():
+                for command in lane.pending:
+                    command.future.cancel()
+                lane.pending.clear()
+            self._cond.notify_all()
+
+
+def _retrieve_exception(future):
+    """
+    Помечает исключение команды прочитанным. Ответ на команду ждут не всегда (без wait,
+    после таймаута ожидания), и тогда asyncio пишет в лог ERROR "Future exception was
+    never retrieved" на каждую замененную команду - а это обычный latest-wins путь.
+    """
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncPtzScheduler:
+    """
+    Тот же latest-wins планировщик, но на asyncio: по одной задаче на камеру.
+    Все методы вызываются из потока event loop.
+    """
+
+    def __init__(self, send_fn, coalesce_actions=(), preempt_actions=(), accumulate_actions=(),
+                 idle_timeout=PTZ_LANE_IDLE_TIMEOUT):
+        self._send_fn = send_fn  # async def send_fn(command)
+        self._coalesce_actions = frozenset(coalesce_actions)
+        self._preempt_actions = frozenset(preempt_actions)
+        self._accumulate_actions = frozenset(accumulate_actions)
+        self._idle_timeout = idle_timeout
+        self._lanes = {}
+        self._wakeups = {}  # camera_key -> asyncio.Event
+        self._closed = False
+
+    def submit(self, camera_key, action, **args):
+        """Ставит команду в очередь камеры и сразу возвращает ее asyncio.Future."""
+        if self._closed:
+            raise RuntimeError("Планировщик PTZ остановлен")
+        loop = asyncio.get_running_loop()
+        command = PtzCommand(camera_key, action, args, future=loop.create_future())
+        command.future.add_done_callback(_retrieve_exception)
+        lane = self._lanes.get(camera_key)
+        if lane is None:
+            lane = self._lanes[camera_key] = _CameraLane(camera_key)
+            self._wakeups[camera_key] = asyncio.Event()
+        for old in lane.enqueue(command, self._coalesce_actions, self._preempt_actions, self._accumulate_actions):
+            if not old.future.done():
+                old.future.set_exception(PtzCommandDropped(old, command))
+        if lane.thread is None:
+            lane.thread = loop.create_task(self._run_lane(lane))
+        self._wakeups[camera_key].set()
+        return command.future
+
+    async def _run_lane(self, lane):
+        wakeup = self._wakeups[lane.camera_key]
+        try:
+            while True:
+                if not lane.pending:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self._idle_timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    if not lane.pending:
+                        return
+                command = lane.pending.popleft()
+                lane.in_flight = command
+                started = time.monotonic()
+                try:
+                    result = await self._send_fn(command)
+                except asyncio.CancelledError:
+                    if not command.future.done():
+                        command.future.cancel()
+                    raise
+                except Exception as e:
+                    if not command.future.done():
+                        command.future.set_exception(e)
+                else:
+                    if not command.future.done():
+                        command.future.set_result(result)
+                finally:
+                    lane.in_flight = None
+                    lane.sent += 1
+                    lane.last_latency = time.monotonic() - started
+        finally:
+            lane.thread = None
+
+    def snapshot(self):
+        return [lane.as_dict() for lane in self._lanes.values()]
+
+    async def close(self):
+        """Отменяет ожидающие команды и рабочие задачи камер."""
+        self._closed = True
+        tasks = []
+        for lane in self._lanes.values():
+            for command in lane.pending:
+                command.future.cancel()
+            lane.pending.clear()
+            if lane.thread is not None:
+                lane.thread.cancel()
+                tasks.append(lane.thread)
+        await asyncio.gather(*tasks, return_exceptions=True)
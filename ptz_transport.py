@@ -0,0 +1,173 @@
+"""
+Транспорт для ONVIF PTZ запросов: пул keep-alive HTTP сессий по одной на камеру
+и учет "здоровья" каждого хоста.
+
+Вместо голого requests.post (новое TCP соединение на каждую команду) каждая камера
+получает свою requests.Session с ограниченным пулом соединений, поэтому серия
+ContinuousMove/Stop идет по уже открытому соединению.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- Настройки пула по умолчанию ---
+PTZ_POOL_MAXSIZE = 4          # Максимум одновременных соединений к одной камере
+PTZ_CONNECT_TIMEOUT = 1.5     # Таймаут установки TCP соединения (сек)
+PTZ_READ_TIMEOUT = 3.0        # Таймаут ожидания ответа камеры (сек)
+PTZ_CONNECT_RETRIES = 1       # Повторы только при ошибке соединения (запрос еще не ушел)
+PTZ_UNHEALTHY_AFTER = 3       # Сколько неудач подряд делают хост "нездоровым"
+PTZ_UNHEALTHY_COOLDOWN = 5.0  # Сколько секунд не трогать нездоровый хост (fail fast)
+PTZ_RTT_EWMA_ALPHA = 0.2      # Коэффициент сглаживания RTT
+
+
+class PtzHostUnavailable(requests.exceptions.ConnectionError):
+    """Хост помечен как нездоровый, запрос не отправлялся."""
+
+
+class HostHealth:
+    """Статистика успешных и неудачных запросов к одному хосту."""
+
+    def __init__(self, host):
+        self.host = host
+        self.ok_count = 0
+        self.fail_count = 0
+        self.consecutive_failures = 0
+        self.last_rtt = None
+        self.ewma_rtt = None
+        self.last_error = None
+        self.last_success_ts = None
+        self.last_failure_ts = None
+
+    def record_success(self, rtt):
+        self.ok_count += 1
+        self.consecutive_failures = 0
+        self.last_rtt = rtt
+        if self.ewma_rtt is None:
+            self.ewma_rtt = rtt
+        else:
+            self.ewma_rtt += PTZ_RTT_EWMA_ALPHA * (rtt - self.ewma_rtt)
+        self.last_success_ts = time.time()
+
+    def record_failure(self, error):
+        self.fail_count += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        self.last_failure_ts = time.time()
+
+    @property
+    def healthy(self):
+        return self.consecutive_failures < PTZ_UNHEALTHY_AFTER
+
+    def in_cooldown(self, now=None):
+        """True, если хост нездоров и с последней неудачи прошло меньше cooldown."""
+        if self.healthy or self.last_failure_ts is None:
+            return False
+        now = time.time() if now is None else now
+        return now - self.last_failure_ts < PTZ_UNHEALTHY_COOLDOWN
+
+    def as_dict(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "ok_count": self.ok_count,
+            "fail_count": self.fail_count,
+            "consecutive_failures": self.consecutive_failures,
+            "last_rtt_ms": None if self.last_rtt is None else round(self.last_rtt * 1000, 1),
+            "ewma_rtt_ms": None if self.ewma_rtt is None else round(self.ewma_rtt * 1000, 1),
+            "last_error": self.last_error,
+            "last_success_ts": self.last_success_ts,
+            "last_failure_ts": self.last_failure_ts,
+        }
+
+
+class PtzTransport:
+    """
+    Пул persistent HTTP сессий, по одной на хост камеры.
+    Потокобезопасен: используется из потоков Flask.
+    """
+
+    def __init__(self, pool_maxsize=PTZ_POOL_MAXSIZE, connect_timeout=PTZ_CONNECT_TIMEOUT,
+                 read_timeout=PTZ_READ_TIMEOUT, connect_retries=PTZ_CONNECT_RETRIES):
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connect_retries = connect_retries
+        self._sessions = {}  # host -> requests.Session
+        self._health = {}    # host -> HostHealth
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        session = requests.Session()
+        # Повторяем только ошибки соединения: тело запроса камере еще не отправлено,
+        # поэтому повтор безопасен и для POST. Это же лечит keep-alive соединения,
+        # которые камера закрыла молча.
+        retries = Retry(total=self.connect_retries, connect=self.connect_retries,
+                        read=0, status=0, redirect=0, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize,
+                              max_retries=retries, pool_block=False)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._create_session()
+                self._sessions[host] = session
+            health = self._health.get(host)
+            if health is None:
+                health = self._health[host] = HostHealth(host)
+            return session, health
+
+    def _drop_session(self, host):
+        with self._lock:
+            session = self._sessions.pop(host, None)
+        if session is not None:
+            session.close()
+
+    def post(self, host, url, data, headers, timeout=None):
+        """
+        Отправляет POST на камеру через ее сессию. Исключения requests пробрасываются
+        как есть, чтобы вызывающий код обрабатывал их так же, как раньше.
+        """
+        session, health = self._get(host)
+        if health.in_cooldown():
+            raise PtzHostUnavailable(
+                f"Хост {host} помечен нездоровым ({health.consecutive_failures} ошибок подряд): {health.last_error}")
+
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        started = time.perf_counter()
+        try:
+            response = session.post(url, data=data, headers=headers, timeout=timeout)
+            # Дочитываем тело, чтобы соединение вернулось в пул
+            _ = response.content
+        except requests.exceptions.RequestException as e:
+            health.record_failure(e)
+            if isinstance(e, requests.exceptions.ConnectionError):
+                # Пул мог держать мертвые соединения - пересоздадим сессию при следующем запросе
+                self._drop_session(host)
+            raise
+        health.record_success(time.perf_counter() - started)
+        return response
+
+    def health(self, host):
+        with self._lock:
+            health = self._health.get(host)
+        return health.as_dict() if health else None
+
+    def health_snapshot(self):
+        with self._lock:
+            items = list(self._health.values())
+        return {h.host: h.as_dict() for h in items}
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,82 @@
+"""
+Асинхронный транспорт для ONVIF PTZ запросов на aiohttp.
+
+Работает в фоновом asyncio loop приложения (тот же, где живет aiortc): одна
+ClientSession с общим пулом keep-alive соединений, ограничение соединений на
+хост и тот же учет здоровья хостов, что и в синхронном PtzTransport.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from ptz_transport import (PTZ_CONNECT_TIMEOUT, PTZ_POOL_MAXSIZE, PTZ_READ_TIMEOUT, HostHealth,
+                           PtzHostUnavailable)
+
+PTZ_ASYNC_MAX_CONNECTIONS = 256   # Общий лимит соединений на все камеры
+PTZ_KEEPALIVE_TIMEOUT = 30.0      # Сколько держать простаивающее соединение открытым (сек)
+
+
+class AsyncPtzResponse:
+    """Минимальный ответ камеры: тело уже прочитано, соединение вернулось в пул."""
+    __slots__ = ("status_code", "text")
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class AsyncPtzTransport:
+    """Пул keep-alive соединений к камерам поверх одной aiohttp.ClientSession."""
+
+    def __init__(self, pool_maxsize=PTZ_POOL_MAXSIZE, connect_timeout=PTZ_CONNECT_TIMEOUT,
+                 read_timeout=PTZ_READ_TIMEOUT, max_connections=PTZ_ASYNC_MAX_CONNECTIONS):
+        self.pool_maxsize = pool_maxsize
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self._session = None
+        self._health = {}  # host -> HostHealth
+
+    def _get_session(self):
+        # Сессия создается лениво внутри работающего loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.pool_maxsize,
+                                             keepalive_timeout=PTZ_KEEPALIVE_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _get_health(self, host):
+        health = self._health.get(host)
+        if health is None:
+            health = self._health[host] = HostHealth(host)
+        return health
+
+    async def post(self, host, url, data, headers):
+        """
+        Отправляет POST на камеру. Исключения aiohttp и asyncio.TimeoutError
+        пробрасываются вызывающему коду, неудача учитывается в здоровье хоста.
+        """
+        health = self._get_health(host)
+        if health.in_cooldown():
+            raise PtzHostUnavailable(
+                f"Хост {host} помечен нездоровым ({health.consecutive_failures} ошибок подряд): {health.last_error}")
+
+        session = self._get_session()
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=data, headers=headers) as response:
+                text = await response.text(errors="replace")
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            health.record_failure(e if str(e) else type(e).__name__)
+            raise
+        health.record_success(time.perf_counter() - started)
+        return AsyncPtzResponse(status, text)
+
+    def health_snapshot(self):
+        return {h.host: h.as_dict() for h in list(self._health.values())}
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,413 @@
+"""
+Supervised RTSP ingest: следит за приходом кадров, при зависании или обрыве
+переподключается к камере с экспоненциальной задержкой и подменяет upstream
+незаметно для зрителей.
+
+Камера читается без декодирования (MediaPlayer(decode=False)): ingest.packets
+отдает закодированные H.264 пакеты, которые в режиме passthrough уходят зрителям
+как есть. Для зрителей, которым нужен перекод, пакеты декодирует один общий
+DecodingVideoTrack (ingest.video) - одно подключение к камере на оба режима.
+
+MediaRelay подписан не на трек MediaPlayer, а на треки ingest, поэтому при
+переподключении меняется только источник пакетов внутри - WebRTC сессии зрителей
+продолжают работать, а метки времени продолжаются без скачка назад.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import random
+import time
+from collections import deque
+from fractions import Fraction
+
+import av # type: ignore
+from aiortc import MediaStreamTrack # type: ignore
+from aiortc.contrib.media import MediaPlayer # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+from media_sources import mask_credentials
+
+logger = logging.getLogger(__name__)
+
+RTSP_STALL_TIMEOUT = 3.0             # Нет кадров столько секунд - считаем поток зависшим
+RTSP_RECONNECT_BACKOFF_INITIAL = 0.5 # Первая пауза перед переподключением (сек)
+RTSP_RECONNECT_BACKOFF_MAX = 10.0    # Потолок паузы между попытками (сек)
+RTSP_RECONNECT_JITTER = 0.2          # +-20% к паузе, чтобы камеры не переподключались синхронно
+RTSP_RECOVERY_HISTORY = 50           # Сколько последних времен восстановления хранить
+
+
+async def open_rtsp_player(url, options=None):
+    """
+    Открывает RTSP без декодирования. Конструктор MediaPlayer блокирует до таймаута
+    подключения, поэтому выполняется в пуле потоков, а не в самом loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: MediaPlayer(url, format='rtsp', options=options, decode=False))
+
+
+def close_rtsp_player(player):
+    """Останавливает треки MediaPlayer; вместе с последним треком закрывается и RTSP."""
+    for track in (player.audio, player.video):
+        if track is not None:
+            track.stop()
+
+
+def _annexb_nal_types(data):
+    """Типы NAL юнитов H.264 в Annex B буфере."""
+    types = set()
+    i = data.find(b"\x00\x00\x01")
+    while i != -1 and i + 3 < len(data):
+        types.add(data[i + 3] & 0x1F)
+        i = data.find(b"\x00\x00\x01", i + 3)
+    return types
+
+
+class SupervisedPacketTrack(MediaStreamTrack):
+    """Трек закодированных пакетов для MediaRelay: берутся из текущего upstream RtspIngest."""
+    kind = "video"
+
+    def __init__(self, ingest):
+        super().__init__()
+        self._ingest = ingest
+
+    async def recv(self):
+        return await self._ingest.next_packet()
+
+
+class DecodingVideoTrack(MediaStreamTrack):
+    """
+    Декодирует пакеты ingest в кадры для зрителей, которым нужен перекод. Один
+    декодер на источник; декодирование идет в отдельном потоке, чтобы не занимать loop.
+
+    MediaRelay продолжает читать трек и без подписчиков, поэтому после detach()
+    recv() просто ждет следующего attach() и не тратит CPU на декодирование.
+    """
+    kind = "video"
+
+    def __init__(self, ingest, relay):
+        super().__init__()
+        self._ingest = ingest
+        self._relay = relay
+        self._packets = None   # Подписка на ingest.packets через relay, создается при первом recv
+        self._codec = None
+        self._generation = None
+        self._frames = deque()
+        self._attached = asyncio.Event()
+        self._pending_recv = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rtsp-decode")
+
+    async def recv(self):
+        loop = asyncio.get_running_loop()
+        while not self._frames:
+            await self._attached.wait()
+            if self.readyState != "live":
+                raise MediaStreamError
+            if self._packets is None:
+                self._packets = self._relay.subscribe(self._ingest.packets)
+            packets = self._packets
+            self._pending_recv = asyncio.ensure_future(packets.recv())
+            try:
+                packet = await self._pending_recv
+            except asyncio.CancelledError:
+                if packets is not self._packets:
+                    continue  # Ожидание прервал detach()
+                raise
+            finally:
+                self._pending_recv = None
+            if self._generation != self._ingest.generation:
+                # Новое подключение к камере - новый декодер, начинаем с ключевого кадра
+                self._codec = None
+                self._generation = self._ingest.generation
+            if self._codec is None:
+                if not packet.is_keyframe:
+                    continue
+                self._codec = av.CodecContext.create(self._ingest.codec_name, "r")
+                if self._ingest.extradata:
+                    self._codec.extradata = self._ingest.extradata
+            try:
+                frames = await loop.run_in_executor(self._executor, self._codec.decode, packet)
+            except av.FFmpegError as e:
+                logger.warning(f"RTSP {mask_credentials(self._ingest.url)}: ошибка декодирования: {e}")
+                self._codec = None
+                continue
+            self._frames.extend(frames)
+        return self._frames.popleft()
+
+    def attach(self):
+        self._attached.set()
+
+    def detach(self):
+        """Отписывается от пакетов, когда не осталось зрителей с перекодом."""
+        self._attached.clear()
+        if self._packets is not None:
+            # Прокси relay после stop() больше не получает пакеты - прерываем ожидание
+            self._packets.stop()
+            self._packets = None
+        if self._pending_recv is not None:
+            self._pending_recv.cancel()
+        self._codec = None
+        self._frames.clear()
+
+    def stop(self):
+        super().stop()
+        self.detach()
+        self._attached.set()  # Разбудить recv, чтобы relay получил MediaStreamError
+        self._executor.shutdown(wait=False)
+
+
+class RtspIngest:
+    """
+    Одно RTSP подключение под надзором. open_player(url) - корутина, возвращающая
+    MediaPlayer(decode=False); close_player(player) - блокирующая остановка плеера
+    (вызывается в пуле потоков, т.к. ждет завершения потока чтения FFmpeg).
+    """
+
+    def __init__(self, url, open_player=open_rtsp_player, close_player=close_rtsp_player, stall_timeout=RTSP_STALL_TIMEOUT,
+                 backoff_initial=RTSP_RECONNECT_BACKOFF_INITIAL, backoff_max=RTSP_RECONNECT_BACKOFF_MAX):
+        self.url = url
+        self._open_player = open_player
+        self._close_player = close_player
+        self.stall_timeout = stall_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+        self.packets = SupervisedPacketTrack(self)
+        self._decoded = None            # DecodingVideoTrack, создается при первом зрителе с перекодом
+        self._player = None
+        self._upstream = None           # player.video текущего подключения
+        self._connected = asyncio.Event()
+        self._reconnect_task = None
+        self._stopped = False
+
+        # Параметры потока текущего подключения
+        self.generation = 0
+        self.codec_name = None
+        self.extradata = None
+        self.width = None
+        self.height = None
+        self.stream = None              # av.VideoStream камеры (шаблон для записи MP4)
+        self._first_packet = None
+
+        # Непрерывность pts между подключениями
+        self._time_base = None
+        self._pts_offset = 0
+        self._last_pts = None
+        self._rebase_pending = False
+
+        # Метрики
+        self.state = "connecting"
+        self.frames = 0
+        self.last_frame_at = None
+        self.outages = 0
+        self.reconnects = 0
+        self.reconnect_attempts = 0
+        self.last_outage_reason = None
+        self.down_since = None
+        self.total_downtime = 0.0
+        self.recovery_times = deque(maxlen=RTSP_RECOVERY_HISTORY)
+
+    async def start(self):
+        """Первое подключение. Ошибка пробрасывается, чтобы /offer сразу получил отказ."""
+        player = await self._open_player(self.url)
+        try:
+            first_packet = await self._probe(player)
+        except Exception:
+            await self._dispose(player)
+            raise
+        self._install(player, first_packet)
+
+    async def _probe(self, player):
+        """Ждет первый пакет, чтобы узнать кодек потока (нужен для выбора passthrough)."""
+        if not player.video:
+            raise RuntimeError(f"Не удалось получить видео трек из RTSP: {mask_credentials(self.url)}")
+        try:
+            return await asyncio.wait_for(player.video.recv(), self.stall_timeout)
+        except (asyncio.TimeoutError, MediaStreamError):
+            raise RuntimeError(f"Нет видео пакетов из RTSP: {mask_credentials(self.url)}")
+
+    def _install(self, player, first_packet):
+        codec_context = first_packet.stream.codec_context
+        self.codec_name = codec_context.name
+        self.extradata = codec_context.extradata
+        self.width = codec_context.width
+        self.height = codec_context.height
+        self.stream = first_packet.stream
+        self._first_packet = first_packet
+        self._player = player
+        self._upstream = player.video
+        self.generation += 1
+        self._rebase_pending = self._last_pts is not None
+        self.state = "running"
+        self._connected.set()
+
+    @property
+    def video(self):
+        """Декодированный трек для зрителей с перекодом (один на источник)."""
+        if self._decoded is None:
+            raise RuntimeError("Декодер не подключен, используйте attach_video(relay)")
+        return self._decoded
+
+    def attach_video(self, relay):
+        if self._decoded is None:
+            self._decoded = DecodingVideoTrack(self, relay)
+        self._decoded.attach()
+        return self._decoded
+
+    def detach_video(self):
+        if self._decoded is not None:
+            self._decoded.detach()
+
+    async def next_packet(self):
+        while True:
+            if self._stopped:
+                raise MediaStreamError
+            upstream = self._upstream
+            if upstream is None:
+                await self._connected.wait()
+                continue
+            if self._first_packet is not None:
+                packet, self._first_packet = self._first_packet, None
+            else:
+                try:
+                    packet = await asyncio.wait_for(upstream.recv(), self.stall_timeout)
+                except asyncio.TimeoutError:
+                    self._upstream_lost(upstream, f"нет кадров {self.stall_timeout} с")
+                    continue
+                except MediaStreamError:
+                    self._upstream_lost(upstream, "поток завершился")
+                    continue
+            packet = self._rebase(self._with_parameter_sets(packet))
+            self.frames += 1
+            self.last_frame_at = time.monotonic()
+            return packet
+
+    def _with_parameter_sets(self, packet):
+        """
+        Камеры часто передают SPS/PPS только в SDP (extradata), а браузеру они нужны
+        в потоке: добавляем их перед ключевым кадром, если их там нет.
+        """
+        extradata = self.extradata
+        if not packet.is_keyframe or self.codec_name != "h264" or not extradata \
+                or not extradata.startswith((b"\x00\x00\x01", b"\x00\x00\x00\x01")):
+            return packet
+        data = bytes(packet)
+        if 7 in _annexb_nal_types(data):
+            return packet
+        patched = av.Packet(extradata + data)
+        patched.pts = packet.pts
+        patched.dts = packet.dts
+        patched.time_base = packet.time_base
+        patched.is_keyframe = True
+        return patched
+
+    def _rebase(self, packet):
+        if packet.pts is None or packet.time_base is None:
+            return packet
+        if self._time_base is None:
+            self._time_base = packet.time_base
+        pts, dts = packet.pts, packet.dts
+        if packet.time_base != self._time_base:
+            pts = int(Fraction(pts) * packet.time_base / self._time_base)
+            if dts is not None:
+                dts = int(Fraction(dts) * packet.time_base / self._time_base)
+        if self._rebase_pending:
+            # Новое подключение начинает pts заново: продолжаем шкалу с учетом простоя
+            gap = int(Fraction(time.monotonic() - self.last_frame_at) / self._time_base)
+            self._pts_offset = self._last_pts + max(gap, 1) - pts
+            self._rebase_pending = False
+        shift = self._pts_offset
+        if self._last_pts is not None and pts + shift <= self._last_pts:
+            shift = self._last_pts + 1 - pts
+        self._last_pts = pts + shift
+        packet.time_base = self._time_base
+        packet.pts = pts + shift
+        if dts is not None:
+            packet.dts = dts + shift  # dts сдвигаем так же, чтобы декодер видел согласованную шкалу
+        return packet
+
+    def _upstream_lost(self, upstream, reason):
+        if upstream is not self._upstream or self._stopped:
+            return  # Уже переподключаемся
+        logger.warning(f"RTSP {mask_credentials(self.url)}: {reason}, переподключение")
+        self.state = "reconnecting"
+        self.outages += 1
+        self.last_outage_reason = reason
+        self.down_since = time.monotonic()
+        self._connected.clear()
+        player, self._player, self._upstream = self._player, None, None
+        asyncio.ensure_future(self._dispose(player))
+        self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        delay = self.backoff_initial
+        while not self._stopped:
+            await asyncio.sleep(delay * random.uniform(1 - RTSP_RECONNECT_JITTER, 1 + RTSP_RECONNECT_JITTER))
+            self.reconnect_attempts += 1
+            try:
+                player = await self._open_player(self.url)
+            except Exception as e:
+                logger.warning(f"RTSP {mask_credentials(self.url)}: попытка переподключения не удалась: {e}")
+                delay = min(delay * 2, self.backoff_max)
+                continue
+            try:
+                first_packet = await self._probe(player)
+            except Exception as e:
+                logger.warning(f"RTSP {mask_credentials(self.url)}: {e}")
+                await self._dispose(player)
+                delay = min(delay * 2, self.backoff_max)
+                continue
+            if self._stopped:
+                await self._dispose(player)
+                return
+            recovery = time.monotonic() - self.down_since
+            self.recovery_times.append(recovery)
+            self.total_downtime += recovery
+            self.reconnects += 1
+            self.down_since = None
+            self._install(player, first_packet)
+            logger.info(f"RTSP {mask_credentials(self.url)}: восстановлен за {recovery:.2f} с")
+            return
+
+    async def _dispose(self, player):
+        if player is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._close_player, player)
+        except Exception as e:
+            logger.error(f"RTSP {mask_credentials(self.url)}: ошибка при закрытии плеера: {e}")
+
+    def stop(self):
+        """Останавливает надзор и плеер; ожидающие зрители получают MediaStreamError."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self.state = "stopped"
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        player, self._player, self._upstream = self._player, None, None
+        self._connected.set()
+        self.packets.stop()
+        if self._decoded is not None:
+            self._decoded.stop()
+        asyncio.ensure_future(self._dispose(player))
+
+    def metrics(self):
+        now = time.monotonic()
+        downtime = self.total_downtime + (now - self.down_since if self.down_since else 0.0)
+        return {
+            "state": self.state,
+            "codec": self.codec_name,
+            "resolution": f"{self.width}x{self.height}" if self.width else None,
+            "decoder_attached": self._decoded is not None and self._decoded._packets is not None,
+            "frames": self.frames,
+            "last_frame_age_s": round(now - self.last_frame_at, 3) if self.last_frame_at else None,
+            "outages": self.outages,
+            "reconnects": self.reconnects,
+            "reconnect_attempts": self.reconnect_attempts,
+            "last_outage_reason": self.last_outage_reason,
+            "last_recovery_s": round(self.recovery_times[-1], 3) if self.recovery_times else None,
+            "max_recovery_s": round(max(self.recovery_times), 3) if self.recovery_times else None,
+            "total_downtime_s": round(downtime, 3),
+        }
@@ -0,0 +1,180 @@
+"""
+Общий энкодер для зрителей одной камеры: кадры кодируются один раз на
+рендицию (кодек, разрешение, битрейт), а готовые пакеты раздаются всем пирам
+через MediaRelay. RTCRtpSender aiortc только упаковывает такие пакеты в RTP
+(Encoder.pack), поэтому CPU не растет с числом зрителей.
+
+Запросы ключевого кадра (новый зритель, PLI от любого пира) схлопываются:
+пока запрос не выполнен, повторные не порождают новых ключевых кадров, и
+ключевые кадры не чаще SHARED_KEYFRAME_MIN_INTERVAL.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import time
+from collections import deque, namedtuple
+from fractions import Fraction
+
+import av # type: ignore
+from aiortc import MediaStreamTrack # type: ignore
+from aiortc.mediastreams import MediaStreamError # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SHARED_ENCODE_BITRATE = 1_500_000     # Битрейт рендиции по умолчанию (бит/с)
+SHARED_ENCODE_FPS = 30                # Ожидаемая частота кадров (для настройки энкодера)
+SHARED_KEYFRAME_INTERVAL = 5.0        # Периодический ключевой кадр, даже без запросов (сек)
+SHARED_KEYFRAME_MIN_INTERVAL = 0.3    # Не чаще одного ключевого кадра за это время (сек)
+SHARED_ENCODE_EWMA_ALPHA = 0.1
+
+# Ключ рендиции: height None - разрешение источника, width None - по пропорциям источника
+EncodingParams = namedtuple("EncodingParams", ("codec", "width", "height", "bitrate"))
+
+SUPPORTED_CODECS = ("h264", "vp8")
+
+
+def create_codec_context(codec, width, height, bitrate, time_base):
+    """Энкодер PyAV с настройками для живого видео без задержки."""
+    if codec == "h264":
+        context = av.CodecContext.create("libx264", "w")
+        # Те же профиль/уровень, что у H264Encoder aiortc: их принимает любой браузер
+        context.options = {"profile": "baseline", "level": "31", "tune": "zerolatency", "preset": "veryfast"}
+    elif codec == "vp8":
+        context = av.CodecContext.create("libvpx", "w")
+        context.options = {"deadline": "realtime", "cpu-used": "8", "lag-in-frames": "0"}
+    else:
+        raise ValueError(f"Кодек не поддерживается общим энкодером: {codec}")
+    context.width = width
+    context.height = height
+    context.bit_rate = bitrate
+    context.pix_fmt = "yuv420p"
+    context.time_base = time_base
+    # Без framerate libx264 берет частоту из time_base: у RTSP это 1/90000, и бюджет кадра
+    # на 90000 кадр/с - P-кадры по десятку байт, зритель видит серое до ключевого кадра
+    context.framerate = Fraction(SHARED_ENCODE_FPS, 1)
+    context.gop_size = int(SHARED_KEYFRAME_INTERVAL * SHARED_ENCODE_FPS)
+    context.open()
+    return context
+
+
+class SharedEncodedTrack(MediaStreamTrack):
+    """
+    Рендиция: читает кадры из frames (подписка на декодер источника), кодирует
+    их в отдельном потоке и отдает av.Packet. Подписчики получают ее через MediaRelay.
+    """
+    kind = "video"
+
+    def __init__(self, frames, params):
+        super().__init__()
+        self._frames = frames
+        self.params = params
+        self._context = None
+        self._pending = deque()
+        self._pending_recv = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-encode")
+
+        self._keyframe_requested = True  # Первый кадр всегда ключевой
+        self._last_keyframe_at = 0.0
+
+        # Метрики
+        self.viewers = 0
+        self.frames_encoded = 0
+        self.bytes_encoded = 0
+        self.keyframes = 0
+        self.keyframe_requests = 0
+        self.keyframe_requests_coalesced = 0
+        self.encode_ms = None
+
+    def request_keyframe(self):
+        """Запрос ключевого кадра; повторные запросы до его выполнения схлопываются."""
+        self.keyframe_requests += 1
+        if self._keyframe_requested:
+            self.keyframe_requests_coalesced += 1
+            return
+        self._keyframe_requested = True
+
+    def _take_keyframe_request(self):
+        if not self._keyframe_requested:
+            return False
+        if time.monotonic() - self._last_keyframe_at < SHARED_KEYFRAME_MIN_INTERVAL:
+            return False  # Запрос остается в силе до конца окна
+        self._keyframe_requested = False
+        return True
+
+    def _target_size(self, frame):
+        """Размер рендиции: точный, по высоте с сохранением пропорций, без апскейла."""
+        width, height = self.params.width, self.params.height
+        if height is None or height >= frame.height:
+            return frame.width, frame.height
+        if width is None:
+            width = round(frame.width * height / frame.height / 2) * 2
+        return width, height
+
+    def _encode(self, frame, force_keyframe):
+        width, height = self._target_size(frame)
+        context = self._context
+        if context is None or context.width != width or context.height != height:
+            context = self._context = create_codec_context(
+                self.params.codec, width, height, self.params.bitrate, frame.time_base)
+            force_keyframe = True
+        if frame.width != width or frame.height != height or frame.format.name != "yuv420p":
+            source_frame = frame
+            frame = frame.reformat(width=width, height=height, format="yuv420p")
+            frame.pts, frame.time_base = source_frame.pts, source_frame.time_base
+        frame.pict_type = av.video.frame.PictureType.I if force_keyframe else av.video.frame.PictureType.NONE
+        packets = context.encode(frame)
+        for packet in packets:
+            packet.time_base = context.time_base
+        return packets
+
+    async def recv(self):
+        loop = asyncio.get_running_loop()
+        while not self._pending:
+            if self.readyState != "live":
+                raise MediaStreamError
+            self._pending_recv = asyncio.ensure_future(self._frames.recv())
+            try:
+                frame = await self._pending_recv
+            except asyncio.CancelledError:
+                if self.readyState != "live":
+                    raise MediaStreamError  # Ожидание прервал stop()
+                raise
+            finally:
+                self._pending_recv = None
+            force_keyframe = self._take_keyframe_request()
+            started = time.perf_counter()
+            packets = await loop.run_in_executor(self._executor, self._encode, frame, force_keyframe)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.encode_ms = elapsed_ms if self.encode_ms is None else \
+                self.encode_ms + SHARED_ENCODE_EWMA_ALPHA * (elapsed_ms - self.encode_ms)
+            self.frames_encoded += 1
+            for packet in packets:
+                self.bytes_encoded += packet.size
+                if packet.is_keyframe:
+                    self.keyframes += 1
+                    self._last_keyframe_at = time.monotonic()
+            self._pending.extend(packets)
+        return self._pending.popleft()
+
+    def stop(self):
+        super().stop()
+        # Прокси relay после stop() больше не получает кадры - прерываем ожидание
+        self._frames.stop()
+        if self._pending_recv is not None:
+            self._pending_recv.cancel()
+        self._executor.shutdown(wait=False)
+
+    def as_dict(self):
+        return {
+            "codec": self.params.codec,
+            "width": self.params.width,
+            "height": self.params.height,
+            "bitrate": self.params.bitrate,
+            "viewers": self.viewers,
+            "frames_encoded": self.frames_encoded,
+            "bytes_encoded": self.bytes_encoded,
+            "keyframes": self.keyframes,
+            "keyframe_requests": self.keyframe_requests,
+            "keyframe_requests_coalesced": self.keyframe_requests_coalesced,
+            "encode_ms": round(self.encode_ms, 2) if self.encode_ms is not None else None,
+        }
@@ -1,3 +1,57 @@
+// Бинарный формат сообщений платформы (platform_wire.py в шлюзе, прошивка ESP32):
+// кадры фиксированной длины little-endian [версия, тип, ...]
+const PLATFORM_WIRE = {
+    VERSION: 1,
+    DRIVE: 0x01,       // int8 left, int8 right, uint16 seq - 6 байт
+    GET_STATUS: 0x02,  // 2 байта
+    STATUS: 0x81,      // int8 motorL, int8 motorR, uint16 seq, uint8 flags, резерв - 8 байт
+    ERROR: 0x82,       // uint8 code, резерв - 4 байта
+    FLAG_FAILSAFE: 0x01,
+    FLAG_LINK_DOWN: 0x02,
+    ERRORS: { 0: "Error", 1: "Unsupported wire version", 2: "Invalid message length", 3: "Unknown message type" },
+};
+
+function encodePlatformWire(commandData, seq) {
+    if (commandData.command === "drive") {
+        const view = new DataView(new ArrayBuffer(6));
+        view.setUint8(0, PLATFORM_WIRE.VERSION);
+        view.setUint8(1, PLATFORM_WIRE.DRIVE);
+        view.setInt8(2, Math.max(-127, Math.min(127, commandData.payload.left)));
+        view.setInt8(3, Math.max(-127, Math.min(127, commandData.payload.right)));
+        view.setUint16(4, seq & 0xFFFF, true);
+        return view.buffer;
+    }
+    if (commandData.command === "get_status") {
+        return new Uint8Array([PLATFORM_WIRE.VERSION, PLATFORM_WIRE.GET_STATUS]).buffer;
+    }
+    return null; // Остальные команды идут JSON
+}
+
+// Сообщение в том же виде, что JSON протокол; null, если кадр не разбирается
+function decodePlatformWire(buffer) {
+    const view = new DataView(buffer);
+    if (view.byteLength < 2 || view.getUint8(0) !== PLATFORM_WIRE.VERSION) return null;
+    const type = view.getUint8(1);
+    if (type === PLATFORM_WIRE.STATUS && view.byteLength === 8) {
+        const flags = view.getUint8(6);
+        return {
+            type: 'status_update',
+            data: {
+                motorL: view.getInt8(2),
+                motorR: view.getInt8(3),
+                seq: view.getUint16(4, true),
+                failsafe: !!(flags & PLATFORM_WIRE.FLAG_FAILSAFE),
+                esp32Connected: !(flags & PLATFORM_WIRE.FLAG_LINK_DOWN),
+            }
+        };
+    }
+    if (type === PLATFORM_WIRE.ERROR && view.byteLength === 4) {
+        const code = view.getUint8(2);
+        return { type: 'error', code: code, message: PLATFORM_WIRE.ERRORS[code] || PLATFORM_WIRE.ERRORS[0] };
+    }
+    return null;
+}
+
 class PlatformController {
     constructor(config = {}) {
         this.config = {
@@ -8,13 +62,16 @@ class PlatformController {
             BRAKE_POWER: 6,
             STEERING_SPEED: 9,
             STEERING_RETURN_SPEED: 7,
-            UPDATE_INTERVAL_MS: 50, // Интервал отправки команд на ESP32
+            UPDATE_INTERVAL_MS: 50, // Интервал пересчета газа и руля (и отправки изменившейся команды)
+            KEEPALIVE_INTERVAL_MS: 200, // Повтор неизменной команды: шлюз останавливает платформу, если оператор молчит
             RECONNECT_INTERVAL_MS: 3000, // Интервал попыток переподключения
+            // 'binary' - бинарные кадры, если собеседник ответил на бинарный get_status, иначе JSON; 'json' - только JSON
+            WIRE_FORMAT: 'binary',
             ...(config.controlParams || {}) // Добавил проверку на undefined
         };
 
         this.wsConfig = {
-            wsUrl: config.wsUrl || '', // Например, ws://192.168.0.155/ws
+            wsUrl: config.wsUrl || '', // Шлюз ws://<host>:5001/ws/drive или ESP32 напрямую ws://192.168.0.155/ws
         };
 
         // Внутреннее состояние контроллера
@@ -33,6 +90,9 @@ class PlatformController {
 
         // Состояние коммуникации
         this.lastSentCommand = null;    // Последняя отправленная команда (объект)
+        this.lastSentAt = 0;            // Время ее отправки (мс, performance.now())
+        this.binaryWire = false;        // Собеседник ответил бинарным статусом - команды идут бинарными кадрами
+        this.wireSeq = 0;               // Номер бинарной команды drive
         this.lastReceivedData = null; // Данные из последнего 'status_update' от ESP32
         this.lastError = null;          // Ошибки WebSocket или от ESP32
 
@@ -64,6 +124,8 @@ class PlatformController {
 
         try {
             this.websocket = new WebSocket(this.wsConfig.wsUrl);
+            this.websocket.binaryType = 'arraybuffer';
+            this.binaryWire = false;
         } catch (error) {
             console.error("PlatformController: Ошибка конструктора WebSocket:", error);
             this.lastError = { message: `Ошибка подключения WebSocket: ${error.message}`, details: error, isNetworkError: true };
@@ -85,13 +147,25 @@ class PlatformController {
                 this.reconnectTimeoutId = null;
             }
             this._notifyConnectionStatusChange();
-            this.getESPStatus(); // Запрашиваем начальный статус после подключения
+            // Начальный статус запрашивать не нужно: и прошивка, и ретранслятор шлюза присылают его
+            // сами при подключении, а дальше - при каждом изменении
+            if (this.config.WIRE_FORMAT === 'binary') {
+                // Проба бинарного формата: старая прошивка кадр игнорирует, и соединение остается на JSON
+                this.websocket.send(encodePlatformWire({ command: "get_status" }));
+            }
         };
 
         this.websocket.onmessage = (event) => {
             // console.log("PlatformController: Получено сообщение WS:", event.data);
             try {
-                const message = JSON.parse(event.data);
+                let message;
+                if (event.data instanceof ArrayBuffer) {
+                    message = decodePlatformWire(event.data);
+                    if (!message) throw new Error(`неразборчивый бинарный кадр (${event.data.byteLength} байт)`);
+                    if (message.type === 'status_update') this.binaryWire = true;
+                } else {
+                    message = JSON.parse(event.data);
+                }
                 if (message.type === 'status_update' && message.data) {
                     this.lastReceivedData = message.data; // Например, { motorL: X, motorR: Y, lastCommand: "..." }
                 } else if (message.type === 'error' && message.message) {
@@ -166,9 +240,10 @@ class PlatformController {
             return false;
         }
         try {
-            const commandString = JSON.stringify(commandData);
-            this.websocket.send(commandString);
+            const frame = this.binaryWire ? encodePlatformWire(commandData, this.wireSeq = (this.wireSeq + 1) & 0xFFFF) : null;
+            this.websocket.send(frame || JSON.stringify(commandData));
             this.lastSentCommand = commandData; 
+            this.lastSentAt = performance.now();
             return true;
         } catch (error) {
             console.error("PlatformController: Ошибка отправки команды WebSocket:", error);
@@ -253,7 +328,11 @@ class PlatformController {
             }
         };
         
-        if (this.isConnected) { 
+        // Только изменения и редкий повтор для поддержки, а не команда на каждом тике
+        const last = this.lastSentCommand;
+        const changed = !last || last.command !== "drive" || last.payload.left !== command.payload.left ||
+            last.payload.right !== command.payload.right;
+        if (this.isConnected && (changed || performance.now() - this.lastSentAt >= this.config.KEEPALIVE_INTERVAL_MS)) {
             this._sendWebSocketCommand(command);
         }
         
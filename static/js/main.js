@@ -11,9 +11,26 @@ const PTZ_MOVE_TIME_MS = 0.4 * 1000; // Duration for continuous move before auto
 const CAMERA_PAN_SPEED_CONFIG = 0.5;
 const CAMERA_TILT_SPEED_CONFIG = 0.5;
 const CAMERA_ZOOM_SPEED_CONFIG = 0.5;
+// Короткий щелчок - один RelativeMove на шаг (одна команда, без Stop); удержание дольше порога - ContinuousMove
+const PTZ_HOLD_THRESHOLD_MS = 250;
+const CAMERA_PAN_STEP_CONFIG = 0.05;
+const CAMERA_TILT_STEP_CONFIG = 0.05;
+const CAMERA_ZOOM_STEP_CONFIG = 0.1;
 const BACKEND_BASE_URL = 'http://localhost:5000'; // URL вашего Flask бэкенда
+const SIGNALING_WS_URL = 'ws://localhost:5001/ws/signaling'; // WebSocket сигнализации WebRTC (WEBRTC_SIGNALING_PORT)
+// Поток телеметрии шлюза: позиции PTZ камер; ack=1 - вкладка подтверждает сообщения, и фоновой вкладке
+// шлюз шлет не очередь, а последнее состояние, когда она успевает его обработать
+const TELEMETRY_WS_URL = 'ws://localhost:5001/ws/telemetry?topics=ptz/&ack=1';
+const TELEMETRY_RECONNECT_MS = 3000;
 let ptzMoveTimeoutId = null;
+let ptzHoldTimeoutId = null;
+let ptzPressedVector = null; // Скорости нажатой кнопки, пока не ясно, щелчок это или удержание
 let isCurrentlyMovingPtz = false;
+let ptzPositionElem = null;
+
+// --- Телеметрия ---
+let telemetrySocket = null;
+let telemetryState = {}; // Последние значения тем телеметрии: { 'ptz/<IP камеры>': { pan, tilt, zoom, moving } }
 
 // --- Платформа ---
 let platformControllerInstance;
@@ -31,6 +48,8 @@ let toggleConfigButton, closeConfigButton, configPanelContainer;
 
 // --- WebRTC Глобальные переменные ---
 let pc = null; // RTCPeerConnection
+let signalingSocket = null; // WebSocket сигнализации (trickle ICE)
+let pendingLocalCandidates = null; // Кандидаты клиента до отправки offer
 let webRtcVideoElement = null; // Для WebRTC видео
 const RtcPeerConnectionConfig = {
     'iceServers': [
@@ -90,6 +109,7 @@ function updateCameraConfigValues() {
     RTSP_URL_CONFIG = rtspUrlInput.value;
     SELECTED_CAMERA_TYPE_NAME_CONFIG = cameraTypeSelect.value;
     IS_INVERT_UPDOWN_PTZ_CONFIG = invertUpDownCheckbox.checked;
+    updatePtzPositionDisplay();
     logger("Конфигурация камеры обновлена.");
 }
 
@@ -104,7 +124,7 @@ async function sendCameraPtzRequestToBackend(ptzAction, panSpeed = 0, tiltSpeed
         action: ptzAction
     };
 
-    if (ptzAction === 'move') {
+    if (ptzAction === 'move' || ptzAction === 'relative_move') {
         payload.pan = panSpeed;
         payload.tilt = tiltSpeed;
         payload.zoom = zoomSpeed;
@@ -118,7 +138,8 @@ async function sendCameraPtzRequestToBackend(ptzAction, panSpeed = 0, tiltSpeed
             body: JSON.stringify(payload)
         });
         const responseData = await response.json();
-        if (response.ok && responseData.status === 'success') {
+        // 'queued' - команда принята в очередь камеры, 'coalesced' - заменена более новой
+        if (response.ok && ['success', 'queued', 'coalesced'].includes(responseData.status)) {
             logger(`Камера: PTZ ${ptzAction} успешно: ${responseData.message}`, 'success');
         } else {
             logger(`Камера: Ошибка PTZ ${ptzAction}: ${responseData.message || `HTTP ${response.status}`}. Детали: ${responseData.details || ''}`, 'error');
@@ -140,17 +161,35 @@ async function cameraPtzContinuousMoveCommand(x, y, z) {
 
 function startCameraPtzMovement(x, y, z) {
     if (ptzMoveTimeoutId) clearTimeout(ptzMoveTimeoutId);
+    if (ptzHoldTimeoutId) clearTimeout(ptzHoldTimeoutId);
     isCurrentlyMovingPtz = true;
-    cameraPtzContinuousMoveCommand(x, y, z);
-    ptzMoveTimeoutId = setTimeout(() => {
-        if (isCurrentlyMovingPtz) {
-            cameraPtzStopCommand();
-            isCurrentlyMovingPtz = false;
-        }
-    }, PTZ_MOVE_TIME_MS);
+    ptzPressedVector = [x, y, z];
+    // Движение начинается, только если кнопку держат дольше порога; щелчок обработает stopCameraPtzMovement
+    ptzHoldTimeoutId = setTimeout(() => {
+        ptzHoldTimeoutId = null;
+        ptzPressedVector = null;
+        cameraPtzContinuousMoveCommand(x, y, z);
+        ptzMoveTimeoutId = setTimeout(() => {
+            if (isCurrentlyMovingPtz) {
+                cameraPtzStopCommand();
+                isCurrentlyMovingPtz = false;
+            }
+        }, PTZ_MOVE_TIME_MS);
+    }, PTZ_HOLD_THRESHOLD_MS);
 }
 
 function stopCameraPtzMovement() {
+    if (ptzHoldTimeoutId) {
+        // Отпущено до порога: один шаг RelativeMove в сторону нажатой кнопки
+        clearTimeout(ptzHoldTimeoutId);
+        ptzHoldTimeoutId = null;
+        const [x, y, z] = ptzPressedVector;
+        ptzPressedVector = null;
+        isCurrentlyMovingPtz = false;
+        sendCameraPtzRequestToBackend('relative_move',
+            Math.sign(x) * CAMERA_PAN_STEP_CONFIG, Math.sign(y) * CAMERA_TILT_STEP_CONFIG, Math.sign(z) * CAMERA_ZOOM_STEP_CONFIG);
+        return;
+    }
     if (ptzMoveTimeoutId) clearTimeout(ptzMoveTimeoutId);
     if (isCurrentlyMovingPtz) {
         cameraPtzStopCommand();
@@ -158,6 +197,49 @@ function stopCameraPtzMovement() {
     }
 }
 
+// --- Функции Телеметрии ---
+
+// Шлюз присылает сначала все темы, дальше только изменившиеся - позицию камеры не нужно опрашивать
+function connectTelemetry() {
+    try {
+        telemetrySocket = new WebSocket(TELEMETRY_WS_URL);
+    } catch (e) {
+        logger(`Телеметрия: ошибка подключения: ${e.message}`, 'error');
+        return;
+    }
+    telemetrySocket.onmessage = (event) => {
+        let message;
+        try {
+            message = JSON.parse(event.data);
+        } catch (e) {
+            return;
+        }
+        if (message.type !== 'telemetry') return;
+        if (message.full) telemetryState = {};
+        for (const [topic, value] of Object.entries(message.topics || {})) {
+            if (value === null) delete telemetryState[topic];
+            else telemetryState[topic] = value;
+        }
+        updatePtzPositionDisplay();
+        telemetrySocket.send(JSON.stringify({ type: 'ack', seq: message.seq }));
+    };
+    telemetrySocket.onclose = () => {
+        telemetrySocket = null;
+        setTimeout(connectTelemetry, TELEMETRY_RECONNECT_MS);
+    };
+}
+
+function updatePtzPositionDisplay() {
+    if (!ptzPositionElem) return;
+    const position = telemetryState[`ptz/${ONVIF_HOST_CONFIG}`];
+    if (!position) {
+        ptzPositionElem.textContent = 'N/A';
+        return;
+    }
+    const axis = (value) => (value === null || value === undefined) ? '-' : value.toFixed(2);
+    ptzPositionElem.textContent = `${axis(position.pan)} ${axis(position.tilt)} ${axis(position.zoom)}${position.moving ? ' (движется)' : ''}`;
+}
+
 // --- Функции для Управления Платформой ---
 
 // HUD-style notification 
@@ -179,6 +261,13 @@ function showPlatformNotification(message, type, duration = 3000) {
     }
 }
 
+// Поле настроек: полный ws:// URL (ретранслятор шлюза /ws/drive) или IP ESP32 для прямого подключения
+function platformWsUrl(value) {
+    const address = (value || '').trim();
+    if (!address) return '';
+    if (address.startsWith('ws://') || address.startsWith('wss://')) return address;
+    return `ws://${address}/ws`;
+}
 
 function updatePlatformUI(state) {
     // Throttle Bar
@@ -214,6 +303,10 @@ function updatePlatformUI(state) {
         if (state.lastError) {
             platformActualLeftElem.textContent = "Err";
             platformActualRightElem.textContent = "Err";
+        } else if (state.lastReceivedData && state.lastReceivedData.esp32Connected === false) {
+            // Шлюз на связи, а его соединение с ESP32 - нет
+            platformActualLeftElem.textContent = "Нет ESP32";
+            platformActualRightElem.textContent = "Нет ESP32";
         } else if (state.lastReceivedData && typeof state.lastReceivedData.motorL !== 'undefined') {
             platformActualLeftElem.textContent = state.lastReceivedData.motorL;
             platformActualRightElem.textContent = state.lastReceivedData.motorR;
@@ -273,11 +366,10 @@ function createPeerConnection() {
     pc.onicecandidate = event => {
         if (event.candidate) {
             logger("WebRTC: Новый ICE кандидат от клиента: " + event.candidate.candidate.substring(0, 30) + "...");
-            // TODO: Отправить event.candidate на сервер (например, через WebSocket)
-            // Пример: sendToServerViaWebSocket({ type: 'ice-candidate', payload: event.candidate.toJSON() });
-            console.log("КЛИЕНТ: Кандидат для отправки на сервер:", event.candidate.toJSON());
+            sendLocalCandidate({ type: 'candidate', candidate: event.candidate.toJSON() });
         } else {
             logger("WebRTC: Сбор ICE кандидатов от клиента завершен.");
+            sendLocalCandidate({ type: 'end-of-candidates' });
         }
     };
 
@@ -321,6 +413,87 @@ function createPeerConnection() {
     return pc;
 }
 
+// --- Сигнализация WebRTC по WebSocket ---
+function openSignalingSocket() {
+    return new Promise((resolve, reject) => {
+        const socket = new WebSocket(SIGNALING_WS_URL);
+        socket.onopen = () => resolve(socket);
+        socket.onerror = () => reject(new Error(`WebSocket сигнализации недоступен: ${SIGNALING_WS_URL}`));
+    });
+}
+
+function closeSignalingSocket() {
+    if (signalingSocket) {
+        signalingSocket.onclose = null;
+        try { signalingSocket.close(); } catch (e) { /* Игнор */ }
+        signalingSocket = null;
+    }
+    pendingLocalCandidates = null;
+}
+
+// Кандидат уходит на сервер сразу; до отправки offer копится в очереди
+function sendLocalCandidate(message) {
+    if (!signalingSocket) return; // HTTP /offer: кандидаты не передаются
+    if (pendingLocalCandidates) {
+        pendingLocalCandidates.push(message);
+    } else if (signalingSocket.readyState === WebSocket.OPEN) {
+        signalingSocket.send(JSON.stringify(message));
+    }
+}
+
+async function handleSignalingMessage(event) {
+    let message;
+    try {
+        message = JSON.parse(event.data);
+    } catch (e) {
+        logger("WebRTC: Некорректное сообщение сигнализации: " + event.data, "error");
+        return;
+    }
+    if (message.type === 'answer') {
+        hideLoader();
+        logger("WebRTC: Получен Answer от сервера.");
+        try {
+            await pc.setRemoteDescription(new RTCSessionDescription({ type: 'answer', sdp: message.sdp }));
+            logger("WebRTC: RemoteDescription (Answer) установлен.");
+        } catch (e) {
+            logger("WebRTC: Ошибка установки Answer: " + e, "error");
+        }
+    } else if (message.type === 'candidate') {
+        addIceCandidateFromServer(message.candidate);
+    } else if (message.type === 'motion') {
+        // Детектор движения сервера (MOTION_DETECTION): начало и конец движения на камере
+        if (message.state === 'start') {
+            logger(`Движение в кадре: ${(message.area * 100).toFixed(1)}% площади`, "warning");
+            showPlatformNotification("Обнаружено движение перед камерой", "warning");
+        } else {
+            logger("Движение в кадре закончилось.");
+        }
+    } else if (message.type === 'error') {
+        hideLoader();
+        logger("WebRTC: Ошибка сервера: " + message.message, "error");
+        showPlatformNotification("WebRTC: Ошибка старта: " + message.message, "error");
+    }
+}
+
+async function sendOfferOverHttp(offerParams) {
+    const response = await fetch(`${BACKEND_BASE_URL}/offer`, { // Используем BACKEND_BASE_URL
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(offerParams)
+    });
+    hideLoader(); // Скрываем лоадер
+
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`Ошибка сервера при отправке Offer: ${response.status} ${errorText}`);
+    }
+
+    const answer = await response.json();
+    logger("WebRTC: Получен Answer от сервера.");
+    await pc.setRemoteDescription(new RTCSessionDescription(answer));
+    logger("WebRTC: RemoteDescription (Answer) установлен.");
+}
+
 async function startWebRtcStream() {
     if (!webRtcVideoElement) {
         logger("WebRTC: HTML video элемент 'webRtcVideoElement' не найден.", "error");
@@ -337,6 +510,23 @@ async function startWebRtcStream() {
         logger("WebRTC: Закрытие предыдущего PeerConnection...");
         try { pc.close(); } catch (e) { /* Игнор */ }
     }
+    closeSignalingSocket();
+    showLoader(); // Показываем лоадер до получения Answer
+
+    // Trickle ICE по WebSocket; если он недоступен - обычный /offer
+    try {
+        signalingSocket = await openSignalingSocket();
+        pendingLocalCandidates = [];
+        signalingSocket.onmessage = handleSignalingMessage;
+        signalingSocket.onclose = () => {
+            logger("WebRTC: WebSocket сигнализации закрыт.");
+            signalingSocket = null;
+        };
+    } catch (e) {
+        logger(`WebRTC: ${e.message}, используем HTTP /offer.`, "warning");
+        signalingSocket = null;
+    }
+
     pc = createPeerConnection();
 
     pc.addTransceiver('video', { 'direction': 'recvonly' });
@@ -347,33 +537,27 @@ async function startWebRtcStream() {
         await pc.setLocalDescription(offer);
         logger("WebRTC: LocalDescription (Offer) установлен.");
 
-        logger("WebRTC: Отправка Offer на сервер...");
-        showLoader(); // Показываем лоадер на время запроса
-        const response = await fetch(`${BACKEND_BASE_URL}/offer`, { // Используем BACKEND_BASE_URL
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                sdp: offer.sdp,
-                type: offer.type,
-                // rtsp_url: RTSP_URL_CONFIG // Если сервер должен знать RTSP URL с клиента
-            })
-        });
-        hideLoader(); // Скрываем лоадер
-
-        if (!response.ok) {
-            const errorText = await response.text();
-            throw new Error(`Ошибка сервера при отправке Offer: ${response.status} ${errorText}`);
+        const offerParams = {
+            sdp: offer.sdp,
+            type: offer.type,
+            rtsp_url: RTSP_URL_CONFIG || undefined // Сервер откроет этот источник (или DEFAULT_RTSP_URL)
+        };
+        if (signalingSocket) {
+            // Offer уходит без ожидания сбора кандидатов, кандидаты следом по мере появления
+            logger("WebRTC: Отправка Offer через WebSocket...");
+            signalingSocket.send(JSON.stringify(offerParams));
+            const queued = pendingLocalCandidates || [];
+            pendingLocalCandidates = null;
+            queued.forEach(sendLocalCandidate);
+        } else {
+            logger("WebRTC: Отправка Offer на сервер...");
+            await sendOfferOverHttp(offerParams);
         }
-
-        const answer = await response.json();
-        logger("WebRTC: Получен Answer от сервера.");
-        await pc.setRemoteDescription(new RTCSessionDescription(answer));
-        logger("WebRTC: RemoteDescription (Answer) установлен.");
-
     } catch (e) {
         logger("WebRTC: Ошибка при старте стрима: " + e, "error");
         showPlatformNotification("WebRTC: Ошибка старта: " + e.message, "error");
         if (pc) { try { pc.close(); } catch (eClose) { /* Игнор */ } pc = null; }
+        closeSignalingSocket();
         hideLoader();
     }
 }
@@ -384,6 +568,7 @@ function stopWebRtcStream() {
         pc.close();
         pc = null;
     }
+    closeSignalingSocket();
     if (webRtcVideoElement) {
         webRtcVideoElement.srcObject = null;
         webRtcVideoElement.load(); // Сброс video элемента
@@ -391,7 +576,8 @@ function stopWebRtcStream() {
     showPlatformNotification("WebRTC: Видео остановлено", "info");
 }
 
-// TODO: Эта функция должна вызываться, когда сервер присылает ICE кандидат (например, через WebSocket)
+// Кандидат сервера из сигнализации. aiortc сейчас включает свои кандидаты в Answer,
+// но протокол допускает и отдельные сообщения 'candidate'.
 function addIceCandidateFromServer(candidateData) {
     if (pc) {
         const candidate = new RTCIceCandidate(candidateData);
@@ -435,6 +621,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Инициализация Камеры (элементы в Config Panel) ---
+    ptzPositionElem = document.getElementById('ptzPosition');
+    connectTelemetry();
     videoStreamImgElement = document.getElementById('videoStream'); // Для MJPEG
     webRtcVideoElement = document.getElementById('webRtcVideoStream'); // Для WebRTC
 
@@ -509,9 +697,8 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!platformIpInputElem || !platformThrottleBar || !platformSteeringBar || !platformHandbrakeButton || !platformActualLeftElem || !platformActualRightElem || !platformKeysPressedElem || !platformNotificationElem) {
          logger("КРИТИЧЕСКАЯ ОШИБКА: Не все HTML-элементы для управления платформой найдены!", "error");
     } else {
-        const initialPlatformIp = platformIpInputElem.value || "192.168.0.155";
         const platformConfig = {
-            wsUrl: initialPlatformIp ? `ws://${initialPlatformIp}/ws` : '',
+            wsUrl: platformWsUrl(platformIpInputElem.value),
             onUpdate: updatePlatformUI,
             onConnectionStatusChange: updatePlatformConnectionStatusDisplay,
         };
@@ -528,8 +715,7 @@ document.addEventListener('DOMContentLoaded', () => {
         
         platformIpInputElem.addEventListener('change', () => {
             if (platformControllerInstance) {
-                const newIp = platformIpInputElem.value;
-                const newWsUrl = newIp ? `ws://${newIp}/ws` : '';
+                const newWsUrl = platformWsUrl(platformIpInputElem.value);
                 platformControllerInstance.setWsUrl(newWsUrl);
                 logger(`Платформа: WebSocket URL установлен на: ${newWsUrl || '(пусто)'}`);
             }
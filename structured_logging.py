@@ -0,0 +1,178 @@
+"""
+Логирование шлюза и camera_simple.py: JSON строки, запись в фоновом потоке.
+
+Вызов logger.info() на пути запроса только создает запись, проверяет лимит
+частоты и кладет ее в ограниченную очередь - форматирование и запись в
+stderr/journald идут в потоке QueueListener. Если писатель не успевает и
+очередь полна, запись отбрасывается и учитывается, а запрос не ждет консоль.
+
+Повторяющиеся сообщения (PTZ запрос/ответ на каждое нажатие, проверки ICE
+пар aioice, строки доступа werkzeug) ограничиваются по месту вызова: не больше
+LOG_RATE_LIMIT записей за LOG_RATE_WINDOW секунд с одной строки кода. Первая
+запись после подавленных несет поле "suppressed" с их числом.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+LOG_LEVEL = "INFO"            # Уровень корневого логгера; "OFF" - логирование выключено
+LOG_JSON = True               # JSON строки; False - обычный текст "время уровень логгер: сообщение"
+LOG_QUEUE_SIZE = 10000        # Записей в очереди к писателю, сверх этого записи отбрасываются
+LOG_RATE_LIMIT = 20           # Записей с одного места вызова за окно
+LOG_RATE_WINDOW = 10.0        # Окно ограничения частоты (сек)
+# Уровни сторонних логгеров: aioice пишет каждую проверку ICE пары на INFO
+LOG_LIBRARY_LEVELS = {"aioice": "WARNING"}
+
+# Стандартные атрибуты LogRecord; остальное пришло через extra= и попадает в JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed"}
+
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна JSON строка: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Текстовый вариант для консоли разработчика; число подавленных записей дописывается в конец."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} подавлено)" if suppressed else text
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Не больше limit записей за window секунд с одного места вызова (файл и строка).
+    Вызывается в потоке, который пишет в лог, поэтому счетчики под блокировкой.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.suppressed_total = 0
+        self._sites = {}   # (pathname, lineno) -> [начало окна, записей в окне, подавлено]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [now, 0, 0]
+            elif now - site[0] >= self.window:
+                site[0], site[1] = now, 0
+            if site[1] >= self.limit:
+                site[2] += 1
+                self.suppressed_total += 1
+                return False
+            site[1] += 1
+            if site[2]:
+                record.suppressed, site[2] = site[2], 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не блокирует и не пишет трассировку при полной очереди,
+    а считает отброшенные записи. Сообщение собирается здесь (args могут быть
+    изменяемыми), JSON - уже в потоке писателя.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Запись больше никуда не передается, копия как в QueueHandler.prepare не нужна
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, json_output=LOG_JSON, stream=None):
+    """
+    Настраивает корневой логгер: очередь, фильтр частоты и писатель в отдельном
+    потоке. Повторный вызов заменяет прежнюю настройку.
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+    _queue_handler = None
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if str(level).upper() == "OFF":
+        logging.disable(logging.CRITICAL)
+        return
+    logging.disable(logging.NOTSET)
+    root.setLevel(level)
+    for name, library_level in LOG_LIBRARY_LEVELS.items():
+        logging.getLogger(name).setLevel(library_level)
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JsonFormatter() if json_output else TextFormatter())
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(RateLimitFilter())
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, writer)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Дописывает очередь и останавливает поток писателя."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats():
+    """Счетчики подавленных и отброшенных записей (для диагностики перегрузки лога)."""
+    if _queue_handler is None:
+        return {"suppressed": 0, "dropped": 0, "queued": 0}
+    suppressed = sum(f.suppressed_total for f in _queue_handler.filters if isinstance(f, RateLimitFilter))
+    return {"suppressed": suppressed, "dropped": _queue_handler.dropped, "queued": _queue_handler.queue.qsize()}
+
+
+atexit.register(shutdown_logging)
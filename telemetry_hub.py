@@ -0,0 +1,216 @@
+"""
+Телеметрия для UI: последнее состояние по темам и поток изменений подписчикам.
+
+Источники публикуют состояние в хаб один раз, сколько бы ни было зрителей:
+ретранслятор платформы - статус ESP32 (тема "platform"), опрос позиций PTZ -
+позицию камеры ("ptz/<камера>"). Хаб хранит последнее значение каждой темы;
+публикация того же значения ничего не рассылает.
+
+У каждого подписчика своя задача отправки. Публикация только отмечает тему
+изменившейся у подписчика и будит задачу, а задача забирает отмеченные темы и
+шлет одним сообщением их текущие значения (первое сообщение - все темы
+подписки). Пока отправка медленному клиенту висит на его сокете, новые
+публикации лишь перезаписывают значения: клиент получит самое свежее
+состояние, а не растущую очередь, и память на подписчика ограничена числом
+тем. Быстрые клиенты медленного не ждут - у каждого своя задача.
+
+Буферы сокета сами по себе давления почти не дают: ядро принимает в очередь
+отправки мегабайты, и до медленного клиента они дойдут с опозданием в десятки
+секунд. Поэтому клиент может подтверждать сообщения (ack_window): тогда
+неподтвержденных сообщений у него не больше TELEMETRY_ACK_WINDOW, а следующее
+уходит, только когда клиент обработал предыдущее, и несет самое свежее
+состояние. Клиент, который не подтверждает и не принимает данные
+TELEMETRY_SEND_TIMEOUT секунд, отключается.
+
+Сообщение подписчику:
+  {"type": "telemetry", "full": true|false, "seq": n, "topics": {тема: значение}}
+значение None - тема удалена. Подтверждение от клиента - ack(seq последнего
+обработанного сообщения).
+Используется только из background_loop.
+"""
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_MAX_RATE = 30.0       # Не больше сообщений в секунду одному подписчику; чаще - изменения сливаются.
+                                # Выше DRIVE_CONTROL_RATE, чтобы ответы ESP32 на команды не задерживались
+TELEMETRY_ACK_WINDOW = 2        # Неподтвержденных сообщений у клиента, который подтверждает (ack)
+TELEMETRY_SEND_TIMEOUT = 5.0    # Отправка или подтверждение дольше этого (сек) - клиент отключается
+
+_MISSING = object()
+
+
+class TelemetrySubscriber:
+    """
+    Подписчик хаба: send(message) - корутина отправки клиенту, prefixes - темы подписки
+    (None - все), ack_window - сколько сообщений клиент может не подтвердить (None - клиент
+    не подтверждает).
+    """
+
+    def __init__(self, subscriber_id, send, prefixes=None, client=None, ack_window=None):
+        self.id = subscriber_id
+        self.client = client
+        self.prefixes = tuple(prefixes) if prefixes else None
+        self.ack_window = ack_window
+        self.sent = 0           # Отправлено сообщений (seq последнего)
+        self.acked = 0          # seq последнего подтвержденного
+        self.conflated = 0      # Изменений, перезаписанных до отправки
+        self.created_at = time.monotonic()
+        self._send = send
+        self._dirty = set()
+        self._event = asyncio.Event()
+        self._acked = asyncio.Event()
+        self._task = None
+
+    def wants(self, topic):
+        return self.prefixes is None or topic.startswith(self.prefixes)
+
+    def _mark(self, topic):
+        if topic in self._dirty:
+            self.conflated += 1
+        else:
+            self._dirty.add(topic)
+        self._event.set()
+
+    def ack(self, seq):
+        if isinstance(seq, int) and self.acked < seq <= self.sent:
+            self.acked = seq
+            self._acked.set()
+
+    def _window_full(self):
+        return self.ack_window is not None and self.sent - self.acked >= self.ack_window
+
+    async def _wait_window(self):
+        while self._window_full():
+            self._acked.clear()
+            await self._acked.wait()
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+
+class TelemetryHub:
+    """Последние значения тем и подписчики с отправкой только изменений."""
+
+    def __init__(self, max_rate=TELEMETRY_MAX_RATE, send_timeout=TELEMETRY_SEND_TIMEOUT):
+        self.max_rate = max_rate
+        self.send_timeout = send_timeout
+        self.published = 0       # Публикаций, изменивших состояние
+        self.unchanged = 0       # Публикаций того же значения
+        self.messages_sent = 0
+        self.dropped = 0         # Подписчиков, отключенных по TELEMETRY_SEND_TIMEOUT
+        self._state = {}
+        self._updated_at = {}
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def get(self, topic, default=None):
+        return self._state.get(topic, default)
+
+    def publish(self, topic, value):
+        """Новое значение темы; True, если оно отличается от прежнего и разослано."""
+        if self._state.get(topic, _MISSING) == value:
+            self.unchanged += 1
+            return False
+        self._state[topic] = value
+        self._updated_at[topic] = time.monotonic()
+        self.published += 1
+        self._notify(topic)
+        return True
+
+    def remove(self, topic):
+        if self._state.pop(topic, _MISSING) is _MISSING:
+            return
+        self._updated_at.pop(topic, None)
+        self._notify(topic)
+
+    def _notify(self, topic):
+        for subscriber in self._subscribers.values():
+            if subscriber.wants(topic):
+                subscriber._mark(topic)
+
+    def subscribe(self, send, prefixes=None, client=None, ack_window=None):
+        subscriber = TelemetrySubscriber(next(self._ids), send, prefixes, client, ack_window)
+        for topic in self._state:
+            if subscriber.wants(topic):
+                subscriber._dirty.add(topic)
+        subscriber._event.set()
+        self._subscribers[subscriber.id] = subscriber
+        subscriber._task = asyncio.ensure_future(self._run(subscriber))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.pop(subscriber.id, None)
+        if subscriber._task is not None and subscriber._task is not asyncio.current_task():
+            subscriber._task.cancel()
+        subscriber._task = None
+
+    async def wait_closed(self, subscriber):
+        """Ждет конца отправки подписчику: клиент отключен по таймауту или ошибке отправки."""
+        if subscriber._task is not None:
+            await asyncio.gather(subscriber._task, return_exceptions=True)
+
+    async def _run(self, subscriber):
+        interval = 1.0 / self.max_rate
+        try:
+            while True:
+                await subscriber._event.wait()
+                try:
+                    # Пока клиент не подтвердил прежние сообщения, изменения копятся в _dirty
+                    await asyncio.wait_for(subscriber._wait_window(), self.send_timeout)
+                    subscriber._event.clear()
+                    topics, subscriber._dirty = subscriber._dirty, set()
+                    message = {
+                        "type": "telemetry",
+                        "full": subscriber.sent == 0,
+                        "seq": subscriber.sent + 1,
+                        "topics": {topic: self._state.get(topic) for topic in topics},
+                    }
+                    await asyncio.wait_for(subscriber._send(message), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self.dropped += 1
+                    logger.warning(f"Подписчик телеметрии {subscriber.client} не принимает данные "
+                                   f"{self.send_timeout} с, отключается")
+                    return
+                except Exception as e:
+                    logger.debug(f"Телеметрия подписчику {subscriber.client} не отправлена: {e}")
+                    return
+                subscriber.sent += 1
+                self.messages_sent += 1
+                # Изменения за время паузы уйдут одним следующим сообщением
+                await asyncio.sleep(interval)
+        finally:
+            self._subscribers.pop(subscriber.id, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "topics": {topic: {"value": value, "age": round(now - self._updated_at[topic], 3)}
+                       for topic, value in self._state.items()},
+            "published": self.published,
+            "unchanged": self.unchanged,
+            "messages_sent": self.messages_sent,
+            "dropped": self.dropped,
+            "subscribers": [{
+                "id": subscriber.id,
+                "client": subscriber.client,
+                "prefixes": list(subscriber.prefixes) if subscriber.prefixes else None,
+                "sent": subscriber.sent,
+                "acked": subscriber.acked if subscriber.ack_window is not None else None,
+                "conflated": subscriber.conflated,
+                "pending": subscriber.pending,
+                "age": round(now - subscriber.created_at, 3),
+            } for subscriber in list(self._subscribers.values())],
+        }
+
+    def close(self):
+        for subscriber in list(self._subscribers.values()):
+            self.unsubscribe(subscriber)
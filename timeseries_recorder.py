@@ -0,0 +1,281 @@
+"""
+Запись команд оператора и состояния ровера для разбора инцидентов.
+
+Записи фиксированной длины (RECORD_DTYPE, 32 байта) дописываются в сегменты -
+файлы, отображенные в память (mmap). Запись - один struct.pack_into в mmap и
+обновление счетчика в заголовке сегмента, без системных вызовов и без
+блокировок: страницы принадлежат файлу, ядро пишет их на диск само, и при
+падении процесса записанное не теряется. Сегмент создается сразу на
+RECORDER_SEGMENT_BYTES (разреженный файл: место занимают только записанные
+страницы); заполненный сегмент закрывается и начинается новый, а старые
+удаляются, когда все сегменты вместе больше RECORDER_MAX_BYTES.
+
+Поля записи общие для всех видов, смысл v0..v3 и code - по RecordKind:
+  PTZ_COMMAND   code - действие (PTZ_ACTION_CODES), v0..v2 - pan, tilt, zoom
+  PTZ_RESULT    code - действие, v0 - RTT (сек), v1 - HTTP статус (0 - ошибка, таймаут)
+  PTZ_POSITION  v0..v2 - pan, tilt, zoom; flags 1 - камера движется
+  DRIVE_INPUT   key - оператор, v0 left, v1 right
+  DRIVE_SENT    code - причина (DRIVE_REASON_CODES), v0 left, v1 right
+  DRIVE_STATUS  v0 motorL, v1 motorR; flags 1 - failsafe, 2 - ESP32 на связи
+  STREAM_STATS  key - сессия зрителя, v0 битрейт (бит/с), v1 fps, v2 RTT (сек), v3 доля потерь
+Отсутствующее или нечисловое значение - NaN. key - crc32 строки (камера, оператор, сессия);
+сами строки пишутся в keys.jsonl каталога при первом появлении.
+
+query() возвращает записи за интервал времени как структурированный массив
+NumPy. Запрос открывает сегменты сам, только для чтения, и не трогает
+состояние писателя, поэтому его можно выполнять из любого потока. Запись -
+только из background_loop.
+"""
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from enum import IntEnum
+
+import numpy as np # type: ignore
+
+from onvif_templates import PtzAction
+
+logger = logging.getLogger(__name__)
+
+RECORDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+RECORDER_SEGMENT_BYTES = 64 * 1024 * 1024   # Размер сегмента (2 млн записей)
+RECORDER_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Все сегменты вместе; сверх - удаляются самые старые
+
+RECORD_DTYPE = np.dtype([
+    ("t", "<f8"),        # time.time()
+    ("kind", "u1"),      # RecordKind
+    ("flags", "u1"),
+    ("code", "<u2"),
+    ("key", "<u4"),      # crc32 ключа
+    ("v0", "<f4"), ("v1", "<f4"), ("v2", "<f4"), ("v3", "<f4"),
+])
+_RECORD = struct.Struct("<dBBHIffff")
+assert _RECORD.size == RECORD_DTYPE.itemsize
+
+# Заголовок сегмента: сигнатура, версия, длина записи, емкость и число записей, время создания
+_HEADER = struct.Struct("<4sHHQQd")
+_COUNT = struct.Struct("<Q")
+_COUNT_OFFSET = 16
+HEADER_SIZE = 64
+SEGMENT_MAGIC = b"RPTS"
+SEGMENT_VERSION = 1
+
+NAN = float("nan")
+
+
+class RecordKind(IntEnum):
+    PTZ_COMMAND = 1
+    PTZ_RESULT = 2
+    PTZ_POSITION = 3
+    DRIVE_INPUT = 4
+    DRIVE_SENT = 5
+    DRIVE_STATUS = 6
+    STREAM_STATS = 7
+
+
+PTZ_ACTION_CODES = {action: code for code, action in enumerate(PtzAction, 1)}
+DRIVE_REASON_CODES = {"change": 1, "heartbeat": 2, "deadman": 3, "shutdown": 4}
+
+
+def key_id(key):
+    return zlib.crc32(str(key).encode("utf-8"))
+
+
+def _value(value):
+    return value if isinstance(value, (int, float)) else NAN
+
+
+class TimeSeriesRecorder:
+    """Сегменты в каталоге directory; enabled=False - record() ничего не делает."""
+
+    def __init__(self, directory=RECORDER_DIR, segment_bytes=RECORDER_SEGMENT_BYTES, max_bytes=RECORDER_MAX_BYTES, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        self.capacity = (segment_bytes - HEADER_SIZE) // _RECORD.size
+        self.max_bytes = max_bytes
+        self.records = 0
+        self.kind_counts = [0] * (max(RecordKind) + 1)
+        self.rotations = 0
+        self.errors = 0
+        self._mm = None
+        self._path = None
+        self._count = 0
+        self._key_ids = {}
+        self._keys_file = None
+
+    # --- Запись ---
+    def record(self, kind, key=None, code=0, v0=NAN, v1=NAN, v2=NAN, v3=NAN, flags=0):
+        if not self.enabled:
+            return
+        if self._mm is None or self._count >= self.capacity:
+            if not self._rotate():
+                return
+        ident = 0
+        if key is not None:
+            ident = self._key_ids.get(key)
+            if ident is None:
+                ident = self._register_key(key)
+        _RECORD.pack_into(self._mm, HEADER_SIZE + self._count * _RECORD.size,
+                          time.time(), kind, flags, code, ident, _value(v0), _value(v1), _value(v2), _value(v3))
+        self._count += 1
+        _COUNT.pack_into(self._mm, _COUNT_OFFSET, self._count)
+        self.records += 1
+        self.kind_counts[kind] += 1
+
+    def _register_key(self, key):
+        ident = self._key_ids[key] = key_id(key)
+        try:
+            self._keys_file.write(json.dumps({"key": ident, "name": str(key)}, ensure_ascii=False) + "\n")
+            self._keys_file.flush()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ключ записи {key} не сохранен: {e}")
+        return ident
+
+    def _rotate(self):
+        """Закрывает текущий сегмент и открывает новый; False - запись невозможна (ошибка диска)."""
+        try:
+            self._close_segment()
+            os.makedirs(self.directory, exist_ok=True)
+            if self._keys_file is None:
+                self._keys_file = open(os.path.join(self.directory, "keys.jsonl"), "a", encoding="utf-8")
+            path = os.path.join(self.directory, f"segment-{time.time_ns()}.rec")
+            size = HEADER_SIZE + self.capacity * _RECORD.size
+            with open(path, "w+b") as f:
+                f.truncate(size)
+                self._mm = mmap.mmap(f.fileno(), size)
+            _HEADER.pack_into(self._mm, 0, SEGMENT_MAGIC, SEGMENT_VERSION, _RECORD.size, self.capacity, 0, time.time())
+            self._path, self._count = path, 0
+            self.rotations += 1
+            self._enforce_retention()
+            return True
+        except OSError as e:
+            self.errors += 1
+            if self.errors == 1 or self.errors % 1000 == 0:
+                logger.error(f"Сегмент записи не открыт в {self.directory}: {e} (ошибок: {self.errors})")
+            return False
+
+    def _close_segment(self, flush=False):
+        # При ротации msync не нужен: грязные страницы ядро допишет само, а запись не ждет диска
+        if self._mm is None:
+            return
+        try:
+            if flush:
+                self._mm.flush()
+        finally:
+            self._mm.close()
+            self._mm = None
+
+    def _enforce_retention(self):
+        segments = self.segments()
+        total = sum(os.path.getsize(path) for path in segments)
+        for path in segments[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+            logger.info(f"Удален старый сегмент записи {os.path.basename(path)}")
+
+    def close(self):
+        """Сбрасывает сегмент на диск; записи после close() не пишутся."""
+        self.enabled = False
+        self._close_segment(flush=True)
+        if self._keys_file is not None:
+            self._keys_file.close()
+            self._keys_file = None
+
+    # --- Чтение ---
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, "segment-*.rec")))
+
+    def keys(self):
+        """{crc32: строка} всех ключей каталога."""
+        names = {}
+        try:
+            with open(os.path.join(self.directory, "keys.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        names[entry["key"]] = entry["name"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        return names
+
+    def query(self, start=None, end=None, kinds=None, key=None):
+        """
+        Записи с start <= t < end (time.time(), None - без границы) как массив RECORD_DTYPE
+        (копия, не зависит от файлов). kinds - RecordKind или их список, key - строка ключа.
+        """
+        kind_values = None if kinds is None else np.array(
+            [int(kinds)] if isinstance(kinds, (int, RecordKind)) else [int(k) for k in kinds], dtype=np.uint8)
+        ident = None if key is None else key_id(key)
+        parts = []
+        for path in self.segments():
+            records = _read_segment(path)
+            if records is None or not len(records):
+                continue
+            # Сегменты идут по времени создания: по первой и последней записи отбрасываются целиком
+            if (end is not None and records["t"][0] >= end) or (start is not None and records["t"][-1] < start):
+                continue
+            mask = np.ones(len(records), dtype=bool)
+            if start is not None:
+                mask &= records["t"] >= start
+            if end is not None:
+                mask &= records["t"] < end
+            if kind_values is not None:
+                mask &= np.isin(records["kind"], kind_values)
+            if ident is not None:
+                mask &= records["key"] == ident
+            parts.append(records[mask])   # Индексация маской копирует - файл можно закрыть
+            del records
+        return np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+
+    def snapshot(self):
+        segments = self.segments()
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "records": self.records,
+            "by_kind": {kind.name: self.kind_counts[kind] for kind in RecordKind},
+            "segment": os.path.basename(self._path) if self._mm is not None else None,
+            "segment_fill": round(self._count / self.capacity, 4) if self._mm is not None else None,
+            "segments": len(segments),
+            "disk_bytes": sum(_allocated_bytes(path) for path in segments),
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
+
+
+def _read_segment(path):
+    """Записи сегмента (представление над mmap только для чтения); None - сегмент не читается."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return None  # Удален ротацией между glob и open
+    if len(header) < _HEADER.size:
+        return None
+    magic, version, record_size, capacity, count, _ = _HEADER.unpack(header)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        logger.warning(f"Сегмент {path} другого формата, пропущен")
+        return None
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    try:
+        return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(min(count, capacity),))
+    except (OSError, ValueError):
+        return None
+
+
+def _allocated_bytes(path):
+    """Место сегмента на диске: файл разреженный, st_size - его емкость."""
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0